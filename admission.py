@@ -0,0 +1,217 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from telemetry import count_event
+
+# =========================
+# ADMISSION CONTROL
+# =========================
+# A question can cost up to ~6 LLM calls, so on busy days the endpoint's
+# rate limit is what everyone ends up waiting on. Questions are admitted
+# against two token buckets before they reach the pipeline:
+#
+#   global   LLM calls per minute for the whole process (the endpoint's
+#            budget); a question takes as many tokens as calls it will make
+#   session  questions per minute for one chat session / API client
+#
+# When the global bucket is empty, questions wait in a bounded priority
+# queue (cache-answerable questions first, then arrival order) and the
+# caller is told its position. Questions that would wait longer than
+# ADMISSION_MAX_WAIT_SECONDS, or find the queue full, are rejected at once
+# with a retry-after instead of timing out later.
+
+GLOBAL_LLM_CALLS_PER_MINUTE = float(os.getenv("ADMISSION_LLM_CALLS_PER_MINUTE", 240))
+GLOBAL_BURST = float(os.getenv("ADMISSION_LLM_BURST", 60))
+SESSION_QUESTIONS_PER_MINUTE = float(os.getenv("ADMISSION_SESSION_PER_MINUTE", 6))
+SESSION_BURST = float(os.getenv("ADMISSION_SESSION_BURST", 3))
+QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 50))
+MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", 60))
+SESSION_IDLE_SECONDS = 3600      # forget idle session buckets
+
+PRIORITY_CACHED = 0     # answerable from templates / cached rows
+PRIORITY_NORMAL = 1
+
+
+class AdmissionRejected(Exception):
+    """The question was not admitted; retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"{reason} (retry in {retry_after:.0f}s)")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """`rate` tokens per second up to `capacity`. Not thread-safe; callers hold a lock."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, n: float) -> bool:
+        self._refill()
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def seconds_until(self, n: float) -> float:
+        """Time until n tokens are available (n is capped at the capacity)."""
+        self._refill()
+        missing = min(n, self.capacity) - self.tokens
+        return max(missing, 0) / self.rate
+
+
+class Ticket:
+    """An admitted question; release() (or leaving the `with` block) ends it."""
+
+    def __init__(self, controller, waited: float):
+        self.controller = controller
+        self.waited = waited
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class AdmissionController:
+    def __init__(self, llm_calls_per_minute=GLOBAL_LLM_CALLS_PER_MINUTE, burst=GLOBAL_BURST,
+                 session_per_minute=SESSION_QUESTIONS_PER_MINUTE, session_burst=SESSION_BURST,
+                 queue_size=QUEUE_SIZE, max_wait=MAX_WAIT_SECONDS):
+        self.bucket = TokenBucket(llm_calls_per_minute / 60, burst)
+        self.session_rate = session_per_minute / 60
+        self.session_burst = session_burst
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self._sessions = {}         # session id -> TokenBucket
+        self._queue = []            # heap of (priority, seq, cost)
+        self._seq = itertools.count()
+        self._active = 0
+        self._cond = threading.Condition()
+
+    # ---- session buckets ----
+    def _session_bucket(self, session_id) -> TokenBucket:
+        bucket = self._sessions.get(session_id)
+        if bucket is None:
+            now = time.monotonic()
+            self._sessions = {
+                sid: b for sid, b in self._sessions.items() if now - b.updated < SESSION_IDLE_SECONDS
+            }
+            bucket = self._sessions[session_id] = TokenBucket(self.session_rate, self.session_burst)
+        return bucket
+
+    # ---- queue helpers (called with the lock held) ----
+    def _position(self, entry) -> int:
+        return sum(1 for queued in self._queue if queued < entry) + 1
+
+    def _estimated_wait(self, cost: float, ahead) -> float:
+        """Seconds until the bucket covers everything ahead plus this question."""
+        needed = sum(c for _, _, c in ahead) + cost
+        return max(needed - self.bucket.tokens, 0) / self.bucket.rate
+
+    def admit(self, session_id, cost: float, priority: int = PRIORITY_NORMAL, on_position=None) -> Ticket:
+        """
+        Block until the question may run and return its Ticket.
+        on_position(position, eta_seconds) is called whenever its queue
+        position changes. Raises AdmissionRejected instead of waiting past
+        max_wait.
+        """
+        started = time.monotonic()
+        cost = min(cost, self.bucket.capacity)
+        with self._cond:
+            session = self._session_bucket(session_id)
+            if not session.try_take(1):
+                count_event("admission.session_limited")
+                raise AdmissionRejected("too many questions from this session", session.seconds_until(1))
+
+            if not self._queue and self.bucket.try_take(cost):
+                count_event("admission.admitted")
+                self._active += 1
+                return Ticket(self, 0.0)
+
+            entry = (priority, next(self._seq), cost)
+            ahead = [queued for queued in self._queue if queued < entry]
+            eta = self._estimated_wait(cost, ahead)
+            if len(self._queue) >= self.queue_size or eta > self.max_wait:
+                session.tokens += 1     # the question never ran
+                count_event("admission.shed")
+                reason = "the assistant is very busy" if len(self._queue) >= self.queue_size else "the wait would be too long"
+                raise AdmissionRejected(reason, max(eta, 1.0))
+
+            heapq.heappush(self._queue, entry)
+            count_event("admission.queued")
+            last_position = None
+            try:
+                while True:
+                    position = self._position(entry)
+                    if position == 1 and self.bucket.try_take(cost):
+                        break
+                    waited = time.monotonic() - started
+                    if waited > self.max_wait:
+                        session.tokens += 1
+                        count_event("admission.wait_timeout")
+                        raise AdmissionRejected("the wait took too long", self.max_wait / 2)
+                    if position != last_position and on_position:
+                        eta = self._estimated_wait(cost, [q for q in self._queue if q < entry])
+                        self._cond.release()
+                        try:
+                            on_position(position, eta)
+                        finally:
+                            self._cond.acquire()
+                        last_position = position
+                        continue
+                    self._cond.wait(timeout=min(max(self.bucket.seconds_until(cost), 0.05), 1.0))
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+
+            count_event("admission.admitted")
+            self._active += 1
+            return Ticket(self, time.monotonic() - started)
+
+    def _release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def status(self) -> dict:
+        with self._cond:
+            self.bucket._refill()
+            return {
+                "active": self._active,
+                "queued": len(self._queue),
+                "llm_tokens": round(self.bucket.tokens, 1),
+                "sessions": len(self._sessions)
+            }
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission() -> AdmissionController:
+    """Process-wide controller shared by all sessions and API requests."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController()
+        return _controller
@@ -1,51 +1,23 @@
-import os
 import json
-import psycopg2
 import sqlglot
-from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-import sqlite3
+import sys
 from pathlib import Path
-# =========================
-# ENV
-# =========================
-load_dotenv()
 
+# Shared helpers live at the project root (also when run as a script)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from result_summary import summarize_result
+from sql_runner import run_query
+from query_guard import check_query_cost, QueryTooExpensive
+from llm_registry import invoke
+from sql_repair import repair_feedback
+from plan_schema import request_plan
+from fewshot_index import nearest_examples, format_plan_examples, format_sql_examples
 # =========================
-# AZURE OPENAI LLM FACTORY
+# LLM
 # =========================
-def load_llm():
-    """Azure OpenAI using ChatOpenAI with base_url"""
-
-    temperature = float(os.getenv("LLM_TEMPERATURE", 0.3))
-
-    azure_api_key = os.getenv("AZURE_OPENAI_API_KEY")
-    base_url = os.getenv("AZURE_OPENAI_ENDPOINT")
-    azure_model = os.getenv("AZURE_OPENAI_MODEL")
-
-    if not azure_api_key:
-        raise ValueError("AZURE_OPENAI_API_KEY not set")
-    if not base_url:
-        raise ValueError("AZURE_OPENAI_ENDPOINT not set")
-    if not azure_model:
-        raise ValueError("AZURE_OPENAI_MODEL not set")
-
-    print(f"🔧 Connecting to: {base_url}")
-    print(f"🔧 Using model: {azure_model}")
-
-    return ChatOpenAI(
-        api_key=azure_api_key,
-        base_url=base_url,
-        model=azure_model,
-        temperature=temperature,
-        streaming=False
-    )
-
-llm_client = load_llm()
-
-def llm(messages):
-    response = llm_client.invoke(messages)
-    return response.content
+# Shared, lazily created client (see llm_registry.py)
+def llm(messages, profile="default", **options):
+    return invoke(messages, profile, **options)
 
 # =========================
 # POSTGRES CONFIG
@@ -135,10 +107,83 @@ ALLOWED_COLUMNS = {
     "assembly_name", "assembly_incharge"
 }
 
+# =========================
+# ENTITIES
+# =========================
+# Canonical values users refer to by name (prompt lists, template cache)
+SCHEME_NAMES = [
+    "DIVYANG JAN SAMPARK",
+    "VADIL VANDANA",
+    "PMAY",
+    "MEDICAL SAHAY",
+    "CNG RIKSHA",
+    "GAS CONNECTION",
+    "IZZAT PASS",
+    "PM KISAN",
+    "SOLAR CHARKHA",
+    "LABHARTHI",
+    "PM SVANIDHI",
+    "SUKANYA YOJANA",
+    "AYUSHMAN BHARAT",
+    "LORRY DISTRIBUTION",
+    "SENIOR CITIZEN",
+    "UJJWALA YOJANA",
+    "VIDHWA SAHAY",
+    "PM-JAY (Pradhan Mantri Jan Arogya Yojana)",
+    "DIVYANG",
+    "TIRANGA"
+]
+SCHEME_LIST_TEXT = "\n".join(f"    - {name}" for name in SCHEME_NAMES)
+
+ENTITY_VALUES = {"scheme": SCHEME_NAMES}
+# Text columns of ENTITY_TABLE whose distinct values users name directly
+ENTITY_TABLE = "beneficiary_master"
+ENTITY_COLUMNS = {
+    "booth_name": "booth",
+    "ward_name": "ward",
+    "shaktikendra_name": "shaktikendra",
+    "assembly_name": "assembly",
+    "assembly_incharge": "incharge"
+}
+
+# =========================
+# FEW-SHOT SEEDS
+# =========================
+# Starting examples for the dynamic few-shot index (see fewshot_index.py);
+# verified questions are added to the index as they succeed.
+AGENT_KEY = "beneficiary"
+FEWSHOT_SEEDS = [
+    {
+        "question": "How many beneficiaries are there?",
+        "plan": {"table": "beneficiary_master", "filters": {}, "metrics": ["COUNT(*)"],
+                 "group_by": [], "order_by": [], "limit": None},
+        "sql": "SELECT COUNT(*) FROM beneficiary_master;"
+    },
+    {
+        "question": "Top 5 booths by beneficiary count",
+        "plan": {"table": "beneficiary_master", "filters": {}, "metrics": ["booth_name", "COUNT(*) as benf_count"],
+                 "group_by": ["booth_name"], "order_by": ["benf_count DESC"], "limit": 5},
+        "sql": "SELECT booth_name, COUNT(*) AS benf_count FROM beneficiary_master GROUP BY booth_name ORDER BY benf_count DESC LIMIT 5;"
+    },
+    {
+        "question": "Beneficiaries per booth",
+        "plan": {"table": "beneficiary_master", "filters": {}, "metrics": ["booth_name", "COUNT(*)"],
+                 "group_by": ["booth_name"], "order_by": [], "limit": None},
+        "sql": "SELECT booth_name, COUNT(*) FROM beneficiary_master GROUP BY booth_name;"
+    },
+    {
+        "question": "How many people have an ayushman card?",
+        "plan": {"table": "beneficiary_master", "filters": {"beneficiary_item_name": "AYUSHMAN BHARAT"}, "metrics": ["COUNT(*)"],
+                 "group_by": [], "order_by": [], "limit": None},
+        "sql": "SELECT COUNT(*) FROM beneficiary_master WHERE beneficiary_item_name LIKE '%AYUSHMAN BHARAT%' COLLATE NOCASE;"
+    }
+]
+
 # =========================
 # STEP 1: QUERY PLANNER
 # =========================
 def generate_plan(question: str) -> dict:
+    examples = nearest_examples(AGENT_KEY, question, FEWSHOT_SEEDS)
     system_prompt = f"""
     You are a PostgreSQL query planner for a beneficiary management system.
     - if the user asks about which assembly you are created for or what assembly data you have then you must need to answer that you are created for the assembly name 163-Limbayat every time.(very important)
@@ -148,26 +193,7 @@ def generate_plan(question: str) -> dict:
     {SCHEMA_TEXT}
 
     CANONICAL SCHEME NAMES (LOCKED — USE ONLY THESE):
-    - DIVYANG JAN SAMPARK
-    - VADIL VANDANA
-    - PMAY
-    - MEDICAL SAHAY
-    - CNG RIKSHA
-    - GAS CONNECTION
-    - IZZAT PASS
-    - PM KISAN
-    - SOLAR CHARKHA
-    - LABHARTHI
-    - PM SVANIDHI
-    - SUKANYA YOJANA
-    - AYUSHMAN BHARAT
-    - LORRY DISTRIBUTION
-    - SENIOR CITIZEN
-    - UJJWALA YOJANA
-    - VIDHWA SAHAY
-    - PM-JAY (Pradhan Mantri Jan Arogya Yojana)
-    - DIVYANG
-    - TIRANGA
+{SCHEME_LIST_TEXT}
 
     MANDATORY SCHEME RESOLUTION RULES:
     1. Users may mention scheme names in:
@@ -225,37 +251,20 @@ Output format:
   "limit": null
 }}
 Examples:
-Q: "How many beneficiaries are there?"
-{{
-  "table": "beneficiary_master",
-  "filters": {{}},
-  "metrics": ["COUNT(*)"],
-  "group_by": [],
-  "order_by": []
-}}
-
-Q: "Top 5 booths by beneficiary count"
-{{
-  "table": "beneficiary_master",
-  "filters": {{}},
-  "metrics": ["booth_name", "COUNT(*) as benf_count"],
-  "group_by": ["booth_name"],
-  "order_by": ["benf_count DESC"],
-  "limit": 5
-}}
+{format_plan_examples(examples)}
 """
 
-    content = llm([
+    # JSON mode + local repair + validation (see plan_schema.py)
+    return request_plan(llm, [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": question},
-    ])
-
-    return json.loads(content)
+    ], default_table="beneficiary_master")
 
 # =========================
 # STEP 2: SQL GENERATOR
 # =========================
-def generate_sql(plan: dict) -> str:
+def generate_sql(plan: dict, feedback=None) -> str:
+    examples = nearest_examples(AGENT_KEY, json.dumps(plan), FEWSHOT_SEEDS)
     system_prompt = f"""
 You generate SQLite SELECT queries for a beneficiary management system.
 
@@ -302,27 +311,19 @@ DATE RULES (STRICT):
   - Return a query-independent response:
     "There is no date column available in the schema to filter beneficiaries by entry date."
 
-COMMON QUERY PATTERNS:
-SELECT COUNT(*) FROM beneficiary_master;
-
-SELECT booth_name, COUNT(*) 
-FROM beneficiary_master 
-GROUP BY booth_name;
+Examples:
+{format_sql_examples(examples)}
 
 Return ONLY SQL.
-
-Example:
-SELECT booth_name, COUNT(*) AS benf_count
-FROM beneficiary_master
-GROUP BY booth_name
-ORDER BY benf_count DESC
-LIMIT 5;
 """
 
-    content = llm([
+    messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": json.dumps(plan)},
-    ])
+    ]
+    # Errors from earlier attempts at this question (see sql_repair.py)
+    messages += repair_feedback(feedback or [])
+    content = llm(messages, profile="sql")
 
     sql = content.strip()
 
@@ -361,23 +362,24 @@ def validate_sql(sql: str):
         if name not in ALLOWED_COLUMNS:
             raise ValueError(f"Invalid column: {name}")
 
+# =========================
+# STEP 3b: COST GUARD
+# =========================
+def guard_sql(sql: str):
+    """Raises QueryTooExpensive if EXPLAIN QUERY PLAN shows an over-budget plan."""
+    return check_query_cost(SQLITE_DB_PATH, sql)
+
 # =========================
 # STEP 4: EXECUTE SQL
 # =========================
-def run_sql(sql: str):
-    conn = sqlite3.connect(SQLITE_DB_PATH)
-    cur = conn.cursor()
-    cur.execute(sql)
-    rows = cur.fetchall()
-    columns = [d[0] for d in cur.description]
-    cur.close()
-    conn.close()
-    return columns, rows
+def run_sql(sql: str, max_rows: int = None):
+    """Returns (columns, rows, total); rows are capped at max_rows (SQL_MAX_ROWS by default)."""
+    return run_query(SQLITE_DB_PATH, sql, max_rows, agent=AGENT_KEY)
 
 # =========================
 # STEP 5: ANSWER GENERATOR
 # =========================
-def explain_answer(question, columns, rows):
+def explain_answer(question, columns, rows, total=None):
     prompt = f"""
 If the user question is like to which assembly you are created for or what assembly data you have then you must need to answer that you are created for the assembly name 163-Limbayat every time.(very important)
 - Not to mention about Mp and assembly in every answer just repond when the user explicity asks about it or the data you got related to that.
@@ -385,9 +387,7 @@ If the user question is like to which assembly you are created for or what assem
 Question:
 {question}
 
-Columns: {columns}
-Rows Returned: {len(rows)}
-Data: {rows[:50]}
+{summarize_result(columns, rows, total)}
 
 Instructions:
 - You are an consituency agent assistant who explains beneficiary data clearly and accurately.
@@ -407,7 +407,7 @@ Instructions:
     return llm([
         {"role": "system", "content": "You explain beneficiary data clearly and accurately."},
         {"role": "user", "content": prompt},
-    ])
+    ], profile="answer")
 
 # =========================
 # MAIN LOOP
@@ -435,8 +435,9 @@ def main():
             plan = generate_plan(question)
             sql = generate_sql(plan)
             validate_sql(sql)
-            columns, rows = run_sql(sql)
-            answer = explain_answer(question, columns, rows)
+            guard_sql(sql)
+            columns, rows, total = run_sql(sql)
+            answer = explain_answer(question, columns, rows, total)
 
             print("\n🧠 Query Plan:")
             # print(json.dumps(plan, indent=2))
@@ -444,11 +445,15 @@ def main():
             print("\n🧾 SQL:")
             print(sql)
 
-            print(f"\n📊 Rows returned: {len(rows)}")
+            print(f"\n📊 Rows returned: {total}")
             print("\n✅ Answer:")
             print(answer)
             print("\n" + "-" * 70)
 
+        except QueryTooExpensive as e:
+            print(f"⛔ {e}")
+            print(f"\n🔍 Query plan:\n{e.plan}")
+            print()
         except Exception as e:
             print(f"❌ Error: {e}")
             if 'sql' in locals():
@@ -457,4 +462,9 @@ def main():
             print()
 
 if __name__ == "__main__":
-    main()
+    # `--batch questions.txt [-o out.jsonl] [-c 4]` runs a question file (see batch_runner.py)
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        from batch_runner import main as run_batch
+        run_batch(sys.argv[2:], agent_key=AGENT_KEY)
+    else:
+        main()
@@ -0,0 +1,369 @@
+import json
+import sqlglot
+import sys
+from pathlib import Path
+
+# Shared helpers live at the project root (also when run as a script)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from result_summary import summarize_result
+from sql_runner import run_query
+from query_guard import check_query_cost, QueryTooExpensive
+from llm_registry import invoke
+from sql_repair import repair_feedback
+from plan_schema import request_plan, PlanError
+from fewshot_index import nearest_examples, format_plan_examples, format_sql_examples
+from cross_views import start_cross_view_refresher, FACT_TABLES
+# =========================
+# LLM
+# =========================
+# Shared, lazily created client (see llm_registry.py)
+def llm(messages, profile="default", **options):
+    return invoke(messages, profile, **options)
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+SQLITE_DB_PATH = BASE_DIR /"converted.db"
+
+
+# =========================
+# SCHEMA CONTRACT (LOCKED)
+# =========================
+# Precomputed joins of visitor_details, beneficiary_master and
+# constituency_hierarchy on the hierarchy IDs (see cross_views.py)
+SCHEMA_TEXT = """
+Table: booth_facts (one row per booth)
+
+Columns:
+- booth_mas_id INTEGER (booth master ID)
+- booth_no INTEGER (booth number)
+- booth_name TEXT (booth name, e.g., "2- Umrvada-2")
+- ward_mas_id INTEGER (ward master ID)
+- ward_id INTEGER (ward identifier)
+- ward_name TEXT (ward name)
+- shaktikendra_mas_id INTEGER (shakti kendra master ID)
+- shaktikendra_name TEXT (shakti kendra name)
+- ac_no INTEGER (assembly constituency number)
+- assembly_name TEXT (assembly name, e.g., "163-Limbayat")
+- visitor_count INTEGER (visitor entries from the booth)
+- unique_visitors INTEGER (distinct visitor contact numbers)
+- visitor_pending INTEGER (visitor entries with pending work)
+- visitor_complete INTEGER (visitor entries with completed work)
+- last_visit_date DATE (most recent visit date)
+- beneficiary_count INTEGER (beneficiaries in the booth)
+- scheme_count INTEGER (distinct schemes with beneficiaries in the booth)
+
+Table: booth_scheme_facts (one row per booth and scheme)
+
+Columns:
+- booth_mas_id INTEGER
+- booth_name TEXT
+- ward_mas_id INTEGER
+- shaktikendra_mas_id INTEGER
+- scheme_name TEXT (canonical scheme name, e.g., "AYUSHMAN BHARAT")
+- beneficiary_count INTEGER (beneficiaries of the scheme in the booth)
+
+Table: ward_facts (one row per ward)
+
+Columns:
+- ward_mas_id INTEGER
+- ward_id INTEGER
+- ward_name TEXT
+- assembly_name TEXT
+- booth_count INTEGER
+- shaktikendra_count INTEGER
+- visitor_count INTEGER
+- visitor_pending INTEGER
+- visitor_complete INTEGER
+- beneficiary_count INTEGER
+- scheme_count INTEGER
+- booths_with_visitors INTEGER
+- booths_with_beneficiaries INTEGER
+
+Key Information:
+- Booths without visitors or beneficiaries have counts of 0, not NULL
+- Shakti kendra totals: SUM over booth_facts grouped by shaktikendra_mas_id
+- Scheme-specific questions join booth_scheme_facts to booth_facts on booth_mas_id
+"""
+
+ALLOWED_TABLES = set(FACT_TABLES)
+
+ALLOWED_COLUMNS = {
+    "booth_mas_id", "booth_no", "booth_name", "ward_mas_id", "ward_id", "ward_name",
+    "shaktikendra_mas_id", "shaktikendra_name", "ac_no", "assembly_name",
+    "visitor_count", "unique_visitors", "visitor_pending", "visitor_complete",
+    "last_visit_date", "beneficiary_count", "scheme_count", "scheme_name",
+    "booth_count", "shaktikendra_count", "booths_with_visitors", "booths_with_beneficiaries"
+}
+
+# =========================
+# ENTITIES
+# =========================
+ENTITY_VALUES = {}
+# Text columns of ENTITY_TABLE whose distinct values users name directly
+ENTITY_TABLE = "booth_facts"  # one row per booth, so every name is loaded
+ENTITY_COLUMNS = {
+    "booth_name": "booth",
+    "ward_name": "ward",
+    "shaktikendra_name": "shaktikendra",
+    "assembly_name": "assembly"
+}
+
+# =========================
+# FEW-SHOT SEEDS
+# =========================
+# Starting examples for the dynamic few-shot index (see fewshot_index.py);
+# verified questions are added to the index as they succeed.
+AGENT_KEY = "cross"
+FEWSHOT_SEEDS = [
+    {
+        "question": "Visitors and beneficiaries per booth in ward 7",
+        "plan": {"table": "booth_facts", "filters": {"ward_id": 7},
+                 "metrics": ["booth_name", "visitor_count", "beneficiary_count"],
+                 "group_by": [], "order_by": ["visitor_count DESC"], "limit": None},
+        "sql": "SELECT booth_name, visitor_count, beneficiary_count FROM booth_facts WHERE ward_id = 7 ORDER BY visitor_count DESC;"
+    },
+    {
+        "question": "Which wards have many visitors but few beneficiaries?",
+        "plan": {"table": "ward_facts", "filters": {},
+                 "metrics": ["ward_name", "visitor_count", "beneficiary_count",
+                             "ROUND(beneficiary_count * 1.0 / NULLIF(visitor_count, 0), 2) AS beneficiaries_per_visitor"],
+                 "group_by": [], "order_by": ["beneficiaries_per_visitor ASC"], "limit": 10},
+        "sql": "SELECT ward_name, visitor_count, beneficiary_count, ROUND(beneficiary_count * 1.0 / NULLIF(visitor_count, 0), 2) AS beneficiaries_per_visitor FROM ward_facts WHERE visitor_count > 0 ORDER BY beneficiaries_per_visitor ASC LIMIT 10;"
+    },
+    {
+        "question": "Ayushman beneficiaries versus pending visitor work per booth",
+        "plan": {"table": "booth_scheme_facts", "filters": {"scheme_name": "AYUSHMAN BHARAT"},
+                 "metrics": ["booth_name", "beneficiary_count", "visitor_pending"],
+                 "group_by": [], "order_by": ["visitor_pending DESC"], "limit": None},
+        "sql": "SELECT f.booth_name, s.beneficiary_count, f.visitor_pending FROM booth_facts f JOIN booth_scheme_facts s ON s.booth_mas_id = f.booth_mas_id WHERE s.scheme_name LIKE '%AYUSHMAN BHARAT%' COLLATE NOCASE ORDER BY f.visitor_pending DESC;"
+    },
+    {
+        "question": "Booths with visitors but no beneficiaries",
+        "plan": {"table": "booth_facts", "filters": {"visitor_count": "> 0", "beneficiary_count": 0},
+                 "metrics": ["booth_name", "ward_name", "visitor_count"],
+                 "group_by": [], "order_by": ["visitor_count DESC"], "limit": None},
+        "sql": "SELECT booth_name, ward_name, visitor_count FROM booth_facts WHERE visitor_count > 0 AND beneficiary_count = 0 ORDER BY visitor_count DESC;"
+    }
+]
+
+# =========================
+# STEP 1: QUERY PLANNER
+# =========================
+def generate_plan(question: str) -> dict:
+    examples = nearest_examples(AGENT_KEY, question, FEWSHOT_SEEDS)
+    system_prompt = f"""
+You are a SQLite query planner for questions that compare visitor, beneficiary
+and constituency hierarchy data at booth, shakti kendra or ward level.
+Schema:
+{SCHEMA_TEXT}
+
+Rules:
+Hierarchy is first assembly then ward then shaktikendra then booth.(very important)
+- Use ONLY the schema above
+- Prefer ward_facts for ward-level questions and booth_facts for booth or shakti kendra level
+- Use booth_scheme_facts only when a specific scheme is mentioned
+- Do NOT write SQL
+- Return ONLY valid JSON
+- No explanations
+
+Output format:
+{{
+  "table": "booth_facts",
+  "filters": {{}},
+  "metrics": [],
+  "group_by": [],
+  "order_by": [],
+  "limit": null
+}}
+
+Examples:
+{format_plan_examples(examples)}
+"""
+
+    # JSON mode + local repair + validation (see plan_schema.py)
+    return request_plan(llm, [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": question},
+    ], default_table="booth_facts")
+
+# =========================
+# STEP 2: SQL GENERATOR
+# =========================
+def generate_sql(plan: dict, feedback=None) -> str:
+    examples = nearest_examples(AGENT_KEY, json.dumps(plan), FEWSHOT_SEEDS)
+    system_prompt = f"""
+You generate SQLite SELECT queries over precomputed booth and ward fact tables.
+
+Schema:
+{SCHEMA_TEXT}
+
+Rules:
+- Use ONLY the tables and columns in the schema
+- No SELECT *
+- Read-only queries only
+- Return ONLY valid SQL with semicolon at the end
+- Do NOT include markdown formatting
+- Do NOT include explanations
+- Use LIKE ... COLLATE NOCASE for text comparisons
+- Ratios: multiply by 1.0 and divide by NULLIF(denominator, 0)
+- Join booth_scheme_facts to booth_facts on booth_mas_id
+
+Examples:
+{format_sql_examples(examples)}
+"""
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": json.dumps(plan)},
+    ]
+    # Errors from earlier attempts at this question (see sql_repair.py)
+    messages += repair_feedback(feedback or [])
+    content = llm(messages, profile="sql")
+
+    sql = content.strip()
+    if "```sql" in sql:
+        sql = sql.split("```sql")[1].split("```")[0].strip()
+    elif "```" in sql:
+        sql = sql.split("```")[1].split("```")[0].strip()
+
+    if not sql.endswith(";"):
+        sql += ";"
+
+    return sql
+
+# =========================
+# STEP 3: SQL VALIDATION
+# =========================
+def validate_sql(sql: str):
+    """Cross-domain mode: SELECTs over the fact tables only, never the source tables."""
+    try:
+        parsed = sqlglot.parse_one(sql, dialect="sqlite")
+    except Exception as e:
+        raise ValueError(f"SQL parsing failed: {str(e)}\nSQL: {sql}")
+
+    if not isinstance(parsed, sqlglot.exp.Select) and not parsed.find(sqlglot.exp.Select):
+        raise ValueError("Only SELECT queries are allowed")
+    if parsed.find(sqlglot.exp.Delete) or parsed.find(sqlglot.exp.Update) or parsed.find(sqlglot.exp.Insert):
+        raise ValueError("Only SELECT queries are allowed")
+
+    for table in parsed.find_all(sqlglot.exp.Table):
+        if table.name not in ALLOWED_TABLES:
+            raise ValueError(f"Invalid table: {table.name}")
+
+    aliases = set()
+    for alias in parsed.find_all(sqlglot.exp.Alias):
+        if alias.alias:
+            aliases.add(alias.alias.lower())
+
+    for col in parsed.find_all(sqlglot.exp.Column):
+        name = col.name
+        if name == "*":
+            continue
+        if name.lower() in aliases:
+            continue
+        if name not in ALLOWED_COLUMNS:
+            raise ValueError(f"Invalid column: {name}")
+
+# =========================
+# STEP 3b: COST GUARD
+# =========================
+def guard_sql(sql: str):
+    """Raises QueryTooExpensive if EXPLAIN QUERY PLAN shows an over-budget plan."""
+    # Fact tables are kept fresh in the background; this only starts that once
+    start_cross_view_refresher()
+    return check_query_cost(SQLITE_DB_PATH, sql)
+
+# =========================
+# STEP 4: EXECUTE SQL
+# =========================
+def run_sql(sql: str, max_rows: int = None):
+    """Returns (columns, rows, total); rows are capped at max_rows (SQL_MAX_ROWS by default)."""
+    start_cross_view_refresher()
+    return run_query(SQLITE_DB_PATH, sql, max_rows, agent=AGENT_KEY)
+
+# =========================
+# STEP 5: ANSWER GENERATOR
+# =========================
+def explain_answer(question, columns, rows, total=None):
+    prompt = f"""
+Question:
+{question}
+
+Query Results:
+{summarize_result(columns, rows, total)}
+
+Instructions:
+- You are an consituency agent assistant who compares visitor and beneficiary data across booths, shakti kendras and wards.
+- please provide answer to the user like an assistant and not just read the data and tell.
+- please dont mention what you got and dont tell user like you got this data and columns like that and just say what is there in that efficiently to user like a human.(important)
+- Always give answer in well structured way with clear sections
+- If the answer involves multiple points, use bullet points or numbered lists
+- Point out notable gaps (e.g., many visitors but few beneficiaries)
+- Use the actual data from the results
+- If there are many rows, summarize the key insights
+- Do NOT invent or assume data not in the results
+(important)RULE: Always return a well-structured, concise answer based on the data, without mentioning the underlying columns or data structure to the user.
+"""
+
+    return llm([
+        {"role": "system", "content": "You explain combined visitor and beneficiary data clearly and accurately."},
+        {"role": "user", "content": prompt},
+    ], profile="answer")
+
+# =========================
+# MAIN LOOP
+# =========================
+def main():
+    start_cross_view_refresher()
+    print("✅ Cross-Domain SQL Agent (SQLite)")
+    print("📊 Tables: booth_facts, booth_scheme_facts, ward_facts")
+    print("💡 Compare visitors and beneficiaries per booth, shakti kendra or ward")
+    print("Type 'exit' to quit\n")
+
+    print("Example questions:")
+    print("  - Visitors and beneficiaries per booth in ward 7")
+    print("  - Which wards have many visitors but few beneficiaries?")
+    print("  - Booths with visitors but no beneficiaries")
+    print()
+
+    while True:
+        question = input("❓ Ask a question: ").strip()
+        if question.lower() == "exit":
+            break
+
+        try:
+            plan = generate_plan(question)
+            sql = generate_sql(plan)
+            validate_sql(sql)
+            guard_sql(sql)
+            columns, rows, total = run_sql(sql)
+            answer = explain_answer(question, columns, rows, total)
+
+            print("\n🧾 SQL:")
+            print(sql)
+
+            print(f"\n📊 Rows returned: {total}")
+            print("\n✅ Answer:")
+            print(answer)
+            print("\n" + "-" * 70)
+
+        except PlanError as e:
+            print(f"❌ JSON Parse Error: {str(e)}")
+            print()
+        except QueryTooExpensive as e:
+            print(f"⛔ {e}")
+            print(f"\n🔍 Query plan:\n{e.plan}")
+            print()
+        except Exception as e:
+            print(f"❌ Error: {e}")
+            if 'sql' in locals():
+                print("\nGenerated SQL:")
+                print(sql)
+            print()
+
+if __name__ == "__main__":
+    # `--batch questions.txt [-o out.jsonl] [-c 4]` runs a question file (see batch_runner.py)
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        from batch_runner import main as run_batch
+        run_batch(sys.argv[2:], agent_key=AGENT_KEY)
+    else:
+        main()
@@ -1,51 +1,23 @@
-import os
 import json
-import psycopg2
 import sqlglot
-from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-import sqlite3
+import sys
 from pathlib import Path
-# =========================
-# ENV
-# =========================
-load_dotenv()
 
+# Shared helpers live at the project root (also when run as a script)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from result_summary import summarize_result
+from sql_runner import run_query
+from query_guard import check_query_cost, QueryTooExpensive
+from llm_registry import invoke
+from sql_repair import repair_feedback
+from plan_schema import request_plan
+from fewshot_index import nearest_examples, format_plan_examples, format_sql_examples
 # =========================
-# AZURE OPENAI LLM FACTORY
+# LLM
 # =========================
-def load_llm():
-    """Azure OpenAI using ChatOpenAI with base_url (same as your working script)"""
-
-    temperature = float(os.getenv("LLM_TEMPERATURE", 0.3))
-
-    azure_api_key = os.getenv("AZURE_OPENAI_API_KEY")
-    base_url = os.getenv("AZURE_OPENAI_ENDPOINT")  # Full URL with /openai/v1/
-    azure_model = os.getenv("AZURE_OPENAI_MODEL")  # Deployment name
-
-    if not azure_api_key:
-        raise ValueError("AZURE_OPENAI_API_KEY not set")
-    if not base_url:
-        raise ValueError("AZURE_OPENAI_ENDPOINT not set")
-    if not azure_model:
-        raise ValueError("AZURE_OPENAI_MODEL (deployment name) not set")
-
-    print(f"🔧 Connecting to: {base_url}")
-    print(f"🔧 Using model/deployment: {azure_model}")
-
-    # Use ChatOpenAI with base_url (same pattern as your working script)
-    return ChatOpenAI(
-        api_key=azure_api_key,
-        base_url=base_url,  # ✅ This accepts the full URL including /openai/v1/
-        model=azure_model,
-        temperature=temperature,
-        streaming=False
-    )
-
-llm_client = load_llm()
-def llm(messages):
-    response = llm_client.invoke(messages)
-    return response.content
+# Shared, lazily created client (see llm_registry.py)
+def llm(messages, profile="default", **options):
+    return invoke(messages, profile, **options)
 
 # =========================
 # POSTGRES CONFIG
@@ -94,10 +66,78 @@ ALLOWED_COLUMNS = {
     "assembly_name", "assembly_incharge"
 }
 
+# =========================
+# ENTITIES
+# =========================
+# Canonical values users refer to by name (prompt lists, template cache)
+ASSEMBLY_NAMES = [
+    "175-Navsari",
+    "163-Limbayat",
+    "165-Majura",
+    "164-Udhna",
+    "176-Gandevi",
+    "168-Choryasi",
+    "174-Jalalpur"
+]
+INCHARGE_NAMES = [
+    "RAKESH DESAI",
+    "HARSHBHAI SANGHVI",
+    "R.C. PATEL",
+    "NARESHBHAI MANGABHAI PATEL",
+    "SANDIP DESAI",
+    "MANUBHAI PATEL",
+    "Sangitaben Rajendrakumar Patil"
+]
+ASSEMBLY_LIST_TEXT = "\n".join(f"- {name}" for name in ASSEMBLY_NAMES)
+INCHARGE_LIST_TEXT = "\n".join(f"- {name}" for name in INCHARGE_NAMES)
+
+ENTITY_VALUES = {"assembly": ASSEMBLY_NAMES, "incharge": INCHARGE_NAMES}
+# Text columns of ENTITY_TABLE whose distinct values users name directly
+ENTITY_TABLE = "constituency_hierarchy"
+ENTITY_COLUMNS = {
+    "booth_name": "booth",
+    "ward_name": "ward",
+    "shaktikendra_name": "shaktikendra"
+}
+
+# =========================
+# FEW-SHOT SEEDS
+# =========================
+# Starting examples for the dynamic few-shot index (see fewshot_index.py);
+# verified questions are added to the index as they succeed.
+AGENT_KEY = "hierarchy"
+FEWSHOT_SEEDS = [
+    {
+        "question": "Top 5 assemblies by booth count",
+        "plan": {"table": "constituency_hierarchy", "filters": {}, "metrics": ["assembly_name", "COUNT(booth_no) as booth_count"],
+                 "group_by": ["assembly_name"], "order_by": ["booth_count DESC"], "limit": 5},
+        "sql": "SELECT assembly_name, COUNT(booth_no) AS booth_count FROM constituency_hierarchy GROUP BY assembly_name ORDER BY booth_count DESC LIMIT 5;"
+    },
+    {
+        "question": "How many booths are in Limbayat?",
+        "plan": {"table": "constituency_hierarchy", "filters": {"assembly_name": "163-Limbayat"}, "metrics": ["COUNT(booth_no)"],
+                 "group_by": [], "order_by": [], "limit": None},
+        "sql": "SELECT COUNT(booth_no) FROM constituency_hierarchy WHERE LOWER(assembly_name) LIKE LOWER('%163-Limbayat%');"
+    },
+    {
+        "question": "How many wards is patil madam incharge of?",
+        "plan": {"table": "constituency_hierarchy", "filters": {"assembly_incharge": "Sangitaben Rajendrakumar Patil"}, "metrics": ["COUNT(DISTINCT ward_id)"],
+                 "group_by": [], "order_by": [], "limit": None},
+        "sql": "SELECT COUNT(DISTINCT ward_id) FROM constituency_hierarchy WHERE LOWER(assembly_incharge) LIKE LOWER('%Sangitaben Rajendrakumar Patil%');"
+    },
+    {
+        "question": "List the shakti kendras in ward 5",
+        "plan": {"table": "constituency_hierarchy", "filters": {"ward_id": 5}, "metrics": ["shaktikendra_name", "ward_name"],
+                 "group_by": ["shaktikendra_name", "ward_name"], "order_by": [], "limit": None},
+        "sql": "SELECT shaktikendra_name, ward_name FROM constituency_hierarchy WHERE ward_id = 5 GROUP BY shaktikendra_name, ward_name;"
+    }
+]
+
 # =========================
 # STEP 1: QUERY PLANNER
 # =========================
 def generate_plan(question: str) -> dict:
+    examples = nearest_examples(AGENT_KEY, question, FEWSHOT_SEEDS)
     system_prompt = f"""
 You are a PostgreSQL query planner for a constituency hierarchy system.
 
@@ -105,13 +145,7 @@ Schema:
 {SCHEMA_TEXT}
 If the user asks about shakti kendras always write a query plan to return shakti kendras name and their details from constituency_hierarchy table.
 CANONICAL ASSEMBLY NAMES (LOCKED — USE ONLY THESE):
-- 175-Navsari
-- 163-Limbayat
-- 165-Majura
-- 164-Udhna
-- 176-Gandevi
-- 168-Choryasi
-- 174-Jalalpur
+{ASSEMBLY_LIST_TEXT}
 
 MANDATORY ASSEMBLY NAME RESOLUTION RULES:
 1. Users may refer to assembly names using:
@@ -199,13 +233,7 @@ Rules:
 
 
 CANONICAL ASSEMBLY INCHARGE NAMES (LOCKED — USE ONLY THESE):
-- RAKESH DESAI
-- HARSHBHAI SANGHVI
-- R.C. PATEL
-- NARESHBHAI MANGABHAI PATEL
-- SANDIP DESAI
-- MANUBHAI PATEL
-- Sangitaben Rajendrakumar Patil
+{INCHARGE_LIST_TEXT}
 
 IMPORTANT NAME NORMALIZATION RULE:
 - If the user mentions a FIRST NAME + MIDDLE NAME combination
@@ -301,19 +329,22 @@ Output format:
   "group_by": [],
   "order_by": []
 }}
+
+Examples:
+{format_plan_examples(examples)}
 """
 
-    content = llm([
+    # JSON mode + local repair + validation (see plan_schema.py)
+    return request_plan(llm, [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": question},
-    ])
-
-    return json.loads(content)
+    ], default_table="constituency_hierarchy")
 
 # =========================
 # STEP 2: SQL GENERATOR
 # =========================
-def generate_sql(plan: dict) -> str:
+def generate_sql(plan: dict, feedback=None) -> str:
+    examples = nearest_examples(AGENT_KEY, json.dumps(plan), FEWSHOT_SEEDS)
     system_prompt = f"""
 You generate SQLite SELECT queries.
 
@@ -377,18 +408,17 @@ OTHER RULES:
 - No subqueries unless necessary
 - Use LIMIT when returning ranked results
 
-Example format:
-SELECT assembly_name, COUNT(booth_no) AS booth_count
-FROM hierarchy_master
-GROUP BY assembly_name
-ORDER BY booth_count DESC
-LIMIT 5;
+Examples:
+{format_sql_examples(examples)}
 """
 
-    content = llm([
+    messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": json.dumps(plan)},
-    ])
+    ]
+    # Errors from earlier attempts at this question (see sql_repair.py)
+    messages += repair_feedback(feedback or [])
+    content = llm(messages, profile="sql")
 
     # Clean up the response
     sql = content.strip()
@@ -435,33 +465,31 @@ def validate_sql(sql: str):
         if col.name not in ALLOWED_COLUMNS:
             raise ValueError(f"Invalid column: {col.name}")
 
+# =========================
+# STEP 3b: COST GUARD
+# =========================
+def guard_sql(sql: str):
+    """Raises QueryTooExpensive if EXPLAIN QUERY PLAN shows an over-budget plan."""
+    return check_query_cost(SQLITE_DB_PATH, sql)
+
 # =========================
 # STEP 4: EXECUTE SQL
 # =========================
-def run_sql(sql: str):
+def run_sql(sql: str, max_rows: int = None):
+    """Returns (columns, rows, total); rows are capped at max_rows (SQL_MAX_ROWS by default)."""
     # conn = psycopg2.connect(**DB_CONFIG)
-    conn = sqlite3.connect(SQLITE_DB_PATH)
-    cur = conn.cursor()
-    cur.execute(sql)
-    rows = cur.fetchall()
-    columns = [desc[0] for desc in cur.description]
-    cur.close()
-    conn.close()
-    return columns, rows
+    return run_query(SQLITE_DB_PATH, sql, max_rows, agent=AGENT_KEY)
 
 # =========================
 # STEP 5: ANSWER GENERATOR
 # =========================
-def explain_answer(question, columns, rows):
+def explain_answer(question, columns, rows, total=None):
     prompt = f"""
 Question:
 {question}
 
-Columns:
-{columns}
-
-Rows:
-{rows}
+Query Results:
+{summarize_result(columns, rows, total)}
 
 Explain the result clearly.
 If the user mention under which MP these assemblies or whose is the Mp of these booths or wards or shakthi kendras then you must need to return "C.R PATIL" not Rc patil(critical)
@@ -481,7 +509,7 @@ Do NOT invent or assume data.
     return llm([
         {"role": "system", "content": "You explain SQL query results clearly."},
         {"role": "user", "content": prompt},
-    ])
+    ], profile="answer")
 
 # =========================
 # MAIN LOOP
@@ -504,12 +532,13 @@ def main():
             
             print("\n🔄 Validating SQL...")
             validate_sql(sql)
+            guard_sql(sql)
             
             print("\n🔄 Executing query...")
-            columns, rows = run_sql(sql)
+            columns, rows, total = run_sql(sql)
             
             print("\n🔄 Generating answer...")
-            answer = explain_answer(question, columns, rows)
+            answer = explain_answer(question, columns, rows, total)
 
             print("\n🧠 Query Plan:")
             print(json.dumps(plan, indent=2))
@@ -517,13 +546,17 @@ def main():
             print("\n🧾 SQL:")
             print(sql)
 
-            print(f"\n📊 Rows returned: {len(rows)}")
+            print(f"\n📊 Rows returned: {total}")
 
             print("\n✅ Answer:")
             print(answer)
 
             print("\n" + "-" * 70)
 
+        except QueryTooExpensive as e:
+            print(f"⛔ {e}")
+            print(f"\n🔍 Query plan:\n{e.plan}")
+            print()
         except Exception as e:
             print(f"❌ Error: {str(e)}")
             if 'sql' in locals():
@@ -531,4 +564,9 @@ def main():
             print()
 
 if __name__ == "__main__":
-    main()
+    # `--batch questions.txt [-o out.jsonl] [-c 4]` runs a question file (see batch_runner.py)
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        from batch_runner import main as run_batch
+        run_batch(sys.argv[2:], agent_key=AGENT_KEY)
+    else:
+        main()
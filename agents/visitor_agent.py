@@ -1,50 +1,23 @@
-import os
 import json
-import psycopg2
 import sqlglot
-from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-import sqlite3
+import sys
 from pathlib import Path
-# =========================
-# ENV
-# =========================
-load_dotenv()
 
+# Shared helpers live at the project root (also when run as a script)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from result_summary import summarize_result
+from sql_runner import run_query
+from query_guard import check_query_cost, QueryTooExpensive
+from llm_registry import invoke
+from sql_repair import repair_feedback
+from plan_schema import request_plan, PlanError
+from fewshot_index import nearest_examples, format_plan_examples, format_sql_examples
 # =========================
-# AZURE OPENAI LLM FACTORY
+# LLM
 # =========================
-def load_llm():
-    """Azure OpenAI using ChatOpenAI with base_url"""
-
-    temperature = float(os.getenv("LLM_TEMPERATURE", 0.3))
-
-    azure_api_key = os.getenv("AZURE_OPENAI_API_KEY")
-    base_url = os.getenv("AZURE_OPENAI_ENDPOINT")  # Full URL with /openai/v1/
-    azure_model = os.getenv("AZURE_OPENAI_MODEL")  # Deployment name
-
-    if not azure_api_key:
-        raise ValueError("AZURE_OPENAI_API_KEY not set")
-    if not base_url:
-        raise ValueError("AZURE_OPENAI_ENDPOINT not set")
-    if not azure_model:
-        raise ValueError("AZURE_OPENAI_MODEL (deployment name) not set")
-
-    print(f"🔧 Connecting to: {base_url}")
-    print(f"🔧 Using model/deployment: {azure_model}")
-
-    return ChatOpenAI(
-        api_key=azure_api_key,
-        base_url=base_url,
-        model=azure_model,
-        temperature=temperature,
-        streaming=False
-    )
-
-llm_client = load_llm()
-def llm(messages):
-    response = llm_client.invoke(messages)
-    return response.content
+# Shared, lazily created client (see llm_registry.py)
+def llm(messages, profile="default", **options):
+    return invoke(messages, profile, **options)
 
 # =========================
 # POSTGRES CONFIG
@@ -155,10 +128,69 @@ ALLOWED_COLUMNS = {
     "assembly_incharge"
 }
 
+# =========================
+# ENTITIES
+# =========================
+ENTITY_VALUES = {}
+# Text columns of ENTITY_TABLE whose distinct values users name directly
+ENTITY_TABLE = "visitor_details"
+ENTITY_COLUMNS = {
+    "booth_name": "booth",
+    "shaktikendra_name": "shaktikendra",
+    "assembly_name": "assembly",
+    "reason_category": "reason"
+}
+
+# =========================
+# FEW-SHOT SEEDS
+# =========================
+# Starting examples for the dynamic few-shot index (see fewshot_index.py);
+# verified questions are added to the index as they succeed.
+AGENT_KEY = "visitor"
+FEWSHOT_SEEDS = [
+    {
+        "question": "How many visitors came last month?",
+        "plan": {"table": "visitor_details", "filters": {"vis_date_clean": "last_month"}, "metrics": ["COUNT(*)"],
+                 "group_by": [], "order_by": [], "limit": None},
+        "sql": "SELECT COUNT(*) FROM visitor_details WHERE vis_date_clean >= DATE('now', 'start of month', '-1 month') AND vis_date_clean < DATE('now', 'start of month');"
+    },
+    {
+        "question": "Show top 5 booths by visitor count",
+        "plan": {"table": "visitor_details", "filters": {}, "metrics": ["booth_name", "COUNT(*) as visitor_count"],
+                 "group_by": ["booth_name"], "order_by": ["visitor_count DESC"], "limit": 5},
+        "sql": "SELECT booth_name, COUNT(*) AS visitor_count FROM visitor_details GROUP BY booth_name ORDER BY visitor_count DESC LIMIT 5;"
+    },
+    {
+        "question": "Which booths have the most completed work?",
+        "plan": {"table": "visitor_details", "filters": {"vis_work_status": "Complete"}, "metrics": ["booth_name", "COUNT(*) as visitor_count"],
+                 "group_by": ["booth_name"], "order_by": ["visitor_count DESC"], "limit": 10},
+        "sql": "SELECT booth_name, COUNT(*) AS visitor_count FROM visitor_details WHERE vis_work_status = 'Complete' GROUP BY booth_name ORDER BY visitor_count DESC LIMIT 10;"
+    },
+    {
+        "question": "How many visitors came in 2024?",
+        "plan": {"table": "visitor_details", "filters": {"vis_date_clean": "2024"}, "metrics": ["COUNT(*)"],
+                 "group_by": [], "order_by": [], "limit": None},
+        "sql": "SELECT COUNT(*) FROM visitor_details WHERE vis_date_clean BETWEEN '2024-01-01' AND '2024-12-31';"
+    },
+    {
+        "question": "How many unique visitors are from AC 163?",
+        "plan": {"table": "visitor_details", "filters": {"ac_no": 163}, "metrics": ["COUNT(DISTINCT vis_contact_no)"],
+                 "group_by": [], "order_by": [], "limit": None},
+        "sql": "SELECT COUNT(DISTINCT vis_contact_no) FROM visitor_details WHERE ac_no = 163;"
+    },
+    {
+        "question": "Show the latest visitors",
+        "plan": {"table": "visitor_details", "filters": {}, "metrics": ["vis_name", "vis_added_datetime"],
+                 "group_by": [], "order_by": ["vis_added_datetime DESC"], "limit": 10},
+        "sql": "SELECT vis_name, vis_added_datetime FROM visitor_details ORDER BY vis_added_datetime DESC LIMIT 10;"
+    }
+]
+
 # =========================
 # STEP 1: QUERY PLANNER
 # =========================
 def generate_plan(question: str) -> dict:
+    examples = nearest_examples(AGENT_KEY, question, FEWSHOT_SEEDS)
     system_prompt = f"""
 You are a PostgreSQL query planner for a visitor management system.
 when the user asks about how many unique visitors came then you must and should need to provide plan based on unique mobile numbers(VIS_CONTACT_NO) count instead of total count of rows.(very important)
@@ -194,37 +226,20 @@ Output format:
 }}
 
 Examples:
-Q: "How many visitors came last month?"
-{{
-  "table": "visitor_details",
-  "filters": {{"vis_date_clean": "last_month"}},
-  "metrics": ["COUNT(*)"],
-  "group_by": [],
-  "order_by": []
-}}
-
-Q: "Show top 5 booths by visitor count"
-{{
-  "table": "visitor_details",
-  "filters": {{}},
-  "metrics": ["booth_name", "COUNT(*) as visitor_count"],
-  "group_by": ["booth_name"],
-  "order_by": ["visitor_count DESC"],
-  "limit": 5
-}}
+{format_plan_examples(examples)}
 """
 
-    content = llm([
+    # JSON mode + local repair + validation (see plan_schema.py)
+    return request_plan(llm, [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": question},
-    ])
-
-    return json.loads(content)
+    ], default_table="visitor_details")
 
 # =========================
 # STEP 2: SQL GENERATOR
 # =========================
-def generate_sql(plan: dict) -> str:
+def generate_sql(plan: dict, feedback=None) -> str:
+    examples = nearest_examples(AGENT_KEY, json.dumps(plan), FEWSHOT_SEEDS)
     system_prompt = f"""
 You generate SQLite SELECT queries for a visitor management system.
 
@@ -245,31 +260,21 @@ LOWER(booth_name) LIKE LOWER('%text%')
 - Handle NULL values appropriately
 - Use LOWER(column) LIKE LOWER('%text%') for case-insensitive search
 - Instead of mass id you must need to take id columns for filtering and grouping
-
-Common patterns:
-- Count visitors: SELECT COUNT(*) FROM visitor_details
-- Group by booth: GROUP BY booth_name
-- Filter by status: WHERE vis_work_status = 'Complete'
-- Filter by date: WHERE vis_date_clean BETWEEN '2024-01-01' AND '2024-12-31'
-- Filter by AC: WHERE ac_no = 163
-- Recent visitors: ORDER BY vis_added_datetime DESC
 - When extracting year from date, use:
   STRFTIME('%Y', column_name)
 - Use WHERE column_name IS NOT NULL before grouping by date
 
-Example format:
-SELECT booth_name, COUNT(*) as visitor_count 
-FROM visitor_details 
-WHERE vis_work_status = 'Complete' 
-GROUP BY booth_name 
-ORDER BY visitor_count DESC 
-LIMIT 10;
+Examples:
+{format_sql_examples(examples)}
 """
 
-    content = llm([
+    messages = [
         {"role": "system", "content": system_prompt},
         {"role": "user", "content": json.dumps(plan)},
-    ])
+    ]
+    # Errors from earlier attempts at this question (see sql_repair.py)
+    messages += repair_feedback(feedback or [])
+    content = llm(messages, profile="sql")
 
     # Clean up the response
     sql = content.strip()
@@ -349,32 +354,31 @@ def validate_sql(sql: str):
         if col_name not in ALLOWED_COLUMNS:
             raise ValueError(f"Invalid column: {col_name}")
 
+# =========================
+# STEP 3b: COST GUARD
+# =========================
+def guard_sql(sql: str):
+    """Raises QueryTooExpensive if EXPLAIN QUERY PLAN shows an over-budget plan."""
+    return check_query_cost(SQLITE_DB_PATH, sql)
+
 # =========================
 # STEP 4: EXECUTE SQL
 # =========================
-def run_sql(sql: str):
+def run_sql(sql: str, max_rows: int = None):
+    """Returns (columns, rows, total); rows are capped at max_rows (SQL_MAX_ROWS by default)."""
     # conn = psycopg2.connect(**DB_CONFIG)
-    conn = sqlite3.connect(SQLITE_DB_PATH)
-    cur = conn.cursor()
-    cur.execute(sql)
-    rows = cur.fetchall()
-    columns = [desc[0] for desc in cur.description]
-    cur.close()
-    conn.close()
-    return columns, rows
+    return run_query(SQLITE_DB_PATH, sql, max_rows, agent=AGENT_KEY)
 
 # =========================
 # STEP 5: ANSWER GENERATOR
 # =========================
-def explain_answer(question, columns, rows):
+def explain_answer(question, columns, rows, total=None):
     prompt = f"""
 Question:
 {question}
 
 Query Results:
-Columns: {columns}
-Number of rows: {len(rows)}
-Data: {rows[:50] if len(rows) > 50 else rows}  
+{summarize_result(columns, rows, total)}
 
 Instructions:
 - If the user query is about Reasons or reasons categories then you must need to provide answer based on REASON_CATEGORY column in the data but dont display to user like you got this from reason category column. please avoid mentioning reason category with brackets and capital letters it is make weird look to user.
@@ -403,7 +407,7 @@ Example formats:
     return llm([
         {"role": "system", "content": "You explain SQL query results clearly and concisely for visitor management data."},
         {"role": "user", "content": prompt},
-    ])
+    ], profile="answer")
 
 # =========================
 # MAIN LOOP
@@ -437,12 +441,13 @@ def main():
             
             print("\n🔄 Validating SQL...")
             validate_sql(sql)
+            guard_sql(sql)
             
             print("\n🔄 Executing query...")
-            columns, rows = run_sql(sql)
+            columns, rows, total = run_sql(sql)
             
             print("\n🔄 Generating answer...")
-            answer = explain_answer(question, columns, rows)
+            answer = explain_answer(question, columns, rows, total)
 
             print("\n🧠 Query Plan:")
             print(json.dumps(plan, indent=2))
@@ -450,17 +455,21 @@ def main():
             print("\n🧾 SQL:")
             print(sql)
 
-            print(f"\n📊 Rows returned: {len(rows)}")
+            print(f"\n📊 Rows returned: {total}")
 
             print("\n✅ Answer:")
             print(answer)
 
             print("\n" + "-" * 70)
 
-        except json.JSONDecodeError as e:
+        except (json.JSONDecodeError, PlanError) as e:
             print(f"❌ JSON Parse Error: {str(e)}")
             print("The LLM returned invalid JSON. Please try rephrasing your question.")
             print()
+        except QueryTooExpensive as e:
+            print(f"⛔ {e}")
+            print(f"\n🔍 Query plan:\n{e.plan}")
+            print()
         except Exception as e:
             print(f"❌ Error: {str(e)}")
             if 'sql' in locals():
@@ -468,4 +477,9 @@ def main():
             print()
 
 if __name__ == "__main__":
-    main()
+    # `--batch questions.txt [-o out.jsonl] [-c 4]` runs a question file (see batch_runner.py)
+    if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        from batch_runner import main as run_batch
+        run_batch(sys.argv[2:], agent_key=AGENT_KEY)
+    else:
+        main()
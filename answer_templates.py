@@ -0,0 +1,226 @@
+import re
+from decimal import Decimal
+
+# =========================
+# DETERMINISTIC ANSWER TEMPLATES
+# =========================
+# Simple result shapes (one COUNT(*) cell, a single record, a short ranked
+# list or a small distribution) don't need an LLM to be explained. These
+# templates render them locally; anything wider or longer still goes to
+# the agent's explain_answer.
+
+MAX_SINGLE_ROW_COLUMNS = 6
+MAX_LIST_ROWS = 10
+MAX_DISTRIBUTION_ROWS = 15
+
+# Results that need the domain rules written in the explain_answer prompts
+# (reason category merging, MP naming, assembly disclaimer) go to the LLM.
+LLM_ONLY_COLUMNS = {"reason_category"}
+LLM_ONLY_QUESTION = re.compile(
+    r"\b(mp|m\.p\.|reason|reasons|created for|why|explain|compare|trend|insight)\b",
+    re.IGNORECASE
+)
+RANKED_QUESTION = re.compile(r"\b(top|highest|lowest|most|least|best|worst|rank|bottom)\b", re.IGNORECASE)
+
+SUBJECTS = {
+    "visitor": {"English": "visitors", "हिन्दी": "विज़िटर"},
+    "beneficiary": {"English": "beneficiaries", "हिन्दी": "लाभार्थी"},
+    "hierarchy": {"English": "records", "हिन्दी": "रिकॉर्ड"},
+}
+
+HINDI_WORDS = {
+    "booth": "बूथ", "booths": "बूथ", "ward": "वार्ड", "wards": "वार्ड",
+    "assembly": "विधानसभा", "assemblies": "विधानसभा", "shaktikendra": "शक्ति केंद्र",
+    "visitor": "विज़िटर", "visitors": "विज़िटर", "beneficiary": "लाभार्थी",
+    "beneficiaries": "लाभार्थी", "count": "संख्या", "total": "कुल", "name": "नाम",
+    "scheme": "योजना", "item": "योजना", "status": "स्थिति", "work": "कार्य",
+    "category": "श्रेणी", "incharge": "प्रभारी", "gender": "लिंग", "age": "आयु",
+    "caste": "जाति", "village": "गाँव", "date": "तारीख", "priority": "प्राथमिकता",
+    "unique": "यूनिक", "average": "औसत", "number": "संख्या", "no": "संख्या",
+}
+
+TEXT = {
+    "English": {
+        "empty": "I couldn't find any matching {subject} for this question.",
+        "count": "There are **{value}** {label}.",
+        "scalar": "The {label} is **{value}**.",
+        "record": "Here are the details:",
+        "ranked": "Here are the {label} ranked by {measure}:",
+        "distribution": "Here is the breakdown of {measure} by {label}:",
+        "total": "**Total:** {value}",
+        "table": "I couldn't write a full summary right now, but here is what I found ({shown} of {total} rows):",
+    },
+    "हिन्दी": {
+        "empty": "इस प्रश्न के लिए कोई मिलते-जुलते {subject} नहीं मिले।",
+        "count": "कुल **{value}** {label} हैं।",
+        "scalar": "{label} **{value}** है।",
+        "record": "विवरण इस प्रकार है:",
+        "ranked": "{measure} के अनुसार {label} की सूची:",
+        "distribution": "{label} के अनुसार {measure} का विवरण:",
+        "total": "**कुल:** {value}",
+        "table": "अभी पूरा सारांश नहीं बन सका, लेकिन यह परिणाम मिले ({total} में से {shown} पंक्तियाँ):",
+    },
+}
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+
+def _fmt(value) -> str:
+    if value is None:
+        return "—"
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        return f"{value:,}"
+    if isinstance(value, (float, Decimal)):
+        value = float(value)
+        return f"{int(value):,}" if value.is_integer() else f"{value:,.2f}"
+    return str(value).strip()
+
+
+AGGREGATES = {"avg": "average", "sum": "total", "min": "minimum", "max": "maximum"}
+
+
+def _humanize(column: str, lang: str) -> str:
+    """visitor_count -> 'visitor count', AVG(vis_age) -> 'average age'."""
+    col = column.strip().lower()
+    call = re.match(r"(\w+)\s*\((?:distinct\s+)?([\w*]*)\)", col)
+    if call:
+        func, inner = call.groups()
+        col = f"{AGGREGATES.get(func, func)}_{inner}" if inner != "*" else func
+    words = [w for w in re.split(r"[_\s]+", col) if w and w not in ("vis", "benf", "mas", "clean")]
+    if not words:
+        return column
+    if lang == "हिन्दी":
+        return " ".join(HINDI_WORDS.get(w, w) for w in words)
+    return " ".join(words)
+
+
+def _count_label(column: str, subject: str, lang: str) -> str:
+    """Noun for a count column: COUNT(*) -> subject, booth_count -> booths."""
+    col = column.lower()
+    if col.startswith("count(") or col in ("count", "total", "total_count", "cnt"):
+        return subject
+    stripped = re.sub(r"(^|_)(count|total|cnt|num|number|of)(_|$)", " ", col).strip(" _")
+    if not stripped:
+        return subject
+    label = _humanize(stripped, lang)
+    if lang == "English" and not label.endswith("s"):
+        label += "s"
+    return label
+
+
+def _entity_label(column: str, lang: str) -> str:
+    """Plural noun for a label column: booth_name -> booths."""
+    words = [w for w in re.split(r"[_\s]+", column.lower()) if w not in ("name", "id", "no", "mas")]
+    label = _humanize("_".join(words) or column, lang)
+    if lang == "English" and not label.endswith("s"):
+        label += "s"
+    return label
+
+
+def _column_tokens(column: str):
+    return [t for t in re.split(r"[^a-z0-9]+", column.lower()) if t]
+
+
+def _is_count_column(column: str) -> bool:
+    """Whole-word match: visit_count, total_visits, num_schemes (not discount, booth_num)."""
+    tokens = _column_tokens(column)
+    return bool({"count", "counts", "total", "cnt"} & set(tokens)) or tokens[:1] == ["num"]
+
+
+def _is_id_column(column: str) -> bool:
+    """booth_id, ward_no, booth_number, booth_mas_id_hier: identifiers, not measures."""
+    tokens = _column_tokens(column)
+    return "id" in tokens or tokens[-1:] in (["no"], ["number"])
+
+
+def render_answer(question: str, columns, rows, agent_key: str = None, lang: str = "English"):
+    """
+    Render the final answer for simple result shapes without an LLM call.
+    Returns None for complex or wide results so the caller can fall back to
+    the agent's explain_answer.
+    """
+    if lang not in TEXT:
+        lang = "English"
+    if not columns or rows is None:
+        return None
+    if {c.lower() for c in columns} & LLM_ONLY_COLUMNS:
+        return None
+    if LLM_ONLY_QUESTION.search(question or ""):
+        return None
+
+    text = TEXT[lang]
+    subject = SUBJECTS.get(agent_key, SUBJECTS["hierarchy"])[lang]
+
+    # ---- empty result ----
+    if len(rows) == 0:
+        return text["empty"].format(subject=subject)
+
+    # ---- scalar (e.g. COUNT(*)) ----
+    if len(rows) == 1 and len(columns) == 1:
+        value = rows[0][0]
+        column = columns[0]
+        if _is_number(value) and _is_count_column(column):
+            return text["count"].format(value=_fmt(value), label=_count_label(column, subject, lang))
+        return text["scalar"].format(value=_fmt(value), label=_humanize(column, lang))
+
+    # ---- single row ----
+    if len(rows) == 1:
+        if len(columns) > MAX_SINGLE_ROW_COLUMNS:
+            return None
+        lines = [text["record"], ""]
+        for column, value in zip(columns, rows[0]):
+            lines.append(f"- **{_humanize(column, lang).capitalize()}:** {_fmt(value)}")
+        return "\n".join(lines)
+
+    # ---- label + number: ranked list or distribution ----
+    if len(columns) != 2 or _is_id_column(columns[1]):
+        return None
+    if not all(_is_number(r[1]) or r[1] is None for r in rows):
+        return None
+
+    label = _entity_label(columns[0], lang)
+    if _is_count_column(columns[1]):
+        measure = _count_label(columns[1], subject, lang)
+    else:
+        measure = _humanize(columns[1], lang)
+    values = [r[1] or 0 for r in rows]
+    ordered_desc = all(a >= b for a, b in zip(values, values[1:]))
+    ordered_asc = all(a <= b for a, b in zip(values, values[1:]))
+    ranked = RANKED_QUESTION.search(question or "") and (ordered_desc or ordered_asc)
+
+    if ranked:
+        if len(rows) > MAX_LIST_ROWS:
+            return None
+        lines = [text["ranked"].format(label=label, measure=measure), ""]
+        for i, (name, value) in enumerate(rows, start=1):
+            lines.append(f"{i}. **{_fmt(name)}** — {_fmt(value)}")
+        return "\n".join(lines)
+
+    if len(rows) > MAX_DISTRIBUTION_ROWS:
+        return None
+    total = sum(float(v) for v in values)
+    lines = [text["distribution"].format(label=label, measure=measure), ""]
+    for name, value in rows:
+        share = f" ({float(value or 0) / total * 100:.1f}%)" if total and _is_count_column(columns[1]) else ""
+        lines.append(f"- **{_fmt(name)}:** {_fmt(value)}{share}")
+    if _is_count_column(columns[1]):
+        lines += ["", text["total"].format(value=_fmt(sum(values)))]
+    return "\n".join(lines)
+
+
+def render_table_answer(columns, rows, total=None, lang: str = "English", max_rows: int = MAX_LIST_ROWS) -> str:
+    """Plain table of the first rows; used when the LLM is unavailable or out of time."""
+    if lang not in TEXT:
+        lang = "English"
+    total = len(rows) if total is None else total
+    shown = rows[:max_rows]
+    lines = [TEXT[lang]["table"].format(shown=len(shown), total=_fmt(total)), ""]
+    lines.append("| " + " | ".join(_humanize(c, lang).capitalize() for c in columns) + " |")
+    lines.append("|" + "---|" * len(columns))
+    for row in shown:
+        lines.append("| " + " | ".join(_fmt(v).replace("|", "/") for v in row) + " |")
+    return "\n".join(lines)
@@ -0,0 +1,360 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+import uvicorn
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+from llm_registry import warm_up
+from cross_views import start_cross_view_refresher
+from router import (
+    is_general_question, answer_general_question, route_data_question, fallback_route, submit_route,
+    estimate_llm_calls
+)
+from worker_pool import get_pool, STAGE_LABELS
+from resilience import question_deadline, start_deadline, breaker_states
+from admission import get_admission, AdmissionRejected, QUEUE_SIZE
+from profiling import should_profile, start_profile, finish_profile
+from memory_accounting import memory_report, take_snapshot
+
+# =========================
+# HEADLESS HTTP QUERY API
+# =========================
+# The routing + execute_query pipeline behind an async HTTP service, for
+# field dashboards and load balancers. Jobs run on the same worker pool,
+# LLM client, template/few-shot/fix caches and SQLite files as the
+# Streamlit app; identical in-flight questions share one execution.
+#
+#   GET  /health        pool status
+#   GET  /memory        memory by cache layer (?snapshot=1 adds a tracemalloc snapshot)
+#   POST /query         {"question": ..., "lang": "English"} -> JSON result
+#   POST /query/stream  same body, server-sent events: queued, route, stage, answer, done
+#
+# Every response carries an X-Request-ID (the caller's, or a new one), and
+# each request runs under one question deadline (see resilience.py).
+# Questions pass the admission controller first (see admission.py), with
+# X-Session-ID (or the client address) as the session; a rejected question
+# gets 429 with Retry-After, or a "rejected" event on the stream.
+# ?profile=1 or X-Profile: 1 profiles the pipeline job of that request and
+# returns the saved flamegraph under "profile" (see profiling.py).
+# Run with `python api_server.py`; API_WORKERS > 1 starts that many worker
+# processes behind API_PORT. In-memory caches are per process; the SQLite
+# backed ones (templates, few-shot examples, SQL fixes) are shared.
+
+load_dotenv()
+
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", 8000))
+API_WORKERS = int(os.getenv("API_WORKERS", 1))
+API_MAX_ROWS = int(os.getenv("API_MAX_ROWS", 500))     # rows returned per response
+STREAM_POLL_SECONDS = 0.1
+
+# Admission waits block a thread for up to ADMISSION_MAX_WAIT_SECONDS; they get
+# their own threads (one per queue slot) so a full queue cannot starve the
+# default executor that routing and answers run on
+_admission_executor = ThreadPoolExecutor(max_workers=QUEUE_SIZE + 4, thread_name_prefix="admission")
+
+
+def _dumps(payload) -> str:
+    return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def _json(payload, request_id: str, status_code: int = 200) -> Response:
+    return Response(
+        _dumps(payload), status_code=status_code, media_type="application/json",
+        headers={"X-Request-ID": request_id}
+    )
+
+
+def _sse(event: str, payload) -> str:
+    return f"event: {event}\ndata: {_dumps(payload)}\n\n"
+
+
+def _request_id(request: Request) -> str:
+    return request.headers.get("x-request-id") or uuid.uuid4().hex
+
+
+def _wants_profile(request: Request) -> bool:
+    return should_profile(request.query_params.get("profile") == "1" or request.headers.get("x-profile") == "1")
+
+
+def _session_id(request: Request) -> str:
+    return request.headers.get("x-session-id") or (request.client.host if request.client else "anonymous")
+
+
+def _rejected(e: AdmissionRejected, request_id: str) -> Response:
+    retry_after = max(round(e.retry_after), 1)
+    return Response(
+        _dumps({"request_id": request_id, "error": e.reason, "retry_after": retry_after}),
+        status_code=429, media_type="application/json",
+        headers={"X-Request-ID": request_id, "Retry-After": str(retry_after)}
+    )
+
+
+def _release_orphan(future):
+    """Done-callback: release a ticket admitted after its request went away."""
+    if not future.cancelled() and future.exception() is None:
+        future.result().release()
+        print("🌐 Released the ticket of a client that left while queued")
+
+
+async def _admit(request: Request, question: str, on_position=None):
+    """Admission ticket for the question (waits off the event loop); raises AdmissionRejected."""
+    cost, priority = await asyncio.to_thread(estimate_llm_calls, question)
+    waiting = asyncio.get_running_loop().run_in_executor(
+        _admission_executor, partial(get_admission().admit, _session_id(request), cost, priority, on_position)
+    )
+    try:
+        # Shielded: cancelling the future would not stop the waiting thread, only lose its ticket
+        return await asyncio.shield(waiting)
+    except asyncio.CancelledError:
+        waiting.add_done_callback(_release_orphan)
+        raise
+
+
+async def _read_question(request: Request):
+    """(question, lang) from the JSON body; ValueError on a bad request."""
+    try:
+        body = await request.json()
+    except ValueError:
+        raise ValueError("Body must be JSON")
+    question = body.get("question") if isinstance(body, dict) else None
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("'question' is required")
+    return question.strip(), body.get("lang") or "English"
+
+
+def _result_payload(result: dict, route: dict) -> dict:
+    """execute_query result as JSON, rows capped at API_MAX_ROWS."""
+    if not result["success"]:
+        payload = {"success": False, "error": result["error"]}
+        if result.get("too_expensive"):
+            payload.update(too_expensive=True, plan=result["plan"])
+        if result.get("degraded"):
+            payload["degraded"] = True
+        return payload
+    rows = [list(row) for row in result["rows"][:API_MAX_ROWS]]
+    return {
+        "success": True,
+        "answer": result["answer"],
+        "agent": route["agent"],
+        "agents": result.get("agents", [route["agent"]]),
+        "sql": result.get("sql"),
+        "columns": result["columns"],
+        "rows": rows,
+        "total": result["total"],
+        "truncated": len(rows) < result["total"],
+        "degraded": bool(result.get("degraded"))
+    }
+
+
+async def _route(question: str):
+    """None for general questions, else the route dict (blocking LLM calls off the event loop)."""
+    if await asyncio.to_thread(is_general_question, question):
+        return None
+    return await asyncio.to_thread(route_data_question, question)
+
+
+# =========================
+# ENDPOINTS
+# =========================
+async def health(request: Request):
+    return _json({
+        "status": "ok",
+        "inflight": get_pool().inflight(),
+        "llm_circuits": breaker_states(),
+        "admission": get_admission().status(),
+        "pid": os.getpid()
+    }, _request_id(request))
+
+
+async def memory(request: Request):
+    payload = await asyncio.to_thread(memory_report)
+    if request.query_params.get("snapshot") == "1":
+        payload["snapshot"] = await asyncio.to_thread(take_snapshot)
+    return _json(payload, _request_id(request))
+
+
+async def query(request: Request):
+    request_id = _request_id(request)
+    started = time.perf_counter()
+    try:
+        question, lang = await _read_question(request)
+    except ValueError as e:
+        return _json({"request_id": request_id, "error": str(e)}, request_id, 400)
+    print(f"🌐 [{request_id}] {question}")
+
+    try:
+        ticket = await _admit(request, question)
+    except AdmissionRejected as e:
+        print(f"🌐 [{request_id}] rejected: {e}")
+        return _rejected(e, request_id)
+
+    with ticket, question_deadline():
+        if _wants_profile(request):
+            start_profile(question, request_id, attach=False)
+        job = None
+        route = await _route(question)
+        if route is None:
+            answer = await asyncio.to_thread(answer_general_question, question)
+            payload = {"success": True, "answer": answer, "agent": None}
+        else:
+            job = submit_route(route, question, lang)
+            result = await asyncio.wrap_future(job.future)
+            retry = await asyncio.to_thread(fallback_route, route, question, result)
+            if retry:
+                route = retry
+                job = submit_route(route, question, lang)
+                result = await asyncio.wrap_future(job.future)
+            payload = _result_payload(result, route)
+        profile = finish_profile(job.events if job else None)
+        if profile:
+            payload["profile"] = profile
+
+    payload.update(request_id=request_id, seconds=round(time.perf_counter() - started, 3))
+    print(f"🌐 [{request_id}] done in {payload['seconds']}s")
+    return _json(payload, request_id)
+
+
+async def query_stream(request: Request):
+    request_id = _request_id(request)
+    try:
+        question, lang = await _read_question(request)
+    except ValueError as e:
+        return _json({"request_id": request_id, "error": str(e)}, request_id, 400)
+    print(f"🌐 [{request_id}] (stream) {question}")
+
+    async def follow(job):
+        """Stage events until the job finishes; stops early if the client went away."""
+        seen = None
+        while not job.done():
+            if await request.is_disconnected():
+                return
+            stage = job.stage
+            if stage != seen:
+                yield _sse("stage", {"stage": stage, "label": STAGE_LABELS.get(stage, stage)})
+                seen = stage
+            await asyncio.sleep(STREAM_POLL_SECONDS)
+
+    async def admit():
+        """Admission ticket, yielding "queued" events while waiting; None if rejected."""
+        loop = asyncio.get_running_loop()
+        positions = asyncio.Queue()
+        waiting = asyncio.ensure_future(_admit(
+            request, question,
+            on_position=lambda position, eta: loop.call_soon_threadsafe(positions.put_nowait, (position, eta))
+        ))
+        taken = False
+        try:
+            while not waiting.done() or not positions.empty():
+                try:
+                    position, eta = await asyncio.wait_for(positions.get(), STREAM_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    continue
+                yield _sse("queued", {"request_id": request_id, "position": position, "eta_seconds": round(eta, 1)})
+            taken = True
+            try:
+                yield waiting.result()
+            except AdmissionRejected as e:
+                print(f"🌐 [{request_id}] rejected: {e}")
+                yield _sse("rejected", {"request_id": request_id, "error": e.reason,
+                                        "retry_after": max(round(e.retry_after), 1)})
+        finally:
+            if not taken:
+                # The client left while queued: release the ticket once the wait ends
+                waiting.add_done_callback(_release_orphan)
+
+    async def events():
+        started = time.perf_counter()
+        ticket = None
+        try:
+            async for event in admit():
+                if isinstance(event, str):
+                    yield event
+                else:
+                    ticket = event
+            if ticket is None:
+                return
+            try:
+                async for event in answer(started):
+                    yield event
+            finally:
+                finish_profile()    # no-op unless the client left mid-question
+        finally:
+            if ticket is not None:
+                ticket.release()    # also when the client left between admission and answer
+
+    async def answer(started):
+        # The generator runs in its own context, so the deadline is set here
+        start_deadline()
+        if _wants_profile(request):
+            start_profile(question, request_id, attach=False)
+        job = None
+        route = await _route(question)
+        yield _sse("route", {"request_id": request_id, "agent": route and route["agent"],
+                             "decomposed": bool(route and route["decomposition"])})
+        if route is None:
+            answer = await asyncio.to_thread(answer_general_question, question)
+            payload = {"success": True, "answer": answer, "agent": None}
+        else:
+            job = submit_route(route, question, lang)
+            async for event in follow(job):
+                yield event
+            if not job.done():
+                return
+            result = job.result()
+            retry = await asyncio.to_thread(fallback_route, route, question, result)
+            if retry:
+                route = retry
+                job = submit_route(route, question, lang)
+                async for event in follow(job):
+                    yield event
+                if not job.done():
+                    return
+                result = job.result()
+            payload = _result_payload(result, route)
+        profile = finish_profile(job.events if job else None)
+        if profile:
+            payload["profile"] = profile
+
+        yield _sse("answer", {"request_id": request_id, **payload})
+        yield _sse("done", {"request_id": request_id, "seconds": round(time.perf_counter() - started, 3)})
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream",
+        headers={"X-Request-ID": request_id, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@asynccontextmanager
+async def lifespan(app):
+    try:
+        await asyncio.to_thread(warm_up)
+    except Exception as e:
+        print(f"⚠️ LLM warm-up failed: {e}")
+    await asyncio.to_thread(start_cross_view_refresher)
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/health", health, methods=["GET"]),
+        Route("/memory", memory, methods=["GET"]),
+        Route("/query", query, methods=["POST"]),
+        Route("/query/stream", query_stream, methods=["POST"]),
+    ],
+    lifespan=lifespan
+)
+
+
+if __name__ == "__main__":
+    uvicorn.run("api_server:app", host=API_HOST, port=API_PORT, workers=API_WORKERS)
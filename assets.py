@@ -0,0 +1,81 @@
+import base64
+import re
+from pathlib import Path
+
+import streamlit as st
+
+# =========================
+# STATIC ASSETS
+# =========================
+# The background photo (~2 MB PNG), the logo and the theme CSS used to be
+# read, base64-encoded and re-sent on every rerun. They are now built once
+# per process: images are re-encoded to right-sized WebP files in static/
+# and served by Streamlit's static file server (.streamlit/config.toml),
+# the CSS is minified once and cached.
+
+BASE_DIR = Path(__file__).resolve().parent
+STATIC_DIR = BASE_DIR / "static"
+STATIC_URL = "app/static"
+
+BACKGROUND_SOURCE = BASE_DIR / "BJP (5).png"
+LOGO_SOURCE = BASE_DIR / "logo.png"
+CSS_FILE = STATIC_DIR / "style.css"
+
+BACKGROUND_MAX_WIDTH = 1920   # covers full-HD screens with background-size: cover
+LOGO_HEIGHT = 80              # displayed at 40px, 2x for high-DPI screens
+
+
+def _reencode(source: Path, target: Path, max_width=None, height=None, quality=80) -> Path:
+    """Resize + re-encode an image to WebP, skipped if the target is up to date."""
+    if target.exists() and target.stat().st_mtime >= source.stat().st_mtime:
+        return target
+
+    from PIL import Image
+
+    with Image.open(source) as img:
+        img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+        if max_width and img.width > max_width:
+            img = img.resize((max_width, round(img.height * max_width / img.width)), Image.LANCZOS)
+        if height and img.height > height:
+            img = img.resize((round(img.width * height / img.height), height), Image.LANCZOS)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        img.save(target, "WEBP", quality=quality, method=6)
+    return target
+
+
+def _minify_css(css: str) -> str:
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.DOTALL)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    return css.replace(";}", "}").strip()
+
+
+def _image_url(path: Path) -> str:
+    """Static URL when static serving is on, otherwise an inline data URI."""
+    if st.get_option("server.enableStaticServing"):
+        return f"{STATIC_URL}/{path.name}?v={int(path.stat().st_mtime)}"
+    encoded = base64.b64encode(path.read_bytes()).decode()
+    return f"data:image/webp;base64,{encoded}"
+
+
+@st.cache_resource(show_spinner=False)
+def build_assets() -> str:
+    """Build all page assets once per process and return the HTML to inject."""
+    background = _reencode(BACKGROUND_SOURCE, STATIC_DIR / "bg.webp", max_width=BACKGROUND_MAX_WIDTH)
+    logo = _reencode(LOGO_SOURCE, STATIC_DIR / "logo.webp", height=LOGO_HEIGHT)
+
+    css = _minify_css(CSS_FILE.read_text(encoding="utf-8"))
+    background_css = (
+        f'.stApp{{background-image:url("{_image_url(background)}");'
+        "background-size:cover;background-position:center;"
+        "background-repeat:no-repeat;background-attachment:fixed}"
+    )
+    return (
+        f"<style>{css}{background_css}</style>"
+        f'<div class="top-right-logo"><img src="{_image_url(logo)}"></div>'
+    )
+
+
+def inject_assets():
+    """Inject the cached CSS, background and logo into the page."""
+    st.markdown(build_assets(), unsafe_allow_html=True)
@@ -0,0 +1,198 @@
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from router import route_data_question, fallback_route, submit_route
+from worker_pool import normalize_question
+from resilience import question_deadline
+
+# =========================
+# BATCH QUESTION RUNNER
+# =========================
+# Runs a file of questions (weekly report sets) through routing and the
+# agent pipeline with bounded concurrency and writes one JSONL record per
+# question: plan, SQL, rows, answer and stage timings.
+#
+#   python batch_runner.py questions.txt -o results.jsonl -c 4
+#   python agents/visitor_agent.py --batch questions.txt   (skips routing)
+#
+# Input is one question per line, or JSONL with {"question", "agent", "lang"}.
+# Repeated questions reuse the first result; plans and SQL are also reused
+# across the batch through the template cache and few-shot index, which the
+# pipeline fills as it goes.
+
+BATCH_CONCURRENCY = 4
+BATCH_MAX_ROWS = 1000     # rows written per record; "total" keeps the real count
+
+
+def read_questions(path: Path, lang: str, agent_key=None):
+    """[{"question", "agent", "lang"}, ...] from a text or JSONL file."""
+    items = []
+    for number, line in enumerate(path.read_text(encoding="utf-8").splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"⚠️ Line {number} skipped: {e}")
+                continue
+            items.append({
+                "question": record["question"],
+                "agent": agent_key or record.get("agent"),
+                "lang": record.get("lang", lang)
+            })
+        else:
+            items.append({"question": line, "agent": agent_key, "lang": lang})
+    return items
+
+
+def stage_timings(events) -> dict:
+    """Seconds spent in each stage, from a job's (stage, timestamp) events."""
+    timings = {}
+    for (stage, started), (_, ended) in zip(events, events[1:]):
+        timings[stage] = round(timings.get(stage, 0) + ended - started, 3)
+    return timings
+
+
+class BatchRunner:
+    def __init__(self, concurrency: int = BATCH_CONCURRENCY):
+        self.concurrency = concurrency
+        self._results = {}      # (agent or None, normalized question, lang) -> record
+        self._lock = threading.Lock()
+
+    def _execute(self, item):
+        started = time.perf_counter()
+        question, lang = item["question"], item["lang"]
+
+        route_started = time.perf_counter()
+        if item["agent"]:
+            route = {"agent": item["agent"], "decomposition": None}
+        else:
+            route = route_data_question(question)
+        route_seconds = time.perf_counter() - route_started
+
+        job = submit_route(route, question, lang)
+        result = job.result()
+        events = list(job.events)
+        retry = None if item["agent"] else fallback_route(route, question, result)
+        if retry:
+            route = retry
+            job = submit_route(route, question, lang)
+            result = job.result()
+            events += list(job.events)
+
+        timings = {"route": round(route_seconds, 3), **stage_timings(events)}
+        timings["total"] = round(time.perf_counter() - started, 3)
+        record = {
+            "question": question,
+            "agent": route["agent"],
+            "decomposed": route["decomposition"] is not None,
+            "success": result["success"],
+            "plan": result.get("query_plan"),
+            "sql": result.get("sql") or result.get("part_sql"),
+            "columns": result.get("columns"),
+            "rows": [list(row) for row in result.get("rows", [])[:BATCH_MAX_ROWS]],
+            "total": result.get("total"),
+            "answer": result.get("answer"),
+            "timings": timings
+        }
+        if not result["success"]:
+            record["error"] = result["error"]
+            record["too_expensive"] = bool(result.get("too_expensive"))
+        return record
+
+    def run_one(self, item) -> dict:
+        key = (item["agent"], normalize_question(item["question"]), item["lang"])
+        with self._lock:
+            cached = self._results.get(key)
+        if cached is not None:
+            return {**cached, "question": item["question"], "cached": True, "timings": {"total": 0.0}}
+        try:
+            with question_deadline():
+                record = self._execute(item)
+        except Exception as e:
+            record = {"question": item["question"], "agent": item["agent"], "success": False, "error": str(e)}
+        record["cached"] = False
+        if record["success"]:
+            with self._lock:
+                self._results.setdefault(key, record)
+        return record
+
+    def run(self, items, out):
+        """Run all items, writing each record to `out` as it finishes. Returns the report."""
+        started = time.perf_counter()
+        records = []
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="batch") as executor:
+            futures = {executor.submit(self.run_one, item): index for index, item in enumerate(items)}
+            for future in as_completed(futures):
+                record = {"index": futures[future], **future.result()}
+                out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                out.flush()
+                records.append(record)
+                status = "✅" if record["success"] else "❌"
+                print(f"{status} [{len(records)}/{len(items)}] {record['question']}")
+        return throughput_report(records, time.perf_counter() - started)
+
+
+def throughput_report(records, wall_seconds: float) -> dict:
+    executed = [r for r in records if not r.get("cached") and "timings" in r]
+    latencies = sorted(r["timings"]["total"] for r in executed)
+    stages = {}
+    for record in executed:
+        for stage, seconds in record["timings"].items():
+            if stage != "total":
+                stages.setdefault(stage, []).append(seconds)
+    return {
+        "questions": len(records),
+        "succeeded": sum(1 for r in records if r["success"]),
+        "failed": sum(1 for r in records if not r["success"]),
+        "reused": sum(1 for r in records if r.get("cached")),
+        "wall_seconds": round(wall_seconds, 2),
+        "questions_per_minute": round(len(records) / wall_seconds * 60, 1) if wall_seconds else None,
+        "latency_p50": round(statistics.median(latencies), 2) if latencies else None,
+        "latency_p95": round(latencies[int(0.95 * (len(latencies) - 1))], 2) if latencies else None,
+        "stage_mean_seconds": {stage: round(statistics.mean(v), 3) for stage, v in sorted(stages.items())}
+    }
+
+
+def print_report(report: dict):
+    print("\n📊 Batch throughput")
+    print(f"  Questions: {report['questions']} ({report['succeeded']} ok, {report['failed']} failed, "
+          f"{report['reused']} reused)")
+    print(f"  Wall time: {report['wall_seconds']}s  →  {report['questions_per_minute']} questions/min")
+    print(f"  Latency p50/p95: {report['latency_p50']}s / {report['latency_p95']}s")
+    for stage, seconds in report["stage_mean_seconds"].items():
+        print(f"    {stage:<10} {seconds:.3f}s avg")
+
+
+def main(argv=None, agent_key=None):
+    parser = argparse.ArgumentParser(description="Run a file of questions through the agent pipeline.")
+    parser.add_argument("questions", type=Path, help="text file (one question per line) or JSONL")
+    parser.add_argument("-o", "--output", type=Path, help="JSONL output (default: <questions>.results.jsonl)")
+    parser.add_argument("-c", "--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--lang", default="English")
+    if agent_key is None:
+        parser.add_argument("--agent", help="skip routing and send every question to this agent")
+    args = parser.parse_args(argv)
+    agent_key = agent_key or args.agent
+
+    items = read_questions(args.questions, args.lang, agent_key)
+    output = args.output or args.questions.with_suffix(".results.jsonl")
+    print(f"🚀 Running {len(items)} questions with concurrency {args.concurrency} → {output}")
+
+    with open(output, "w", encoding="utf-8") as out:
+        report = BatchRunner(args.concurrency).run(items, out)
+    print_report(report)
+    output.with_suffix(".report.json").write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,134 @@
+import os
+import uuid
+from collections import OrderedDict
+
+import streamlit as st
+
+from result_store import result_rows
+from sql_runner import fetch_page, PAGE_SIZE
+
+# =========================
+# CHAT RENDERING
+# =========================
+# Keeps per-rerun script time flat as conversations grow:
+# - only the last HISTORY_WINDOW messages are rendered ("Show earlier" loads more)
+# - preview DataFrames are built once per message/page and cached by message id
+# - the data preview pager is a fragment, so paging re-runs only that expander
+
+HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", 30))
+FRAME_CACHE_SIZE = 64
+
+# st.fragment is available from Streamlit 1.37 (experimental_fragment before)
+fragment = getattr(st, "fragment", None) or getattr(st, "experimental_fragment", None) or (lambda func: func)
+
+
+def new_message(role: str, content: str, **extra) -> dict:
+    """Chat message with a stable id used for widget keys and caches."""
+    return {"id": uuid.uuid4().hex, "role": role, "content": content, **extra}
+
+
+def cached_page(key, columns, load_page):
+    """
+    Preview page as (DataFrame, next_key, has_next), built once and cached
+    per session by message id and page. `load_page` returns (rows, next_key, has_next).
+    """
+    cache = st.session_state.setdefault("_frame_cache", OrderedDict())
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key]
+    import pandas as pd
+
+    rows, next_key, has_next = load_page()
+    cache[key] = (pd.DataFrame(rows, columns=columns), next_key, has_next)
+    while len(cache) > FRAME_CACHE_SIZE:
+        cache.popitem(last=False)
+    return cache[key]
+
+
+def _prev_page(cursors):
+    if len(cursors) > 1:
+        cursors.pop()
+
+
+def _next_page(cursors, key):
+    cursors.append(key)
+
+
+def _load_page(data, cursors, db_path):
+    """Rows for the current page: inline/spilled rows, or pages from the DB."""
+    columns = data["columns"]
+    total = data.get("total", len(data.get("rows", [])))
+    cached = data.get("cached_rows", len(data.get("rows", [])))
+    page_no = len(cursors)
+
+    stored = None
+    from_db = total > cached
+    if not from_db and (page_no > 1 or data.get("evicted")):
+        # Later pages (or all of them once memory accounting released the
+        # preview) come from the spilled result; page the DB if it was evicted
+        stored = result_rows(data)
+        from_db = stored is None
+
+    if from_db:
+        if not (data.get("sql") and db_path):
+            return [], None, False
+        rows, next_key = fetch_page(db_path, data["sql"], columns, cursors[-1], PAGE_SIZE)
+        return rows, next_key, next_key is not None
+
+    source = stored if stored is not None else data.get("rows", data.get("preview", []))
+    start = (page_no - 1) * PAGE_SIZE if stored is not None else 0
+    # Same cursor shape as fetch_page, so paging can move to the DB after eviction
+    return source[start:start + PAGE_SIZE], (page_no * PAGE_SIZE, None), page_no * PAGE_SIZE < cached
+
+
+@fragment
+def render_data_preview(message_id, data, db_path=None):
+    """Preview table with pages; capped results page through the DB."""
+    total = data.get("total", len(data.get("rows", [])))
+    # Stack of page cursors, one per page visited (None = first page)
+    cursors = st.session_state.setdefault(f"preview_pages_{message_id}", [None])
+    page_no = len(cursors)
+
+    with st.expander(f"📊 Data Preview ({total} rows)", expanded=page_no > 1):
+        df, next_key, has_next = cached_page(
+            (message_id, page_no, cursors[-1]),
+            data["columns"],
+            lambda: _load_page(data, cursors, db_path)
+        )
+        st.dataframe(df, use_container_width=True)
+
+        if total > PAGE_SIZE:
+            prev_col, info_col, next_col = st.columns([1, 2, 1])
+            with prev_col:
+                st.button("◀ Prev", key=f"prev_{message_id}", disabled=page_no == 1,
+                          on_click=_prev_page, args=(cursors,))
+            with info_col:
+                st.caption(f"Page {page_no} of {-(-total // PAGE_SIZE)}")
+            with next_col:
+                st.button("Next ▶", key=f"next_{message_id}", disabled=not has_next,
+                          on_click=_next_page, args=(cursors, next_key))
+
+
+def render_message(message, show_data=False, db_path_for=None):
+    """One chat bubble, plus its data preview when enabled."""
+    css_class = "user-message" if message["role"] == "user" else "assistant-message"
+    st.markdown(
+        f'<div class="message-container"><div class="{css_class}">{message["content"]}</div></div>',
+        unsafe_allow_html=True
+    )
+    data = message.get("data")
+    if message["role"] != "user" and show_data and data:
+        db_path = db_path_for(data) if db_path_for else None
+        render_data_preview(message.get("id", id(message)), data, db_path)
+
+
+def render_history(messages, show_data=False, db_path_for=None):
+    """Render the most recent part of the conversation."""
+    window = st.session_state.setdefault("history_window", HISTORY_WINDOW)
+    hidden = max(len(messages) - window, 0)
+    if hidden:
+        if st.button(f"⬆ Show earlier messages ({hidden})", key="show_earlier"):
+            st.session_state.history_window = window + HISTORY_WINDOW
+            st.rerun()
+    for message in messages[hidden:]:
+        render_message(message, show_data, db_path_for)
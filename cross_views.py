@@ -0,0 +1,242 @@
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# =========================
+# CROSS-DOMAIN FACT TABLES
+# =========================
+# visitor_details, beneficiary_master and constituency_hierarchy share the
+# hierarchy IDs (booth_mas_id, ward_mas_id, shaktikendra_mas_id), but each
+# agent may only query its own table. The tables below are precomputed
+# joins on those IDs, so comparative questions ("beneficiary coverage vs
+# visitor volume per booth") are a single indexed query for the cross agent.
+#
+# They are materialized in converted.db and rebuilt whenever the source
+# tables change, checked at startup and then every CROSS_VIEWS_CHECK_SECONDS
+# by a background thread, never on the request path. Inserts,
+# updates and deletes bump a per-table version in cross_view_changes
+# (triggers on the source tables); row count and max rowid also catch a
+# table that was replaced wholesale, triggers and all. A rebuild can be
+# forced with `python cross_views.py`.
+
+CROSS_VIEWS_CHECK_SECONDS = int(os.getenv("CROSS_VIEWS_CHECK_SECONDS", 300))
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_PATH = BASE_DIR / "converted.db"
+
+SOURCE_TABLES = ("visitor_details", "beneficiary_master", "constituency_hierarchy")
+FACT_TABLES = ("booth_facts", "booth_scheme_facts", "ward_facts")
+
+# Build order matters: ward_facts aggregates the two booth tables
+FACT_SQL = {
+    "booth_facts": """
+    WITH h AS (
+        SELECT booth_mas_id,
+               MAX(booth_no) AS booth_no, MAX(booth_name) AS booth_name,
+               MAX(ward_mas_id) AS ward_mas_id, MAX(ward_id) AS ward_id, MAX(ward_name) AS ward_name,
+               MAX(shaktikendra_mas_id) AS shaktikendra_mas_id, MAX(shaktikendra_name) AS shaktikendra_name,
+               MAX(ac_no) AS ac_no, MAX(assembly_name) AS assembly_name
+        FROM constituency_hierarchy
+        WHERE booth_mas_id IS NOT NULL
+        GROUP BY booth_mas_id
+    ),
+    v AS (
+        SELECT booth_mas_id,
+               COUNT(*) AS visitor_count,
+               COUNT(DISTINCT vis_contact_no) AS unique_visitors,
+               SUM(vis_work_status LIKE 'Pending%') AS visitor_pending,
+               SUM(vis_work_status LIKE 'Complete%') AS visitor_complete,
+               MAX(vis_date_clean) AS last_visit_date
+        FROM visitor_details
+        WHERE booth_mas_id IS NOT NULL
+        GROUP BY booth_mas_id
+    ),
+    b AS (
+        SELECT booth_mas_id,
+               COUNT(*) AS beneficiary_count,
+               COUNT(DISTINCT beneficiary_item_name) AS scheme_count
+        FROM beneficiary_master
+        WHERE booth_mas_id IS NOT NULL
+        GROUP BY booth_mas_id
+    )
+    SELECT h.*,
+           IFNULL(v.visitor_count, 0) AS visitor_count,
+           IFNULL(v.unique_visitors, 0) AS unique_visitors,
+           IFNULL(v.visitor_pending, 0) AS visitor_pending,
+           IFNULL(v.visitor_complete, 0) AS visitor_complete,
+           v.last_visit_date,
+           IFNULL(b.beneficiary_count, 0) AS beneficiary_count,
+           IFNULL(b.scheme_count, 0) AS scheme_count
+    FROM h
+    LEFT JOIN v ON v.booth_mas_id = h.booth_mas_id
+    LEFT JOIN b ON b.booth_mas_id = h.booth_mas_id
+    """,
+    "booth_scheme_facts": """
+    SELECT b.booth_mas_id,
+           MAX(h.booth_name) AS booth_name,
+           MAX(h.ward_mas_id) AS ward_mas_id,
+           MAX(h.shaktikendra_mas_id) AS shaktikendra_mas_id,
+           b.beneficiary_item_name AS scheme_name,
+           COUNT(*) AS beneficiary_count
+    FROM beneficiary_master b
+    JOIN constituency_hierarchy h ON h.booth_mas_id = b.booth_mas_id
+    WHERE b.beneficiary_item_name IS NOT NULL
+    GROUP BY b.booth_mas_id, b.beneficiary_item_name
+    """,
+    "ward_facts": """
+    SELECT f.ward_mas_id,
+           MAX(f.ward_id) AS ward_id, MAX(f.ward_name) AS ward_name,
+           MAX(f.assembly_name) AS assembly_name,
+           COUNT(*) AS booth_count,
+           COUNT(DISTINCT f.shaktikendra_mas_id) AS shaktikendra_count,
+           SUM(f.visitor_count) AS visitor_count,
+           SUM(f.visitor_pending) AS visitor_pending,
+           SUM(f.visitor_complete) AS visitor_complete,
+           SUM(f.beneficiary_count) AS beneficiary_count,
+           (SELECT COUNT(DISTINCT s.scheme_name) FROM booth_scheme_facts s
+            WHERE s.ward_mas_id = f.ward_mas_id) AS scheme_count,
+           SUM(f.visitor_count > 0) AS booths_with_visitors,
+           SUM(f.beneficiary_count > 0) AS booths_with_beneficiaries
+    FROM booth_facts f
+    WHERE f.ward_mas_id IS NOT NULL
+    GROUP BY f.ward_mas_id
+    """
+}
+
+FACT_INDEXES = {
+    "booth_facts": [("booth_mas_id",), ("ward_mas_id",), ("shaktikendra_mas_id",)],
+    "booth_scheme_facts": [("booth_mas_id",), ("ward_mas_id",), ("scheme_name",)],
+    "ward_facts": [("ward_mas_id",), ("ward_id",)]
+}
+
+_lock = threading.Lock()
+_last_check = 0.0
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def init_cross_view_state():
+    """Create the state/change tables and the source change triggers if they don't exist"""
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS cross_view_state (
+        source_fingerprint TEXT,
+        refreshed_at TEXT,
+        seconds REAL
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS cross_view_changes (
+        source TEXT PRIMARY KEY,
+        version INTEGER DEFAULT 0
+    )
+    """)
+    for table in SOURCE_TABLES:
+        conn.execute("INSERT OR IGNORE INTO cross_view_changes (source) VALUES (?)", (table,))
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS cross_changes_{table}_{operation.lower()}
+            AFTER {operation} ON {table}
+            BEGIN
+                UPDATE cross_view_changes SET version = version + 1 WHERE source = '{table}';
+            END
+            """)
+    conn.commit()
+    conn.close()
+
+
+def source_fingerprint(conn) -> str:
+    """Changes whenever rows of a source table are inserted, updated or deleted."""
+    versions = dict(conn.execute("SELECT source, version FROM cross_view_changes"))
+    parts = []
+    for table in SOURCE_TABLES:
+        count, max_rowid = conn.execute(f"SELECT COUNT(*), MAX(rowid) FROM {table}").fetchone()
+        parts.append(f"{table}:{count}:{max_rowid}:{versions.get(table, 0)}")
+    return "|".join(parts)
+
+
+def _rebuild(conn, fingerprint: str):
+    started = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table in FACT_TABLES:
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"CREATE TABLE {table} AS {FACT_SQL[table]}")
+            for columns in FACT_INDEXES[table]:
+                conn.execute(
+                    f"CREATE INDEX idx_{table}_{'_'.join(columns)} ON {table} ({', '.join(columns)})"
+                )
+            conn.execute(f"ANALYZE {table}")
+        seconds = time.perf_counter() - started
+        conn.execute("DELETE FROM cross_view_state")
+        conn.execute(
+            "INSERT INTO cross_view_state (source_fingerprint, refreshed_at, seconds) VALUES (?, ?, ?)",
+            (fingerprint, datetime.now().isoformat(), seconds)
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    print(f"🔗 Cross-domain fact tables rebuilt in {seconds:.2f}s")
+
+
+def refresh_cross_views(force: bool = False) -> bool:
+    """
+    Rebuild the fact tables if the source data changed (or force=True).
+    Returns True when a rebuild happened.
+    """
+    global _last_check
+    with _lock:
+        if not force and time.monotonic() - _last_check < CROSS_VIEWS_CHECK_SECONDS:
+            return False
+        init_cross_view_state()
+        conn = sqlite3.connect(DB_PATH, isolation_level=None)
+        try:
+            fingerprint = source_fingerprint(conn)
+            row = conn.execute("SELECT source_fingerprint FROM cross_view_state").fetchone()
+            existing = {
+                name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+            }
+            stale = row is None or row[0] != fingerprint or not set(FACT_TABLES) <= existing
+            if force or stale:
+                _rebuild(conn, fingerprint)
+            _last_check = time.monotonic()
+            return force or stale
+        finally:
+            conn.close()
+
+
+def _refresh_loop():
+    while True:
+        time.sleep(CROSS_VIEWS_CHECK_SECONDS)
+        try:
+            refresh_cross_views()
+        except Exception as e:
+            print(f"⚠️ Cross-domain refresh failed: {e}")
+
+
+def start_cross_view_refresher():
+    """
+    Bring the fact tables up to date, then re-check them in a background
+    thread. Only the first call per process does any work, so callers on
+    the request path can use it as a cheap "has startup run" check.
+    """
+    global _refresher
+    if _refresher is not None:
+        return
+    with _refresher_lock:
+        if _refresher is not None:
+            return
+        try:
+            refresh_cross_views()
+        except Exception as e:
+            print(f"⚠️ Cross-domain refresh failed: {e}")
+        _refresher = threading.Thread(target=_refresh_loop, name="cross-views", daemon=True)
+        _refresher.start()
+
+
+if __name__ == "__main__":
+    refresh_cross_views(force=True)
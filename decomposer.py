@@ -0,0 +1,186 @@
+import os
+import re
+
+from llm_registry import invoke
+from resilience import DEGRADED_ERRORS
+from plan_schema import loads_json_reply, PlanError
+from result_summary import summarize_result
+
+# =========================
+# MULTI-INTENT DECOMPOSITION
+# =========================
+# detect_agent routes a question to exactly one agent, so "visitors and
+# beneficiaries per booth in ward 7" was answered only partly. Questions
+# that mention more than one agent's data are split into per-agent
+# sub-questions; each runs through its agent's plan/SQL/run steps
+# concurrently and the results are joined locally on a shared hierarchy
+# key before a single explanation call.
+
+FANOUT_WORKERS = int(os.getenv("DECOMPOSE_WORKERS", 3))
+# Aggregate comparisons go to the cross agent's fact tables first (see cross_views.py)
+CROSS_DOMAIN_MODE = os.getenv("CROSS_DOMAIN_MODE", "on").lower()
+
+# Shared keys, from the finest level; every agent's table carries them
+JOIN_KEYS = {
+    "booth": "booth_mas_id",
+    "shaktikendra": "shaktikendra_mas_id",
+    "ward": "ward_mas_id"
+}
+
+# Display columns kept once in the joined result
+LABEL_COLUMNS = ("booth_name", "shaktikendra_name", "ward_name", "ward_id", "assembly_name")
+
+# Words that point at each agent's data; two or more groups = multi-intent candidate
+AGENT_KEYWORDS = {
+    "visitor": ("visitor", "visits", "visited", "work status", "pending work", "completed work", "reason"),
+    "beneficiary": ("beneficiar", "scheme", "yojana", "ayushman", "ujjwala", "pm kisan", "pmay"),
+    "hierarchy": ("incharge", "in-charge", "mp ")
+}
+
+
+def mentioned_agents(question: str):
+    q = f" {question.lower()} "
+    return [agent for agent, words in AGENT_KEYWORDS.items() if any(w in q for w in words)]
+
+
+# Record-level questions cannot be answered from the aggregated fact tables
+RECORD_WORDS = ("name of", "names", "list of", "details", "mobile", "address", "contact", "who ")
+
+
+def is_cross_domain(question: str) -> bool:
+    """Aggregate question over several agents' data: one query on the fact tables."""
+    if CROSS_DOMAIN_MODE != "on" or len(mentioned_agents(question)) < 2:
+        return False
+    q = f" {question.lower()} "
+    return not any(word in q for word in RECORD_WORDS)
+
+
+def join_key_for(question: str) -> str:
+    """Finest hierarchy level the question groups by (booth by default)."""
+    q = question.lower().replace("shakti kendra", "shaktikendra").replace("shakthi kendra", "shaktikendra")
+    for level in JOIN_KEYS:
+        if re.search(rf"\b(per|by|each|every|wise)\s+{level}|{level}[\s-]?wise", q):
+            return JOIN_KEYS[level]
+    for level in JOIN_KEYS:
+        if level in q:
+            return JOIN_KEYS[level]
+    return JOIN_KEYS["booth"]
+
+
+def decompose_question(question: str):
+    """
+    Split a multi-intent question into per-agent sub-questions.
+    Returns {"join_key": ..., "parts": [{"agent", "question"}, ...]} or None
+    when the question belongs to a single agent.
+    """
+    if len(mentioned_agents(question)) < 2:
+        return None
+
+    join_key = join_key_for(question)
+    prompt = f"""
+Split the question into independent sub-questions, one per data source.
+
+Data sources:
+- visitor: visitor records, visits, work status, visit reasons
+- beneficiary: beneficiaries, schemes
+- hierarchy: booths, wards, shakti kendras, assemblies, incharges
+
+Each sub-question must keep the same filters (ward, booth, dates...) and
+return one row per {join_key} including the {join_key} column.
+If the question needs only one data source, return a single part.
+
+Return ONLY JSON:
+{{"parts": [{{"agent": "visitor", "question": "..."}}]}}
+
+Question: "{question}"
+"""
+    try:
+        reply = loads_json_reply(invoke([{"role": "user", "content": prompt}], "decompose", json_mode=True))
+    except (PlanError, *DEGRADED_ERRORS) as e:
+        print(f"⚠️ Decomposition failed: {e}")
+        return None
+
+    raw_parts = reply.get("parts") if isinstance(reply, dict) else None
+    if not isinstance(raw_parts, list):
+        print(f"⚠️ Decomposition failed: unexpected reply {str(reply)[:200]}")
+        return None
+
+    parts, seen = [], set()
+    for part in raw_parts:
+        if not isinstance(part, dict):
+            continue
+        agent = str(part.get("agent", "")).lower()
+        if agent in AGENT_KEYWORDS and agent not in seen and isinstance(part.get("question"), str) and part["question"]:
+            seen.add(agent)
+            parts.append({
+                "agent": agent,
+                "question": f"{part['question']} (return one row per {join_key}, including the {join_key} column)"
+            })
+    if len(parts) < 2:
+        return None
+    print(f"🔀 Decomposed into {[p['agent'] for p in parts]} joined on {join_key}")
+    return {"join_key": join_key, "parts": parts}
+
+
+def _key_column(columns, join_key: str):
+    """Result column holding the join key (also matches e.g. shaktikendra_mas_id_hier)."""
+    for column in columns:
+        if column.lower() == join_key:
+            return column
+    for column in columns:
+        if column.lower().startswith(join_key):
+            return column
+    return None
+
+
+def join_results(results, join_key: str):
+    """
+    Outer-join sub-results ({agent: (columns, rows)}) on the join key.
+    Returns (columns, rows); sub-results without the key are dropped.
+    """
+    import pandas as pd
+
+    frames = []
+    for agent, (columns, rows) in results.items():
+        key = _key_column(columns, join_key)
+        if key is None:
+            print(f"⚠️ {agent} result has no {join_key} column, left out of the join")
+            continue
+        df = pd.DataFrame(list(rows), columns=list(columns)).rename(columns={key: join_key})
+        df = df.loc[:, ~df.columns.duplicated()]
+        measures = [c for c in df.columns if c != join_key and c not in LABEL_COLUMNS]
+        frames.append(df.rename(columns={c: f"{agent}_{c}" for c in measures}))
+
+    if not frames:
+        return [], []
+    joined = frames[0]
+    for df in frames[1:]:
+        joined = joined.merge(df, on=join_key, how="outer", suffixes=("", "_dup"))
+        for column in [c for c in joined.columns if c.endswith("_dup")]:
+            base = column[:-len("_dup")]
+            joined[base] = joined[base].combine_first(joined[column])
+            joined = joined.drop(columns=column)
+
+    labels = [c for c in LABEL_COLUMNS if c in joined.columns]
+    ordered = [join_key] + labels + [c for c in joined.columns if c != join_key and c not in labels]
+    joined = joined[ordered].convert_dtypes()
+    joined = joined.astype(object).where(joined.notna(), None)
+    return list(joined.columns), [tuple(row) for row in joined.itertuples(index=False, name=None)]
+
+
+def explain_combined(question, columns, rows, total=None) -> str:
+    prompt = f"""
+Question:
+{question}
+
+The data below combines results from several sources (visitors, beneficiaries,
+hierarchy), joined per {columns[0] if columns else 'row'}. Column names are prefixed with their source.
+
+{summarize_result(columns, rows, total)}
+
+Answer the question clearly and concisely using this data.
+"""
+    return invoke([
+        {"role": "system", "content": "You explain combined constituency data clearly and accurately."},
+        {"role": "user", "content": prompt},
+    ], "answer")
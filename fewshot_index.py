@@ -0,0 +1,209 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from memory_accounting import register_cache, deep_size
+
+# =========================
+# DYNAMIC FEW-SHOT EXAMPLES
+# =========================
+# Instead of long fixed example blocks, the planner and SQL prompts get the
+# FEWSHOT_K most similar verified (question -> plan -> SQL) triples for the
+# agent, ranked with BM25. Every successful query is stored in converted.db,
+# but returning rows is not proof the SQL is right: only examples marked
+# verified (their SQL ran without repair and matched a template learned
+# from another question) enter the index, so a wrong query cannot teach
+# itself to later prompts. Each agent's FEWSHOT_SEEDS keep the prompts
+# useful on a fresh database.
+
+FEWSHOT_K = int(os.getenv("FEWSHOT_K", 3))
+FEWSHOT_MAX_EXAMPLES = int(os.getenv("FEWSHOT_MAX_EXAMPLES", 2000))   # per agent, most recent
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_PATH = BASE_DIR / "converted.db"
+
+STOPWORDS = {
+    "the", "a", "an", "of", "in", "on", "for", "to", "is", "are", "and", "or",
+    "me", "show", "give", "what", "which", "how", "with", "by", "all", "list"
+}
+
+_lock = threading.Lock()
+_indexes = {}
+_initialized = False
+
+
+def init_fewshot_table():
+    """Create the fewshot_examples table if it doesn't exist"""
+    global _initialized
+    if _initialized:
+        return
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS fewshot_examples (
+        agent TEXT,
+        question TEXT,
+        plan TEXT,
+        sql TEXT,
+        created_at TEXT,
+        verified INTEGER DEFAULT 0,
+        PRIMARY KEY (agent, question)
+    )
+    """)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(fewshot_examples)")}
+    if "verified" not in columns:
+        # Earlier rows were stored for any non-empty result: unverified
+        conn.execute("ALTER TABLE fewshot_examples ADD COLUMN verified INTEGER DEFAULT 0")
+    conn.commit()
+    conn.close()
+    _initialized = True
+
+
+def tokenize(text: str):
+    return [t for t in re.findall(r"\w+", text.lower()) if t not in STOPWORDS]
+
+
+def _normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question.strip()).rstrip(" ?.!")
+
+
+class BM25Index:
+    """Incrementally updated BM25 over question + plan text."""
+
+    def __init__(self):
+        self.docs = {}          # question key -> (tokens Counter, length, example)
+        self.df = Counter()
+        self.total_length = 0
+
+    def add(self, example: dict):
+        key = _normalize_question(example["question"]).lower()
+        if key in self.docs:
+            old_tokens, old_length, _ = self.docs.pop(key)
+            self.df.subtract(old_tokens.keys())
+            self.total_length -= old_length
+        tokens = Counter(tokenize(example["question"]) + tokenize(json.dumps(example["plan"])))
+        length = sum(tokens.values())
+        self.docs[key] = (tokens, length, example)
+        self.df.update(tokens.keys())
+        self.total_length += length
+
+    def search(self, text: str, k: int):
+        if not self.docs:
+            return []
+        query = set(tokenize(text))
+        n = len(self.docs)
+        avg_length = self.total_length / n or 1
+        scored = []
+        for tokens, length, example in self.docs.values():
+            score = 0.0
+            for term in query:
+                tf = tokens.get(term)
+                if not tf:
+                    continue
+                idf = math.log(1 + (n - self.df[term] + 0.5) / (self.df[term] + 0.5))
+                score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length))
+            scored.append((score, example))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [example for score, example in scored[:k] if score > 0]
+
+
+def _index_for(agent_key: str, seeds):
+    with _lock:
+        index = _indexes.get(agent_key)
+        if index is not None:
+            return index
+        index = BM25Index()
+        for seed in seeds:
+            index.add(seed)
+        try:
+            init_fewshot_table()
+            conn = sqlite3.connect(DB_PATH)
+            try:
+                rows = conn.execute(
+                    "SELECT question, plan, sql FROM fewshot_examples WHERE agent = ? AND verified = 1 "
+                    "ORDER BY created_at DESC LIMIT ?",
+                    (agent_key, FEWSHOT_MAX_EXAMPLES)
+                ).fetchall()
+            finally:
+                conn.close()
+            for question, plan, sql in reversed(rows):
+                index.add({"question": question, "plan": json.loads(plan), "sql": sql})
+        except sqlite3.Error as e:
+            print(f"⚠️ Few-shot index unavailable for {agent_key}: {e}")
+        _indexes[agent_key] = index
+        return index
+
+
+def clear_indexes():
+    """Drop the in-memory indexes; they are rebuilt from the table on next use."""
+    with _lock:
+        _indexes.clear()
+
+
+register_cache("fewshot.indexes", lambda: deep_size(_indexes), clear_indexes)
+
+
+def nearest_examples(agent_key: str, text: str, seeds, k: int = None):
+    """The k examples most similar to `text`; seeds when nothing matches."""
+    k = FEWSHOT_K if k is None else k
+    index = _index_for(agent_key, seeds)
+    with _lock:
+        found = index.search(text, k)
+    return found or list(seeds[:k])
+
+
+def add_example(agent_key: str, question: str, plan: dict, sql: str, seeds=(), verified: bool = False):
+    """
+    Record a successful question -> plan -> SQL triple. Only verified
+    examples are indexed, and an unverified run never replaces a verified
+    example for the same question.
+    """
+    example = {"question": _normalize_question(question), "plan": plan, "sql": sql}
+    try:
+        init_fewshot_table()
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            conn.execute(
+                """
+                INSERT INTO fewshot_examples (agent, question, plan, sql, created_at, verified)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (agent, question) DO UPDATE SET
+                    plan = excluded.plan,
+                    sql = excluded.sql,
+                    created_at = excluded.created_at,
+                    verified = excluded.verified
+                WHERE fewshot_examples.verified = 0 OR excluded.verified = 1
+                """,
+                (agent_key, example["question"], json.dumps(plan), sql, datetime.now().isoformat(), int(verified))
+            )
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not store few-shot example: {e}")
+    if not verified:
+        return
+    index = _index_for(agent_key, seeds)
+    with _lock:
+        index.add(example)
+
+
+def format_plan_examples(examples) -> str:
+    return "\n\n".join(
+        f'Q: "{ex["question"]}"\n{json.dumps(ex["plan"], ensure_ascii=False)}'
+        for ex in examples
+    )
+
+
+def format_sql_examples(examples) -> str:
+    return "\n\n".join(
+        f'Plan: {json.dumps(ex["plan"], ensure_ascii=False)}\nSQL:\n{ex["sql"]}'
+        for ex in examples
+    )
@@ -0,0 +1,234 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+from telemetry import record_llm_call, token_usage
+from resilience import breaker_for, call_timeout, hedge_delay, hedged_call, is_endpoint_failure
+from memory_accounting import register_cache, deep_size
+
+# =========================
+# SHARED LLM CLIENT REGISTRY
+# =========================
+# One ChatOpenAI client per stage profile (llm_profiles.json), shared by
+# app.py and every agent. Clients are built on first use (importing the
+# agents needs no credentials and does not import langchain), share a
+# single keep-alive HTTP connection pool, and can all be replaced with
+# set_llm() for tests and offline runs. Cheap stages (classification,
+# follow-up rewriting) can point at a small deployment with tight limits.
+# Every call goes through the deadline, hedging and circuit breaker in
+# resilience.py.
+
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT", 60))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 20))
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE", 120))
+
+DEFAULT_PROFILE = "default"
+PROFILES_FILE = Path(os.getenv("LLM_PROFILES_FILE", Path(__file__).resolve().parent / "llm_profiles.json"))
+
+_profiles = None
+_clients = {}     # profile name -> client
+_override = None
+_json_unsupported = set()   # deployments that rejected response_format
+_http_client = None
+_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+
+def http_client():
+    """Keep-alive HTTP transport shared by every LLM client."""
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            import httpx
+
+            _http_client = httpx.Client(
+                timeout=LLM_TIMEOUT_SECONDS,
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                    keepalive_expiry=LLM_KEEPALIVE_SECONDS
+                )
+            )
+        return _http_client
+
+
+def _pool_connections():
+    """Open connections of the shared transport (httpcore pool, best effort)."""
+    pool = getattr(getattr(_http_client, "_transport", None), "_pool", None)
+    return list(getattr(pool, "connections", []))
+
+
+register_cache("llm.http_pool", lambda: deep_size(_pool_connections()), kind="pool")
+
+
+def load_profiles() -> dict:
+    """Stage profiles from LLM_PROFILES_FILE; ${VAR} values are read from the environment."""
+    global _profiles
+    if _profiles is None:
+        load_dotenv()
+        profiles = {}
+        if PROFILES_FILE.exists():
+            profiles = json.loads(PROFILES_FILE.read_text(encoding="utf-8"))
+        profiles = {k: v for k, v in profiles.items() if not k.startswith("_")}
+        for settings in profiles.values():
+            for key, value in settings.items():
+                if isinstance(value, str) and "${" in value:
+                    expanded = os.path.expandvars(value)
+                    settings[key] = None if "${" in expanded else expanded   # None: variable not set
+        profiles.setdefault(DEFAULT_PROFILE, {})
+        _profiles = profiles
+    return _profiles
+
+
+def profile_settings(profile: str) -> dict:
+    """Settings of a profile, unset values falling back to the default profile and env."""
+    profiles = load_profiles()
+    settings = {**profiles[DEFAULT_PROFILE]}
+    settings.update({k: v for k, v in profiles.get(profile, {}).items() if v is not None})
+    if not settings.get("deployment"):
+        settings["deployment"] = os.getenv("AZURE_OPENAI_MODEL")  # Deployment name
+    if settings.get("temperature") is None:
+        settings["temperature"] = float(os.getenv("LLM_TEMPERATURE", 0.3))
+    return settings
+
+
+def load_llm(profile: str = DEFAULT_PROFILE):
+    """Azure OpenAI using ChatOpenAI with base_url, configured for one stage profile"""
+    from langchain_openai import ChatOpenAI
+
+    load_dotenv()
+    settings = profile_settings(profile)
+
+    azure_api_key = os.getenv("AZURE_OPENAI_API_KEY")
+    base_url = os.getenv("AZURE_OPENAI_ENDPOINT")  # Full URL with /openai/v1/
+    azure_model = settings["deployment"]
+
+    if not azure_api_key:
+        raise ValueError("AZURE_OPENAI_API_KEY not set")
+    if not base_url:
+        raise ValueError("AZURE_OPENAI_ENDPOINT not set")
+    if not azure_model:
+        raise ValueError("AZURE_OPENAI_MODEL (deployment name) not set")
+
+    print(f"🔧 LLM profile '{profile}': {azure_model} at {base_url}")
+
+    return ChatOpenAI(
+        api_key=azure_api_key,
+        base_url=base_url,
+        model=azure_model,
+        temperature=settings["temperature"],
+        max_tokens=settings.get("max_tokens"),
+        timeout=settings.get("timeout") or LLM_TIMEOUT_SECONDS,
+        streaming=False,
+        http_client=http_client()
+    )
+
+
+def get_llm(profile: str = DEFAULT_PROFILE):
+    """The process-wide client for a profile, created on first use."""
+    if _override is not None:
+        return _override
+    client = _clients.get(profile)
+    if client is None:
+        with _build_lock:
+            client = _clients.get(profile)
+            if client is None:
+                client = _clients[profile] = load_llm(profile)
+    return client
+
+
+def set_llm(client):
+    """Replace the clients of every profile (tests, fake LLMs). None resets to lazy loading."""
+    global _override
+    with _build_lock:
+        _override = client
+        _clients.clear()
+
+
+def _json_client(client, deployment: str):
+    """Client bound to JSON output mode, unless this deployment rejected it before."""
+    if deployment in _json_unsupported or not hasattr(client, "bind"):
+        return None
+    return client.bind(response_format={"type": "json_object"})
+
+
+def _send(client, messages, deployment: str, json_mode: bool):
+    json_client = _json_client(client, deployment) if json_mode else None
+    try:
+        return (json_client or client).invoke(messages)
+    except Exception as e:
+        if json_client is None or "response_format" not in str(e):
+            raise
+        # Endpoint/deployment without JSON mode: remember and fall back
+        print(f"⚠️ JSON mode not supported by {deployment}, using plain output")
+        _json_unsupported.add(deployment)
+        return client.invoke(messages)
+
+
+def invoke(messages, profile: str = DEFAULT_PROFILE, json_mode: bool = False, label: str = None) -> str:
+    """
+    Send chat messages with a stage profile and return the reply text.
+    json_mode asks for a JSON object where the endpoint supports it.
+    Telemetry is recorded under `label` (defaults to the profile name).
+    Raises LLMUnavailable while the deployment's breaker is open, and
+    LLMTimeout / DeadlineExceeded when the call or question runs out of time.
+    """
+    client = get_llm(profile)
+    settings = profile_settings(profile)
+    deployment = settings["deployment"] if _override is None else "override"
+    label = label or profile
+    breaker = breaker_for(deployment)
+    # Before before_call(): a question already out of time must not take the probe
+    timeout, bound_by_deadline = call_timeout(settings.get("timeout") or LLM_TIMEOUT_SECONDS)
+    hedge_after = hedge_delay(label) if settings.get("hedge", True) else None
+    breaker.before_call()
+
+    started = time.perf_counter()
+    try:
+        response = hedged_call(
+            lambda: _send(client, messages, deployment, json_mode), timeout, hedge_after, bound_by_deadline
+        )
+    except Exception as e:
+        record_llm_call(label, deployment, time.perf_counter() - started, error=True)
+        # A rejected prompt or the question's own deadline says nothing about the endpoint
+        if is_endpoint_failure(e):
+            breaker.record_failure()
+        raise
+    finally:
+        # A probe that ended without record_failure/record_success must not
+        # leave the breaker open for good
+        breaker.release_probe()
+    breaker.record_success()
+    input_tokens, output_tokens = token_usage(response)
+    cost = (input_tokens * (settings.get("input_cost_per_1k") or 0)
+            + output_tokens * (settings.get("output_cost_per_1k") or 0)) / 1000
+    record_llm_call(label, deployment, time.perf_counter() - started, input_tokens, output_tokens, cost)
+    return response.content
+
+
+def warm_up(background: bool = True):
+    """
+    Build the client and open the HTTP connection ahead of the first
+    question, so it does not pay for TCP/TLS setup. Errors are ignored:
+    the real request reports them.
+    """
+    client = get_llm()
+
+    def connect():
+        base_url = getattr(client, "openai_api_base", None)
+        if not base_url:
+            return
+        try:
+            http_client().get(base_url.rstrip("/") + "/models", timeout=5)
+        except Exception as e:
+            print(f"⚠️ LLM warm-up failed: {e}")
+
+    if background:
+        threading.Thread(target=connect, name="llm-warmup", daemon=True).start()
+    else:
+        connect()
+    return client
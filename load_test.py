@@ -0,0 +1,528 @@
+import argparse
+import json
+import random
+import re
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import chat_memory
+import cross_views
+import fewshot_index
+import slow_query_log
+import sql_repair
+import template_cache
+from chat_memory import init_chat_table, save_message, get_last_messages
+from llm_registry import set_llm
+from pipeline import AGENTS
+from decomposer import mentioned_agents
+from fewshot_index import tokenize
+from router import (
+    is_general_question, answer_general_question, route_data_question, fallback_route, submit_route,
+    is_followup_question, rewrite_question, estimate_llm_calls
+)
+from admission import get_admission, AdmissionRejected
+from resilience import question_deadline
+from memory_accounting import rss_mb
+
+# =========================
+# LOAD TEST
+# =========================
+# Simulates concurrent chat sessions against one app process. Each session
+# runs the app's question flow (save_message, follow-up rewrite, general
+# check, routing, execute_query on the worker pool, save_message) with a
+# think time between questions. The LLM is LocalLLM, a stand-in that answers
+# every stage from the agents' FEWSHOT_SEEDS after a configurable latency,
+# and the data is a generated fixture converted.db, so a run measures this
+# process and SQLite rather than Azure.
+#
+#   python load_test.py --levels 1,4,8,16 --questions 10 --llm-latency 0.4
+#
+# For every concurrency level it reports throughput, latency percentiles,
+# error and shed rates, SQLite write/lock waits and memory growth. Chat
+# memory and the shared caches (templates, few-shot, SQL fixes, fact
+# tables) are written to the fixture, never to the real converted.db, and
+# query timings to a slow-query log next to it.
+
+LOAD_LEVELS = (1, 2, 4, 8, 16)
+LOAD_QUESTIONS_PER_SESSION = 10
+LOAD_THINK_SECONDS = 1.0        # mean pause between a session's questions
+LOCAL_LLM_LATENCY = 0.3         # seconds per stand-in call, +/- LOCAL_LLM_JITTER
+LOCAL_LLM_JITTER = 0.5
+FIXTURE_BOOTHS = 200
+FIXTURE_PATH = Path(tempfile.gettempdir()) / "load_test_converted.db"
+
+GENERAL_QUESTIONS = ["hi", "hello", "what can you do?", "who are you?"]
+FOLLOWUP_QUESTIONS = ["what about completed work?", "also for the same period?", "then for that booth?"]
+
+
+# =========================
+# LOCAL LLM STAND-IN
+# =========================
+class _Reply:
+    """The parts of a LangChain chat response that llm_registry reads."""
+
+    def __init__(self, content: str, prompt_chars: int):
+        self.content = content
+        self.usage_metadata = {"input_tokens": prompt_chars // 4, "output_tokens": max(len(content) // 4, 1)}
+
+
+def _closest_seed(seeds, text: str, key):
+    words = set(tokenize(text))
+    return max(seeds, key=lambda seed: len(words & set(tokenize(key(seed)))))
+
+
+class LocalLLM:
+    """
+    Stand-in chat client for load tests (install with llm_registry.set_llm).
+    It recognizes each stage by its prompt and replies with the closest
+    FEWSHOT_SEEDS plan or SQL of the agent whose schema is in the prompt,
+    so every question runs real SQL against the fixture database.
+    """
+
+    def __init__(self, latency=LOCAL_LLM_LATENCY, jitter=LOCAL_LLM_JITTER, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._seed_questions = {
+            seed["question"].lower() for module in AGENTS.values() for seed in module.FEWSHOT_SEEDS
+        }
+
+    def invoke(self, messages):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency * self._random.uniform(1 - self.jitter, 1 + self.jitter)
+            fail = self._random.random() < self.error_rate
+        time.sleep(delay)
+        if fail:
+            raise ConnectionError("LocalLLM: injected failure")
+        return _Reply(self.reply(messages), sum(len(str(m["content"])) for m in messages))
+
+    def _agent_module(self, system: str):
+        for module in AGENTS.values():
+            if module.SCHEMA_TEXT.strip() in system:
+                return module
+        return None
+
+    def reply(self, messages) -> str:
+        prompt = messages[-1]["content"]
+        question = re.search(r'Question: "([^"\n]*)', prompt)
+        question = question.group(1) if question else ""
+
+        if "Classify the question." in prompt:
+            return "GENERAL" if question.strip().lower() in GENERAL_QUESTIONS else "DATA"
+        if "VISITOR, HIERARCHY, or BENEFICIARY" in prompt:
+            agents = mentioned_agents(question)
+            return (agents[0] if agents else "visitor").upper()
+        if "Split the question into independent sub-questions" in prompt:
+            return json.dumps({"parts": [{"agent": agent, "question": question} for agent in mentioned_agents(question)]})
+        if "rewriting a follow-up question" in prompt:
+            previous = re.search(r"Previous question:\n(.*)\n", prompt).group(1)
+            followup = re.search(r"Follow-up question:\n(.*)\n", prompt).group(1)
+            return followup if followup.lower() in self._seed_questions else previous
+        if "helpful AI assistant for a Constituency" in prompt:
+            return "I answer questions about visitors, booths, wards and beneficiaries."
+
+        system = messages[0]["content"] if messages[0]["role"] == "system" else ""
+        module = self._agent_module(system)
+        if module is not None and "query planner" in system:
+            seed = _closest_seed(module.FEWSHOT_SEEDS, messages[1]["content"], lambda s: s["question"])
+            return json.dumps(seed["plan"])
+        if module is not None:
+            plan = messages[1]["content"]
+            for seed in module.FEWSHOT_SEEDS:
+                if json.dumps(seed["plan"]) == plan:
+                    return seed["sql"]
+            return _closest_seed(module.FEWSHOT_SEEDS, plan, lambda s: json.dumps(s["plan"]))["sql"]
+        return "Here is a short summary of the results."
+
+
+# =========================
+# FIXTURE DATABASE
+# =========================
+# Source tables are created from the agents' SCHEMA_TEXT and filled with
+# generated rows. Hierarchy columns are derived from one booth number per
+# row, so booths, shakti kendras and wards line up across the three tables
+# (and the cross-domain fact tables have something to join).
+INTEGER_TYPES = {"INTEGER", "INT", "BIGINT", "SMALLINT", "SERIAL"}
+DATE_TYPES = {"DATE", "TIMESTAMP", "DATETIME"}
+
+SOURCE_MODULES = {
+    "visitor_details": "visitor",
+    "beneficiary_master": "beneficiary",
+    "constituency_hierarchy": "hierarchy"
+}
+ROWS_PER_BOOTH = {"visitor_details": 20, "beneficiary_master": 10, "constituency_hierarchy": 1}
+
+
+def _column_specs(schema_text: str):
+    """[(column, type), ...] from an agent's SCHEMA_TEXT."""
+    specs = {}
+    for column, sql_type in re.findall(r"^- ([a-z_][a-z0-9_]*) ([A-Za-z]+)", schema_text, re.MULTILINE):
+        specs.setdefault(column, sql_type.upper())
+    return list(specs.items())
+
+
+def _hierarchy_value(column: str, booth: int):
+    # Joined copies of hierarchy columns: booth_no_key, ward_id_1, mp_seat_id_hier...
+    column = re.sub(r"_(key|1|hier)$", "", column)
+    hierarchy = AGENTS["hierarchy"].ENTITY_VALUES
+    values = {
+        "booth_mas_id": 10000 + booth,
+        "booth_no": booth,
+        "booth": booth,
+        "booth_name": f"{booth}-BOOTH {booth}",
+        "booth_name_guj": f"{booth}-BOOTH {booth}",
+        "shaktikendra_mas_id": 2000 + booth // 5,
+        "shaktikendra_name": f"SHAKTIKENDRA {booth // 5 + 1}",
+        "ward_mas_id": 500 + booth // 20,
+        "ward_id": booth // 20 + 1,
+        "ward_name": f"WARD {booth // 20 + 1}",
+        "mandal_mas_id": 300 + booth // 40,
+        "ac_no": 163 + booth // 100,
+        "assembly_name": hierarchy["assembly"][booth // 100 % len(hierarchy["assembly"])],
+        "assembly_incharge": hierarchy["incharge"][booth // 100 % len(hierarchy["incharge"])],
+        "mp_seat_id": 1,
+        "state_id": 1
+    }
+    return values.get(column)
+
+
+def _fixture_value(column: str, sql_type: str, booth: int, rnd: random.Random):
+    value = _hierarchy_value(column, booth)
+    if value is not None:
+        return value
+    if column == "vis_work_status":
+        return rnd.choice(["Complete", "Pending"])
+    if column == "beneficiary_item_name":
+        return rnd.choice(AGENTS["beneficiary"].ENTITY_VALUES["scheme"])
+    if column in ("vis_contact_no", "benf_mobile"):
+        return f"9{rnd.randint(0, 20 * FIXTURE_BOOTHS):09d}"
+    if sql_type in DATE_TYPES or "date" in column:
+        day = date.today() - timedelta(days=rnd.randint(0, 730))
+        if sql_type == "DATE":
+            return day.isoformat()
+        return f"{day.isoformat()} {rnd.randint(8, 19):02d}:{rnd.randint(0, 59):02d}:00"
+    if sql_type in INTEGER_TYPES:
+        return rnd.randint(1, 50)
+    return f"{column.upper()} {rnd.randint(1, 20)}"
+
+
+def build_fixture(path: Path = FIXTURE_PATH, booths: int = FIXTURE_BOOTHS, seed: int = 0) -> Path:
+    """Create a fresh fixture database with the three source tables."""
+    path = Path(path)
+    path.unlink(missing_ok=True)
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    try:
+        for table, agent_key in SOURCE_MODULES.items():
+            specs = [(c, t) for c, t in _column_specs(AGENTS[agent_key].SCHEMA_TEXT) if c != "id"]
+            columns = ", ".join(
+                f"{c} {'INTEGER' if t in INTEGER_TYPES else 'TEXT'}" for c, t in specs
+            )
+            conn.execute(f"CREATE TABLE {table} (id INTEGER PRIMARY KEY, {columns})")
+            rows = [
+                tuple(_fixture_value(c, t, booth, rnd) for c, t in specs)
+                for booth in range(1, booths + 1)
+                for _ in range(ROWS_PER_BOOTH[table])
+            ]
+            conn.executemany(
+                f"INSERT INTO {table} ({', '.join(c for c, _ in specs)}) VALUES ({', '.join('?' * len(specs))})",
+                rows
+            )
+            print(f"🧪 {table}: {len(rows)} rows")
+        conn.commit()
+    finally:
+        conn.close()
+    return path
+
+
+def use_database(path: Path):
+    """
+    Point the agents, chat memory and every converted.db cache at `path`,
+    and the slow-query log at a file next to it, so fixture timings never
+    mix with the real log.
+    """
+    for module in (chat_memory, cross_views, fewshot_index, sql_repair, template_cache):
+        module.DB_PATH = path
+    for module in AGENTS.values():
+        module.SQLITE_DB_PATH = path
+    slow_query_log.SLOW_QUERY_DB = path.with_name(f"{path.stem}_slow_queries.db")
+
+
+# =========================
+# SQLITE WAIT TRACKING
+# =========================
+# With SQLite's rollback journal a writer waits (up to the 5s busy timeout)
+# for every other connection to release the database, so under load the
+# time spent in write statements and commits is mostly lock wait.
+WRITE_STATEMENTS = ("INSERT", "UPDATE", "DELETE", "REPLACE", "CREATE", "DROP")
+
+
+class SqliteWaits:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.waits = []
+            self.locked_errors = 0
+
+    def record(self, seconds: float, locked: bool):
+        with self._lock:
+            self.waits.append(seconds)
+            self.locked_errors += int(locked)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = sorted(self.waits)
+            locked = self.locked_errors
+        return {
+            "writes": len(waits),
+            "wait_p95_ms": round(_percentile(waits, 95) * 1000, 1),
+            "wait_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+            "wait_total_s": round(sum(waits), 3),
+            "locked_errors": locked
+        }
+
+
+sqlite_waits = SqliteWaits()
+
+
+def _timed(run, sql=None):
+    if sql is not None and not sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+        return run()
+    started = time.perf_counter()
+    try:
+        result = run()
+    except sqlite3.OperationalError as e:
+        sqlite_waits.record(time.perf_counter() - started, "locked" in str(e))
+        raise
+    sqlite_waits.record(time.perf_counter() - started, False)
+    return result
+
+
+class _TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        return _timed(lambda: sqlite3.Cursor.execute(self, sql, *args), sql)
+
+    def executemany(self, sql, *args):
+        return _timed(lambda: sqlite3.Cursor.executemany(self, sql, *args), sql)
+
+
+class _TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def commit(self):
+        return _timed(super().commit)
+
+
+@contextmanager
+def track_sqlite():
+    """Route every sqlite3.connect() in the process through the timed connection."""
+    connect = sqlite3.connect
+
+    def timed_connect(*args, **kwargs):
+        kwargs.setdefault("factory", _TimedConnection)
+        return connect(*args, **kwargs)
+
+    sqlite3.connect = timed_connect
+    try:
+        yield sqlite_waits
+    finally:
+        sqlite3.connect = connect
+
+
+# =========================
+# SIMULATED SESSIONS
+# =========================
+class SimulatedSession:
+    """One chat user: asks questions in turn, the way app.py handles them."""
+
+    def __init__(self, session_id: str, rnd: random.Random, admission: bool = False):
+        self.session_id = session_id
+        self.rnd = rnd
+        self.admission = admission
+        self.last_question = None
+
+    def pick_question(self, pool) -> str:
+        roll = self.rnd.random()
+        if roll < 0.1:
+            return self.rnd.choice(GENERAL_QUESTIONS)
+        if roll < 0.25 and self.last_question:
+            return self.rnd.choice(FOLLOWUP_QUESTIONS)
+        return self.rnd.choice(pool)
+
+    def _answer(self, question: str):
+        """(outcome, answer text) for one question."""
+        if is_followup_question(question) and self.last_question:
+            question = rewrite_question(question, self.last_question, get_last_messages(8))
+
+        if is_general_question(question, get_last_messages(8)):
+            return "general", answer_general_question(question, get_last_messages(8))
+
+        route = route_data_question(question, get_last_messages(8))
+        result = submit_route(route, question).result()
+        retry = fallback_route(route, question, result)
+        if retry:
+            result = submit_route(retry, question).result()
+
+        if result["success"]:
+            self.last_question = question
+            return "data", result["answer"]
+        if result.get("too_expensive"):
+            return "too_expensive", result["error"]
+        return ("degraded" if result.get("degraded") else "failed"), result["error"]
+
+    def ask(self, question: str) -> dict:
+        started = time.perf_counter()
+        save_message("user", question)
+        ticket = None
+        try:
+            if self.admission:
+                cost, priority = estimate_llm_calls(question)
+                ticket = get_admission().admit(self.session_id, cost, priority)
+            with question_deadline():
+                outcome, answer = self._answer(question)
+        except AdmissionRejected as e:
+            outcome, answer = "shed", f"Please ask again in about {e.retry_after:.0f} seconds."
+        except Exception as e:
+            outcome, answer = "error", str(e)
+        finally:
+            if ticket is not None:
+                ticket.release()
+        save_message("assistant", answer)
+        return {"outcome": outcome, "seconds": time.perf_counter() - started}
+
+    def run(self, pool, questions: int, think_seconds: float):
+        turns = []
+        for _ in range(questions):
+            turns.append(self.ask(self.pick_question(pool)))
+            time.sleep(self.rnd.uniform(0, 2 * think_seconds))
+        return turns
+
+
+def question_pool():
+    """Every agent's seed questions: each one has a plan and SQL the stand-in can serve."""
+    return [seed["question"] for module in AGENTS.values() for seed in module.FEWSHOT_SEEDS]
+
+
+def _percentile(ordered, pct):
+    if not ordered:
+        return 0.0
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def run_level(concurrency: int, llm: LocalLLM, questions: int = LOAD_QUESTIONS_PER_SESSION,
+              think_seconds: float = LOAD_THINK_SECONDS, admission: bool = False, seed: int = 0) -> dict:
+    """Run `concurrency` sessions at once and return the level's report."""
+    pool = question_pool()
+    sessions = [
+        SimulatedSession(f"load-{concurrency}-{i}", random.Random(seed * 1000 + i), admission)
+        for i in range(concurrency)
+    ]
+    sqlite_waits.reset()
+    calls_before = llm.calls
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="session") as executor:
+        futures = [executor.submit(s.run, pool, questions, think_seconds) for s in sessions]
+        turns = [turn for future in futures for turn in future.result()]
+    wall = time.perf_counter() - started
+
+    latencies = sorted(t["seconds"] for t in turns if t["outcome"] != "shed")
+    outcomes = Counter(t["outcome"] for t in turns)
+    errors = outcomes["failed"] + outcomes["degraded"] + outcomes["error"]
+    return {
+        "concurrency": concurrency,
+        "questions": len(turns),
+        "wall_seconds": round(wall, 2),
+        "questions_per_minute": round(len(turns) / wall * 60, 1) if wall else None,
+        "latency_p50": round(_percentile(latencies, 50), 2),
+        "latency_p95": round(_percentile(latencies, 95), 2),
+        "latency_p99": round(_percentile(latencies, 99), 2),
+        "latency_mean": round(statistics.mean(latencies), 2) if latencies else None,
+        "error_rate": round(errors / len(turns), 3) if turns else 0.0,
+        "shed_rate": round(outcomes["shed"] / len(turns), 3) if turns else 0.0,
+        "outcomes": dict(outcomes),
+        "llm_calls": llm.calls - calls_before,
+        "sqlite": sqlite_waits.snapshot(),
+        "rss_mb": round(rss_mb(), 1),
+        "rss_growth_mb": round(rss_mb() - rss_before, 1)
+    }
+
+
+def print_level(report: dict):
+    sqlite_stats = report["sqlite"]
+    print(
+        f"  {report['concurrency']:>4} sessions  {report['questions_per_minute']:>7} q/min  "
+        f"p50 {report['latency_p50']:>6.2f}s  p95 {report['latency_p95']:>6.2f}s  p99 {report['latency_p99']:>6.2f}s  "
+        f"errors {report['error_rate']:.1%}  shed {report['shed_rate']:.1%}  "
+        f"sqlite wait p95 {sqlite_stats['wait_p95_ms']}ms (locked {sqlite_stats['locked_errors']})  "
+        f"rss {report['rss_mb']}MB (+{report['rss_growth_mb']})"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent chat sessions against a local LLM stand-in.")
+    parser.add_argument("--levels", default=",".join(map(str, LOAD_LEVELS)),
+                        help="comma-separated session counts to ramp through")
+    parser.add_argument("--questions", type=int, default=LOAD_QUESTIONS_PER_SESSION, help="questions per session")
+    parser.add_argument("--think", type=float, default=LOAD_THINK_SECONDS, help="mean seconds between questions")
+    parser.add_argument("--llm-latency", type=float, default=LOCAL_LLM_LATENCY)
+    parser.add_argument("--llm-jitter", type=float, default=LOCAL_LLM_JITTER)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--booths", type=int, default=FIXTURE_BOOTHS, help="fixture size")
+    parser.add_argument("--db", type=Path, default=FIXTURE_PATH, help="fixture database (rebuilt)")
+    parser.add_argument("--admission", action="store_true", help="admit questions through admission.py")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=Path, help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    db_path = build_fixture(args.db, args.booths, args.seed)
+    use_database(db_path)
+    init_chat_table()
+    cross_views.refresh_cross_views(force=True)
+    llm = LocalLLM(args.llm_latency, args.llm_jitter, args.llm_error_rate, args.seed)
+    set_llm(llm)
+
+    print(f"🚀 Load test on {db_path} (LLM stand-in {args.llm_latency}s ± {args.llm_jitter:.0%})")
+    levels = []
+    with track_sqlite():
+        for concurrency in (int(level) for level in args.levels.split(",")):
+            report = run_level(concurrency, llm, args.questions, args.think, args.admission, args.seed)
+            print_level(report)
+            levels.append(report)
+    set_llm(None)
+
+    result = {
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "settings": {k: str(v) if isinstance(v, Path) else v for k, v in vars(args).items()},
+        "levels": levels
+    }
+    if args.output:
+        args.output.write_text(json.dumps(result, indent=2), encoding="utf-8")
+        print(f"📄 Report written to {args.output}")
+    return result
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import types
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+from telemetry import count_event
+
+# =========================
+# MEMORY ACCOUNTING
+# =========================
+# Bytes held by each chat session (its messages and cached preview frames),
+# by every in-process cache layer and by the connection pools, plus
+# tracemalloc snapshots on demand. Two ceilings are enforced:
+#
+#   MEMORY_SESSION_MAX_BYTES  one session, checked after each of its questions
+#   MEMORY_GLOBAL_MAX_BYTES   all sessions + caches: cache layers are cleared
+#                             largest first, then the largest sessions are
+#                             trimmed at their next question
+#
+# Trimming a session drops its cached preview frames, then the inline rows
+# of its oldest results (previews page them back from the result store or
+# the DB), then its oldest messages beyond MEMORY_KEEP_MESSAGES (they stay
+# in the conversations table). Sizes are estimates from a recursive
+# sys.getsizeof walk; DataFrames and Arrow/numpy data report their buffers.
+#
+# Modules register their caches with register_cache(name, size_fn,
+# evict_fn, kind); kind "pool" and "disk" layers are reported but not
+# counted against the global ceiling.
+
+BASE_DIR = Path(__file__).resolve().parent
+MEMORY_SESSION_MAX_BYTES = int(os.getenv("MEMORY_SESSION_MAX_BYTES", 64 * 1024 * 1024))
+MEMORY_GLOBAL_MAX_BYTES = int(os.getenv("MEMORY_GLOBAL_MAX_BYTES", 1024 * 1024 * 1024))
+MEMORY_KEEP_MESSAGES = int(os.getenv("MEMORY_KEEP_MESSAGES", 10))
+MEMORY_CHECK_SECONDS = float(os.getenv("MEMORY_CHECK_SECONDS", 30))   # cache sizes are re-measured at most this often
+MEMORY_TRACEMALLOC = os.getenv("MEMORY_TRACEMALLOC", "off").lower()    # "on" traces from startup
+SNAPSHOT_DIR = Path(os.getenv("MEMORY_SNAPSHOT_DIR", BASE_DIR / "memory_snapshots"))
+TRACEMALLOC_FRAMES = 10
+SNAPSHOT_TOP_LINES = 20
+SESSION_IDLE_SECONDS = 3600     # forget sessions that stopped asking
+SIZE_MAX_DEPTH = 12
+
+_lock = threading.Lock()
+_caches = {}        # name -> (size_fn, evict_fn, kind)
+_cache_sizes = (0.0, {})    # (measured at, name -> bytes)
+_sessions = {}      # session id -> {"bytes", "messages", "frames", "updated", "trim_to"}
+_last_snapshot = None
+
+SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType)
+
+
+def deep_size(obj, _seen=None, _depth=0) -> int:
+    """Approximate bytes reachable from obj; shared objects are counted once."""
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen or _depth > SIZE_MAX_DEPTH or isinstance(obj, SKIPPED_TYPES):
+        return 0
+    seen.add(id(obj))
+
+    if type(obj).__module__.startswith("pandas"):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum() if hasattr(usage, "sum") else usage)
+    nbytes = getattr(obj, "nbytes", None)   # numpy arrays, Arrow tables and arrays
+    if isinstance(nbytes, int):
+        return max(sys.getsizeof(obj), nbytes)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool, type(None))):
+        return size
+    if isinstance(obj, dict):
+        size += sum(deep_size(k, seen, _depth + 1) + deep_size(v, seen, _depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_size(item, seen, _depth + 1) for item in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen, _depth + 1)
+    return size
+
+
+def rss_mb() -> float:
+    """Resident memory of this process (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# =========================
+# CACHE LAYERS
+# =========================
+def register_cache(name: str, size_fn, evict_fn=None, kind: str = "memory"):
+    """size_fn() -> bytes held; evict_fn() empties the cache (None = not evictable)."""
+    with _lock:
+        _caches[name] = (size_fn, evict_fn, kind)
+
+
+def cache_sizes(max_age: float = 0) -> dict:
+    """name -> bytes for every registered layer, re-measured when older than max_age."""
+    global _cache_sizes
+    with _lock:
+        measured_at, sizes = _cache_sizes
+        caches = dict(_caches)
+    if time.monotonic() - measured_at <= max_age and sizes.keys() == caches.keys():
+        return dict(sizes)
+    sizes = {}
+    for name, (size_fn, _, _) in caches.items():
+        try:
+            sizes[name] = int(size_fn())
+        except Exception as e:
+            print(f"⚠️ Could not size cache {name}: {e}")
+            sizes[name] = 0
+    with _lock:
+        _cache_sizes = (time.monotonic(), sizes)
+    return dict(sizes)
+
+
+def _evict_cache(name: str):
+    global _cache_sizes
+    with _lock:
+        _, evict_fn, _ = _caches[name]
+        _cache_sizes = (0.0, {})
+    evict_fn()
+    count_event("memory.cache_evicted")
+
+
+# =========================
+# SESSIONS
+# =========================
+def _drop_rows(data) -> int:
+    """Release the inline rows of one result payload; bytes freed."""
+    if not data or data.get("evicted") or not ("rows" in data or "preview" in data):
+        return 0
+    if "result" not in data and not data.get("sql"):
+        return 0    # inline-only rows (drill-downs, multi-part answers): nothing to page them back from
+    before = deep_size(data)
+    data.pop("rows", None)
+    data.pop("preview", None)
+    if "result" not in data:
+        data["cached_rows"] = 0    # previews page the DB instead
+    data["evicted"] = True
+    return before - deep_size(data)
+
+
+def trim_session(messages: list, frames, to_free: int) -> int:
+    """Free about `to_free` bytes from one session's state, cheapest losses first. Bytes freed."""
+    freed = 0
+    while frames and freed < to_free:
+        _, frame = frames.popitem(last=False)
+        freed += deep_size(frame)
+    for message in messages[:-1]:       # oldest first; the latest answer keeps its rows
+        if freed >= to_free:
+            break
+        freed += _drop_rows(message.get("data"))
+    while freed < to_free and len(messages) > MEMORY_KEEP_MESSAGES:
+        freed += deep_size(messages.pop(0))
+    return freed
+
+
+def _session_sizes(state) -> dict:
+    messages = state.get("messages") or []
+    frames = state.get("_frame_cache") or {}
+    return {"messages": deep_size(messages), "frames": deep_size(frames)}
+
+
+def account_session(session_id: str, state) -> int:
+    """
+    Measure one session's state (st.session_state or any mapping with
+    "messages" / "_frame_cache"), record it and enforce both ceilings.
+    Returns the session's bytes after trimming.
+    """
+    sizes = _session_sizes(state)
+    with _lock:
+        entry = _sessions.setdefault(session_id, {"trim_to": None})
+        entry.update(sizes, bytes=sum(sizes.values()), updated=time.time())
+        _forget_idle_sessions()
+
+    enforce_global_ceiling()
+
+    with _lock:
+        limit = min(MEMORY_SESSION_MAX_BYTES, entry["trim_to"] or MEMORY_SESSION_MAX_BYTES)
+        entry["trim_to"] = None
+    total = sum(sizes.values())
+    if total > limit:
+        freed = trim_session(state.get("messages") or [], state.get("_frame_cache"), total - limit)
+        count_event("memory.session_trimmed")
+        print(f"🧹 Session {session_id[:8]} trimmed by {freed / 2 ** 20:.1f} MB (limit {limit / 2 ** 20:.1f} MB)")
+        sizes = _session_sizes(state)
+        with _lock:
+            entry.update(sizes, bytes=sum(sizes.values()))
+    return entry["bytes"]
+
+
+def _forget_idle_sessions():
+    """Called with the lock held."""
+    cutoff = time.time() - SESSION_IDLE_SECONDS
+    for session_id in [sid for sid, entry in _sessions.items() if entry["updated"] < cutoff]:
+        del _sessions[session_id]
+
+
+def enforce_global_ceiling():
+    """Clear cache layers, then mark the largest sessions for trimming, until under the global ceiling."""
+    sizes = cache_sizes(MEMORY_CHECK_SECONDS)
+    with _lock:
+        memory_layers = {name: sizes.get(name, 0) for name, (_, _, kind) in _caches.items() if kind == "memory"}
+        evictable = [name for name, (_, evict_fn, kind) in _caches.items() if kind == "memory" and evict_fn]
+        session_bytes = sum(entry["bytes"] for entry in _sessions.values())
+    over = session_bytes + sum(memory_layers.values()) - MEMORY_GLOBAL_MAX_BYTES
+    if over <= 0:
+        return
+
+    for name in sorted(evictable, key=lambda n: memory_layers[n], reverse=True):
+        if not memory_layers[name]:
+            break
+        print(f"🧹 Memory over the global ceiling, clearing {name} ({memory_layers[name] / 2 ** 20:.1f} MB)")
+        _evict_cache(name)
+        over -= memory_layers[name]
+        if over <= 0:
+            return
+
+    with _lock:
+        for entry in sorted(_sessions.values(), key=lambda e: e["bytes"], reverse=True):
+            if over <= 0:
+                break
+            cut = min(entry["bytes"] // 2, over)
+            entry["trim_to"] = entry["bytes"] - cut
+            over -= cut
+
+
+# =========================
+# REPORTS AND SNAPSHOTS
+# =========================
+def memory_report() -> dict:
+    sizes = cache_sizes()
+    with _lock:
+        kinds = {name: kind for name, (_, _, kind) in _caches.items()}
+        sessions = {sid: dict(entry) for sid, entry in _sessions.items()}
+    largest = sorted(sessions.items(), key=lambda item: item[1]["bytes"], reverse=True)[:5]
+    return {
+        "rss_mb": round(rss_mb(), 1),
+        "threads": threading.active_count(),
+        "sessions": {
+            "count": len(sessions),
+            "bytes": sum(entry["bytes"] for entry in sessions.values()),
+            "largest": [
+                {"session": sid[:8], "bytes": entry["bytes"], "messages": entry["messages"], "frames": entry["frames"]}
+                for sid, entry in largest
+            ]
+        },
+        "caches": [
+            {"name": name, "kind": kinds.get(name, "memory"), "bytes": size}
+            for name, size in sorted(sizes.items(), key=lambda item: item[1], reverse=True)
+        ],
+        "limits": {"session_bytes": MEMORY_SESSION_MAX_BYTES, "global_bytes": MEMORY_GLOBAL_MAX_BYTES},
+        "tracing": tracemalloc.is_tracing()
+    }
+
+
+def session_bytes(session_id: str) -> int:
+    with _lock:
+        entry = _sessions.get(session_id)
+        return entry["bytes"] if entry else 0
+
+
+def take_snapshot(limit: int = SNAPSHOT_TOP_LINES):
+    """
+    tracemalloc snapshot: top allocation sites and growth since the last
+    snapshot, dumped to SNAPSHOT_DIR for offline comparison. Starts tracing
+    and returns None when it was not running (allocations before that are
+    invisible to tracemalloc).
+    """
+    global _last_snapshot
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        print("🔬 tracemalloc started")
+        return None
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    SNAPSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    path = SNAPSHOT_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.tracemalloc"
+    snapshot.dump(str(path))
+
+    stats = snapshot.statistics("lineno")
+    growth = snapshot.compare_to(_last_snapshot, "lineno") if _last_snapshot is not None else []
+    _last_snapshot = snapshot
+    count_event("memory.snapshot")
+    return {
+        "file": str(path),
+        "traced_bytes": sum(stat.size for stat in stats),
+        "top": [
+            {"where": str(stat.traceback[0]), "bytes": stat.size, "blocks": stat.count}
+            for stat in stats[:limit]
+        ],
+        "growth": [
+            {"where": str(stat.traceback[0]), "bytes": stat.size_diff, "blocks": stat.count_diff}
+            for stat in growth[:limit] if stat.size_diff > 0
+        ]
+    }
+
+
+if MEMORY_TRACEMALLOC == "on":
+    tracemalloc.start(TRACEMALLOC_FRAMES)
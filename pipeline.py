@@ -0,0 +1,329 @@
+import os
+import sqlite3
+import threading
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from agents import visitor_agent, hierarchy_agent, beneficiary_agent, cross_agent
+from answer_templates import render_answer, render_table_answer
+from query_guard import QueryTooExpensive
+from sql_repair import (
+    REPAIR_ATTEMPTS, REPAIR_BUDGET_SECONDS, is_repairable, fingerprint, cached_fix, remember_fix
+)
+from fewshot_index import add_example
+from decomposer import FANOUT_WORKERS, join_results, explain_combined
+from template_cache import lookup_template, learn_template, record_shadow_result, same_result
+from telemetry import count_event
+from resilience import DEGRADED_ERRORS
+from profiling import current_profile, profile_scope
+
+# =========================
+# AGENT MAPPING
+# =========================
+AGENTS = {
+    "visitor": visitor_agent,
+    "hierarchy": hierarchy_agent,
+    "beneficiary": beneficiary_agent,
+    # Cross-domain mode: booth/ward fact tables joining the three above (see cross_views.py)
+    "cross": cross_agent
+}
+
+# =========================
+# STAGE CONCURRENCY LIMITS
+# =========================
+# LLM-bound stages (plan, SQL, answer) and DB-bound stages (cost check,
+# execution) are limited separately, so a burst of questions cannot open
+# more Azure requests or SQLite readers than configured.
+
+LLM_CONCURRENCY = int(os.getenv("PIPELINE_LLM_CONCURRENCY", 4))
+DB_CONCURRENCY = int(os.getenv("PIPELINE_DB_CONCURRENCY", 2))
+
+_llm_slots = threading.BoundedSemaphore(LLM_CONCURRENCY)
+_db_slots = threading.BoundedSemaphore(DB_CONCURRENCY)
+
+# Sub-questions of a decomposed question get their own small pool: a
+# multi-intent job already occupies a QueryPool worker and must not wait
+# on that same pool for its parts.
+_fanout = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+
+
+@contextmanager
+def llm_stage():
+    with _llm_slots:
+        yield
+
+
+@contextmanager
+def db_stage():
+    with _db_slots:
+        yield
+
+
+def _noop_progress(stage: str):
+    pass
+
+
+def _run_checked(module, sql, progress):
+    """Validate, cost-check and run one SQL statement."""
+    progress("validate")
+    module.validate_sql(sql)
+    with db_stage():
+        module.guard_sql(sql)
+
+    progress("run")
+    with db_stage():
+        return module.run_sql(sql)
+
+
+def _plan_and_run(agent_key, module, question, progress):
+    """
+    Full pipeline: plan, SQL, and the bounded repair loop.
+    Returns (plan, sql, columns, rows, total, repaired).
+    """
+    # Step 1: Generate plan
+    progress("plan")
+    with llm_stage():
+        plan = module.generate_plan(question)
+
+    # Step 2: Generate SQL
+    progress("sql")
+    with llm_stage():
+        sql = module.generate_sql(plan)
+
+    # Steps 3-4: validate, cost-check and run. Validator/SQLite errors
+    # are fixed from the fix cache or sent back to SQL generation.
+    failures = []
+    attempts = 0
+    deadline = time.monotonic() + REPAIR_BUDGET_SECONDS
+    while True:
+        try:
+            columns, rows, total = _run_checked(module, sql, progress)
+            break
+        except (ValueError, sqlite3.OperationalError) as e:
+            if not is_repairable(e):
+                raise
+            print(f"🩹 SQL failed ({e}), repairing")
+            failures.append((sql, str(e)))
+            tried = {fingerprint(bad) for bad, _ in failures}
+
+            fixed = cached_fix(agent_key, sql, e)
+            if fixed is None or fingerprint(fixed) in tried:
+                if attempts >= REPAIR_ATTEMPTS or time.monotonic() > deadline:
+                    count_event("sql.repair_failed")
+                    raise
+                attempts += 1
+                count_event("sql.repair_llm")
+                progress("repair")
+                with llm_stage():
+                    fixed = module.generate_sql(plan, feedback=failures)
+            sql = fixed
+
+    if failures:
+        count_event("sql.repaired")
+        for bad_sql, error in failures:
+            remember_fix(agent_key, bad_sql, error, sql)
+    return plan, sql, columns, rows, total, bool(failures)
+
+
+def _explain(module, question, columns, rows, total, agent_key, lang):
+    """Templated answer for simple shapes, LLM otherwise; a plain table when the LLM is degraded."""
+    answer = None
+    if total == len(rows):
+        answer = render_answer(question, columns, rows, agent_key, lang)
+    if answer is None:
+        try:
+            with llm_stage():
+                answer = module.explain_answer(question, columns, rows, total)
+        except DEGRADED_ERRORS as e:
+            print(f"⚠️ Answer LLM unavailable ({e}), returning the table")
+            count_event("degraded.table_answer")
+            answer = render_table_answer(columns, rows, total, lang)
+    return answer
+
+
+def _degraded_error(e) -> dict:
+    return {
+        "success": False,
+        "degraded": True,
+        "error": str(e)
+    }
+
+
+def _shadow_check(agent_key, module, template, rows) -> bool:
+    """
+    Run the template's SQL and compare its rows with what the full pipeline
+    returned. True when the match counted as verification (new values).
+    """
+    try:
+        module.validate_sql(template["sql"])
+        with db_stage():
+            module.guard_sql(template["sql"])
+            _, template_rows, _ = module.run_sql(template["sql"])
+    except Exception as e:
+        print(f"⚠️ Template SQL failed in shadow mode: {e}")
+        record_shadow_result(agent_key, template, False)
+        return False
+    return record_shadow_result(agent_key, template, same_result(template_rows, rows))
+
+
+# =========================
+# EXECUTE QUERY
+# =========================
+def execute_query(agent_key, question, lang="English", progress=None):
+    """
+    Execute query using the appropriate agent.
+    `progress(stage)` is called as each stage starts: (template) plan, sql,
+    validate, run (repair), answer.
+    """
+    module = AGENTS[agent_key]
+    progress = progress or _noop_progress
+    sql = None
+    plan = None
+
+    try:
+        # Step 0: a known question shape answers without planner/SQL LLM calls
+        template = lookup_template(agent_key, module, question)
+        served = template is not None and template["servable"]
+        template_failed = False
+        if served:
+            progress("template")
+            sql = template["sql"]
+            try:
+                columns, rows, total = _run_checked(module, sql, progress)
+            except (ValueError, sqlite3.OperationalError) as e:
+                print(f"⚠️ Template SQL failed ({e}), running the full pipeline")
+                record_shadow_result(agent_key, template, False)
+                served = False
+                template_failed = True
+
+        degraded = False
+        if not served:
+            try:
+                plan, sql, columns, rows, total, repaired = _plan_and_run(agent_key, module, question, progress)
+            except DEGRADED_ERRORS as e:
+                # LLM degraded: an unverified template for the shape beats no
+                # answer, one that has ever mismatched does not
+                if template is None or template["sql"] is None or template["mismatches"]:
+                    raise
+                print(f"⚠️ Planner/SQL LLM unavailable ({e}), using the stored template")
+                count_event("degraded.template_sql")
+                progress("template")
+                sql = template["sql"]
+                columns, rows, total = _run_checked(module, sql, progress)
+                degraded = True
+
+        if not served and not degraded:
+            verified = False
+            if template is not None and template["sql"] is None:
+                learn_template(agent_key, template, sql)
+            elif template is not None and not template_failed:
+                # Shadow mode: would the template have produced the same result?
+                verified = _shadow_check(agent_key, module, template, rows)
+
+            # Example for the planner/SQL prompts. It is only shown once its SQL
+            # ran without repair and agreed with a template learned from another
+            # question (see fewshot_index.py)
+            if total:
+                add_example(agent_key, question, plan, sql, module.FEWSHOT_SEEDS, verified=verified and not repaired)
+
+        # Step 5: Generate answer - simple shapes are templated locally,
+        # everything else goes to the LLM with the actual data
+        progress("answer")
+        answer = _explain(module, question, columns, rows, total, agent_key, lang)
+
+        return {
+            "success": True,
+            "answer": answer,
+            "columns": columns,
+            "rows": rows,
+            "total": total,
+            "sql": sql,
+            "query_plan": plan,
+            "degraded": degraded
+        }
+
+    except QueryTooExpensive as e:
+        return {
+            "success": False,
+            "too_expensive": True,
+            "error": str(e),
+            "plan": e.plan,
+            "sql": sql
+        }
+    except DEGRADED_ERRORS as e:
+        return _degraded_error(e)
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+
+# =========================
+# EXECUTE MULTI-INTENT QUERY
+# =========================
+def execute_multi(question, decomposition, lang="English", progress=None):
+    """
+    Run each sub-question of a decomposed question through its agent's
+    plan/SQL/run steps concurrently, join the results on the shared key
+    and explain them with one LLM call. Same result shape as execute_query.
+    """
+    progress = progress or _noop_progress
+    join_key = decomposition["join_key"]
+    parts = decomposition["parts"]
+
+    def run_part(part):
+        module = AGENTS[part["agent"]]
+        with profile_scope(current_profile()):
+            plan, sql, columns, rows, total, _ = _plan_and_run(part["agent"], module, part["question"], progress)
+        if total:
+            # Stored unverified: a part's rows have nothing to be checked against
+            add_example(part["agent"], part["question"], plan, sql, module.FEWSHOT_SEEDS)
+        return plan, sql, columns, rows
+
+    try:
+        # Parts inherit the question's deadline and profile (see resilience.py, profiling.py)
+        futures = {
+            part["agent"]: _fanout.submit(contextvars.copy_context().run, run_part, part)
+            for part in parts
+        }
+        outputs = {agent: future.result() for agent, future in futures.items()}
+        results = {agent: (columns, rows) for agent, (_, _, columns, rows) in outputs.items()}
+        count_event("decompose.fanout")
+
+        columns, rows = join_results(results, join_key)
+        if not columns:
+            raise ValueError(f"No sub-result could be joined on {join_key}")
+
+        progress("answer")
+        try:
+            with llm_stage():
+                answer = explain_combined(question, columns, rows, len(rows))
+        except DEGRADED_ERRORS as e:
+            print(f"⚠️ Answer LLM unavailable ({e}), returning the table")
+            count_event("degraded.table_answer")
+            answer = render_table_answer(columns, rows, len(rows), lang)
+
+        return {
+            "success": True,
+            "answer": answer,
+            "columns": columns,
+            "rows": rows,
+            "total": len(rows),
+            "sql": None,
+            "query_plan": {agent: plan for agent, (plan, _, _, _) in outputs.items()},
+            "part_sql": {agent: sql for agent, (_, sql, _, _) in outputs.items()},
+            "agents": [part["agent"] for part in parts]
+        }
+
+    except DEGRADED_ERRORS as e:
+        count_event("decompose.failed")
+        return _degraded_error(e)
+    except Exception as e:
+        count_event("decompose.failed")
+        return {
+            "success": False,
+            "error": str(e)
+        }
@@ -0,0 +1,224 @@
+import ast
+import json
+import os
+import re
+
+from telemetry import count_event
+
+# =========================
+# QUERY PLAN SCHEMA
+# =========================
+# generate_plan used to json.loads() free-form model text, so a code fence
+# or a sentence around the JSON failed the whole question. Plans are now
+# requested in JSON mode, repaired locally (fences, prose, unbalanced
+# braces, trailing commas, Python literals, key names/types) and validated
+# against the plan shape below. Only if that fails is the model asked again.
+
+PLAN_RETRIES = int(os.getenv("PLAN_RETRIES", 1))
+
+PLAN_LIST_FIELDS = ("metrics", "group_by", "order_by")
+
+# Alternative key spellings seen in model output -> canonical plan key
+# (compared lower-case with underscores removed)
+KEY_ALIASES = {
+    "tablename": "table",
+    "from": "table",
+    "filter": "filters",
+    "where": "filters",
+    "conditions": "filters",
+    "metric": "metrics",
+    "select": "metrics",
+    "columns": "metrics",
+    "groupby": "group_by",
+    "group": "group_by",
+    "orderby": "order_by",
+    "sort": "order_by",
+    "sortby": "order_by",
+    "order": "order_by",
+    "top": "limit",
+    "topn": "limit"
+}
+
+
+class PlanError(ValueError):
+    """The model's plan could not be parsed or repaired."""
+
+
+# =========================
+# LOCAL REPAIR
+# =========================
+def _strip_fences(text: str) -> str:
+    fenced = re.search(r"```(?:json|JSON)?\s*(.*?)```", text, re.DOTALL)
+    return fenced.group(1) if fenced else text.replace("```", "")
+
+
+def _balance(text: str) -> str:
+    """Cut prose around the first JSON object and close unbalanced braces/brackets."""
+    start = text.find("{")
+    if start < 0:
+        raise PlanError("no JSON object in the model reply")
+    stack, in_string, escaped = [], False, False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if stack and stack[-1] == ch:
+                stack.pop()
+            if not stack:
+                return text[start:i + 1]
+    body = text[start:].rstrip().rstrip(",")
+    if in_string:
+        body += '"'
+    return body + "".join(reversed(stack))
+
+
+def _loads(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    cleaned = re.sub(r",\s*([}\]])", r"\1", text)          # trailing commas
+    try:
+        return json.loads(cleaned)
+    except json.JSONDecodeError:
+        pass
+    # Python-style dicts: single quotes, None/True/False
+    for word, literal in (("null", "None"), ("true", "True"), ("false", "False")):
+        cleaned = re.sub(rf"\b{word}\b", literal, cleaned)
+    try:
+        return ast.literal_eval(cleaned)
+    except (ValueError, SyntaxError) as e:
+        raise PlanError(f"unparseable plan JSON: {e}") from e
+
+
+def _as_list(value):
+    if value in (None, "", {}):
+        return []
+    if isinstance(value, str):
+        return [part.strip() for part in value.split(",") if part.strip()]
+    if isinstance(value, dict):
+        return [f"{k} {v}".strip() for k, v in value.items()]
+    return [str(v) if not isinstance(v, str) else v for v in value]
+
+
+def _as_filters(value):
+    if value in (None, "", []):
+        return {}
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, list):
+        merged = {}
+        for item in value:
+            if isinstance(item, dict) and "column" in item:
+                merged[item["column"]] = item.get("value")
+            elif isinstance(item, dict):
+                merged.update(item)
+            else:
+                raise PlanError(f"cannot read filter {item!r}")
+        return merged
+    raise PlanError(f"filters must be an object, got {type(value).__name__}")
+
+
+def _as_limit(value):
+    if value in (None, "", "null", "none"):
+        return None
+    if isinstance(value, bool):
+        raise PlanError("limit must be a number")
+    try:
+        limit = int(str(value).strip())
+    except ValueError as e:
+        raise PlanError(f"limit must be a number, got {value!r}") from e
+    return limit if limit > 0 else None
+
+
+def coerce_plan(raw, default_table: str) -> dict:
+    """Validate a parsed plan and coerce it to the canonical shape."""
+    if isinstance(raw, list) and len(raw) == 1:
+        raw = raw[0]
+    if not isinstance(raw, dict):
+        raise PlanError(f"plan must be a JSON object, got {type(raw).__name__}")
+    if "plan" in raw and isinstance(raw["plan"], dict):
+        raw = raw["plan"]
+
+    fields = {}
+    for key, value in raw.items():
+        name = re.sub(r"[\s\-]+", "_", str(key).strip().lower())
+        fields[KEY_ALIASES.get(name.replace("_", ""), name)] = value
+
+    table = fields.get("table") or default_table
+    if not isinstance(table, str):
+        raise PlanError("table must be a string")
+
+    plan = {
+        "table": table,
+        "filters": _as_filters(fields.get("filters")),
+        **{key: _as_list(fields.get(key)) for key in PLAN_LIST_FIELDS},
+        "limit": _as_limit(fields.get("limit"))
+    }
+    # Keep any extra hints the model added (e.g. "distinct") for the SQL step
+    for key, value in fields.items():
+        plan.setdefault(key, value)
+    return plan
+
+
+def loads_json_reply(content: str):
+    """json.loads with the same local repairs as plans; raises PlanError."""
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        return _loads(_balance(_strip_fences(content)))
+
+
+def parse_plan(content: str, default_table: str):
+    """
+    Parse model output into a plan. Returns (plan, repaired) where repaired
+    is True if the text needed local fixes. Raises PlanError.
+    """
+    try:
+        return coerce_plan(json.loads(content), default_table), False
+    except (json.JSONDecodeError, PlanError):
+        pass
+    return coerce_plan(_loads(_balance(_strip_fences(content))), default_table), True
+
+
+# =========================
+# PLAN REQUEST
+# =========================
+def request_plan(llm, messages, default_table: str) -> dict:
+    """
+    Ask the model for a plan in JSON mode, repair it locally, and only
+    retry (at most PLAN_RETRIES times) with the parse error if that fails.
+    """
+    count_event("plan.requests")
+    content = llm(messages, profile="plan", json_mode=True)
+    for attempt in range(PLAN_RETRIES + 1):
+        try:
+            plan, repaired = parse_plan(content, default_table)
+            count_event("plan.repaired" if repaired else "plan.clean")
+            if attempt:
+                count_event("plan.retry_succeeded")
+            return plan
+        except PlanError as e:
+            error = e
+        if attempt == PLAN_RETRIES:
+            break
+        print(f"⚠️ Plan was not valid JSON ({error}), retrying")
+        count_event("plan.retries")
+        content = llm(messages + [
+            {"role": "assistant", "content": content},
+            {"role": "user", "content": f"That was not a valid plan ({error}). Return ONLY the JSON object."}
+        ], profile="plan", json_mode=True, label="plan_retry")
+
+    count_event("plan.failed")
+    raise error
@@ -0,0 +1,288 @@
+import contextvars
+import html
+import os
+import random
+import re
+import sys
+import sysconfig
+import threading
+import time
+import uuid
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+from telemetry import count_event, record_profile
+
+# =========================
+# REQUEST PROFILING
+# =========================
+# Opt-in sampling profiler for single questions. While a question is
+# profiled, a sampler thread reads the stacks of every thread working on it
+# (the Streamlit script thread, its worker-pool job and fan-out parts)
+# every PROFILE_INTERVAL_MS and writes, per question, to PROFILE_DIR:
+#
+#   <id>.svg     flamegraph (frames are module:function, rooted at the thread)
+#   <id>.txt     top functions by self and total samples
+#   <id>.folded  folded stacks, for flamegraph.pl / speedscope
+#
+# A question is profiled when the caller asks for it (?profile=1 in the app
+# URL, X-Profile: 1 or ?profile=1 on the API) or at random with
+# PROFILE_SAMPLE_RATE. Each capture is listed in the telemetry profiles
+# with the job's stage timeline. When no question is profiled, the only
+# cost is one context-variable lookup per job.
+#
+# Waits in C code (SQLite, HTTP reads) show up as the Python frame that
+# made the call: sql_runner:run_query, llm_registry:_send and so on.
+
+BASE_DIR = Path(__file__).resolve().parent
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))    # fraction of questions, 0 = on request only
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_MS", 5)) / 1000
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", BASE_DIR / "profiles"))
+PROFILE_TOP_FUNCTIONS = 30
+
+# Thread plumbing below the code we care about
+SKIPPED_MODULES = ("threading:", "concurrent.futures.thread:", "contextlib:")
+STDLIB_DIR = sysconfig.get_paths()["stdlib"]
+
+_current = contextvars.ContextVar("profile", default=None)
+
+
+def should_profile(requested: bool = False) -> bool:
+    """Profile this question? Always when requested, else at PROFILE_SAMPLE_RATE."""
+    return requested or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename
+    if "site-packages" in path:
+        package = Path(path.split("site-packages", 1)[1].lstrip("/\\"))
+        module = ".".join((*package.parts[:-1], package.stem)[:2])
+    elif path.startswith(STDLIB_DIR):
+        relative = Path(path[len(STDLIB_DIR):].lstrip("/\\"))
+        module = ".".join((*relative.parts[:-1], relative.stem))
+    else:
+        module = Path(path).stem
+    return f"{module}:{code.co_name}"
+
+
+def _fold(frame) -> list:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return [label for label in reversed(labels) if not label.startswith(SKIPPED_MODULES)]
+
+
+class RequestProfile:
+    """Samples the stacks of the threads attached to one question."""
+
+    def __init__(self, label: str, request_id: str = None):
+        request_id = re.sub(r"[^\w-]", "", request_id or "") or uuid.uuid4().hex
+        self.id = f"{datetime.now():%Y%m%d-%H%M%S}-{request_id[:8]}"
+        self.label = label
+        self.stacks = Counter()     # (thread, frame, ...) -> samples
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+        self._threads = Counter()   # thread id -> attach count
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._sampler.start()
+
+    def attach(self):
+        with self._lock:
+            self._threads[threading.get_ident()] += 1
+
+    def detach(self):
+        with self._lock:
+            ident = threading.get_ident()
+            self._threads[ident] -= 1
+            if self._threads[ident] <= 0:
+                del self._threads[ident]
+
+    def _sample(self):
+        names = {}
+        while not self._stop.wait(PROFILE_INTERVAL_SECONDS):
+            with self._lock:
+                threads = list(self._threads)
+            frames = sys._current_frames()
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                if ident not in names:
+                    thread = threading._active.get(ident)
+                    names[ident] = (thread.name if thread else str(ident)).rstrip("0123456789_-")
+                self.stacks[(names[ident], *_fold(frame))] += 1
+
+    def stop(self):
+        self._stop.set()
+        self._sampler.join()
+        self.seconds = time.perf_counter() - self.started
+
+    @property
+    def samples(self) -> int:
+        return sum(self.stacks.values())
+
+
+def current_profile():
+    return _current.get()
+
+
+@contextmanager
+def profile_scope(profile):
+    """Attach the current thread (e.g. a worker-pool job) to a profile; no-op for None."""
+    if profile is None:
+        yield
+        return
+    token = _current.set(profile)
+    profile.attach()
+    try:
+        yield
+    finally:
+        profile.detach()
+        _current.reset(token)
+
+
+def start_profile(label: str, request_id: str = None, attach: bool = True) -> RequestProfile:
+    """
+    Start profiling the question handled by the current context. attach=False
+    samples only the jobs it submits (an async handler's event-loop thread
+    also runs other requests).
+    """
+    stale = _current.get()
+    if stale is not None:       # a previous question ended without finish_profile
+        stale.stop()
+    profile = RequestProfile(label, request_id)
+    if attach:
+        profile.attach()
+    _current.set(profile)
+    return profile
+
+
+def finish_profile(trace=None):
+    """
+    Stop the current context's profile and save it. `trace` is the job's
+    (stage, timestamp) events. Returns the telemetry entry, or None when no
+    profile was running.
+    """
+    profile = _current.get()
+    if profile is None:
+        return None
+    _current.set(None)
+    profile.detach()
+    profile.stop()
+    if not profile.samples:
+        return None
+
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    base = PROFILE_DIR / profile.id
+    base.with_suffix(".folded").write_text(folded_stacks(profile.stacks), encoding="utf-8")
+    base.with_suffix(".txt").write_text(top_functions_table(profile), encoding="utf-8")
+    base.with_suffix(".svg").write_text(flamegraph_svg(profile.stacks, profile.label), encoding="utf-8")
+
+    started = trace[0][1] if trace else None
+    entry = {
+        "id": profile.id,
+        "question": profile.label,
+        "seconds": round(profile.seconds, 3),
+        "samples": profile.samples,
+        "svg": str(base.with_suffix(".svg")),
+        "table": str(base.with_suffix(".txt")),
+        "stages": [(stage, round(at - started, 3)) for stage, at in trace] if trace else []
+    }
+    record_profile(entry)
+    count_event("profile.captured")
+    print(f"🔥 Profile saved: {entry['svg']} ({entry['samples']} samples)")
+    return entry
+
+
+# =========================
+# REPORTS
+# =========================
+def folded_stacks(stacks) -> str:
+    return "".join(f"{';'.join(stack)} {count}\n" for stack, count in stacks.most_common())
+
+
+def top_functions(stacks):
+    """[(function, self samples, total samples), ...] by self samples."""
+    own, total = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack[1:]
+        if frames:
+            own[frames[-1]] += count
+        for label in set(frames):
+            total[label] += count
+    return [(label, own[label], total[label]) for label in sorted(total, key=lambda l: (-own[l], -total[l]))]
+
+
+def top_functions_table(profile: RequestProfile) -> str:
+    samples = profile.samples
+    threads = sorted({stack[0] for stack in profile.stacks})
+    lines = [
+        f"Profile {profile.id}: {profile.label}",
+        f"{samples} samples every {PROFILE_INTERVAL_SECONDS * 1000:g}ms over {profile.seconds:.2f}s "
+        f"(threads: {', '.join(threads)})",
+        "",
+        f"{'self%':>7} {'total%':>7}  function"
+    ]
+    for label, own, total in top_functions(profile.stacks)[:PROFILE_TOP_FUNCTIONS]:
+        lines.append(f"{own / samples:>7.1%} {total / samples:>7.1%}  {label}")
+    return "\n".join(lines) + "\n"
+
+
+FLAME_WIDTH = 1200
+FLAME_ROW = 16
+
+
+def _flame_color(label: str) -> str:
+    # Stable warm colour per module, so one library reads as one band
+    module = label.split(":", 1)[0]
+    shade = zlib.crc32(module.encode()) % 1000 / 1000
+    return f"rgb({205 + int(50 * shade)},{int(80 + 150 * shade)},{int(40 + 40 * shade)})"
+
+
+def flamegraph_svg(stacks, title: str) -> str:
+    """A self-contained SVG flamegraph; hover a frame for its sample count."""
+    root = {"count": 0, "children": {}}
+    for stack, count in stacks.items():
+        root["count"] += count
+        node = root
+        for label in stack:
+            node = node["children"].setdefault(label, {"count": 0, "children": {}})
+            node["count"] += count
+
+    def depth(node):
+        return 1 + max((depth(child) for child in node["children"].values()), default=0)
+
+    rows = depth(root) - 1
+    height = (rows + 2) * FLAME_ROW
+    scale = FLAME_WIDTH / max(root["count"], 1)
+    rects = []
+
+    def draw(node, x, level):
+        for label, child in sorted(node["children"].items()):
+            width = child["count"] * scale
+            if width >= 0.5:
+                y = height - (level + 1) * FLAME_ROW
+                share = child["count"] / root["count"]
+                text = html.escape(label[:int(width / 7)]) if width > 35 else ""
+                rects.append(
+                    f'<g><title>{html.escape(label)} ({child["count"]} samples, {share:.1%})</title>'
+                    f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" height="{FLAME_ROW - 1}" '
+                    f'fill="{_flame_color(label)}"/>'
+                    f'<text x="{x + 3:.1f}" y="{y + FLAME_ROW - 4}">{text}</text></g>'
+                )
+                draw(child, x, level + 1)
+            x += width
+
+    draw(root, 0.0, 0)
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{FLAME_WIDTH}" height="{height}" '
+        f'font-family="monospace" font-size="11">'
+        f'<text x="4" y="12">{html.escape(title)} ({root["count"]} samples)</text>'
+        + "".join(rects) + "</svg>\n"
+    )
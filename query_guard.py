@@ -0,0 +1,207 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import sqlglot
+
+from memory_accounting import register_cache, deep_size
+
+# =========================
+# QUERY COST GUARD
+# =========================
+# LLM-generated SQL is not bounded in cost: an unfiltered cross/self join
+# over visitor_details can keep a worker busy indefinitely. Before running
+# we estimate the work from EXPLAIN QUERY PLAN (full scans, nested loops,
+# temp B-trees) and refuse plans over budget. While running, a progress
+# handler enforces a VM step budget and a wall-clock deadline.
+
+MAX_PLAN_COST = float(os.getenv("SQL_MAX_PLAN_COST", 5e7))        # estimated row visits
+STEP_BUDGET = int(os.getenv("SQL_STEP_BUDGET", 200_000_000))      # SQLite VM instructions
+QUERY_TIMEOUT_SECONDS = float(os.getenv("SQL_QUERY_TIMEOUT", 15))
+PROGRESS_INTERVAL = 10_000                                         # VM steps between checks
+SEARCH_FANOUT = 10                                                 # rows assumed per index probe
+UNKNOWN_TABLE_ROWS = 1_000
+ROW_COUNT_TTL_SECONDS = 600
+
+
+class QueryTooExpensive(Exception):
+    """Raised when a query's plan or runtime exceeds the cost budget."""
+
+    def __init__(self, reason: str, plan: str = ""):
+        super().__init__(f"Query too expensive: {reason}")
+        self.reason = reason
+        self.plan = plan
+
+
+_row_counts = {}
+_row_counts_lock = threading.Lock()
+
+
+def table_rows(conn, db_path, table: str) -> int:
+    """Approximate row count of a table (MAX(rowid)), cached per process."""
+    key = (str(db_path), table.lower())
+    now = time.time()
+    with _row_counts_lock:
+        cached = _row_counts.get(key)
+    if cached and now - cached[1] < ROW_COUNT_TTL_SECONDS:
+        return cached[0]
+    try:
+        rows = conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()[0] or 0
+    except sqlite3.Error:
+        rows = UNKNOWN_TABLE_ROWS
+    with _row_counts_lock:
+        _row_counts[key] = (rows, now)
+    return rows
+
+
+def clear_row_counts():
+    with _row_counts_lock:
+        _row_counts.clear()
+
+
+register_cache("query_guard.row_counts", lambda: deep_size(_row_counts), clear_row_counts)
+
+
+def explain_plan(conn, sql: str):
+    """EXPLAIN QUERY PLAN rows as (id, parent, detail)."""
+    sql = sql.strip().rstrip(";")
+    return [(r[0], r[1], r[3]) for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+
+
+def format_plan(plan) -> str:
+    """Indented plan text, like the sqlite3 shell's .eqp output."""
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, detail in plan:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return "\n".join(lines)
+
+
+def _aliases(sql: str):
+    """Map query aliases (and names) to real table names."""
+    mapping = {}
+    try:
+        parsed = sqlglot.parse_one(sql, dialect="sqlite")
+    except Exception:
+        return mapping
+    for table in parsed.find_all(sqlglot.exp.Table):
+        mapping[table.name.lower()] = table.name
+        if table.alias:
+            mapping[table.alias.lower()] = table.name
+    return mapping
+
+
+def estimate_cost(conn, db_path, sql: str, plan):
+    """
+    Estimated number of row visits for a plan, plus the plan step that
+    contributed the most. Loops at the same level nest (SQLite join order).
+    """
+    aliases = _aliases(sql)
+    children = {}
+    for node_id, parent, detail in plan:
+        children.setdefault(parent, []).append((node_id, detail))
+    produced = {}   # rows produced by materialized subqueries / CTEs
+    worst = ["", 0.0]
+
+    def rows_for(name):
+        name = name.lower()
+        if name in produced:
+            return produced[name]
+        if name in aliases:
+            return table_rows(conn, db_path, aliases[name])
+        return table_rows(conn, db_path, name)
+
+    def add(total, amount, detail):
+        if amount > worst[1]:
+            worst[0], worst[1] = detail, amount
+        return total + amount
+
+    def walk(parent, outer):
+        total, loop_rows = 0.0, 1.0
+        for node_id, detail in children.get(parent, []):
+            scan = re.match(r"SCAN (?:TABLE )?(\S+)", detail)
+            search = re.match(r"SEARCH (?:TABLE )?(\S+)", detail)
+            container = re.match(r"(MATERIALIZE|CO-ROUTINE) (\S+)", detail)
+            # A SEARCH without an index (e.g. inside a correlated subquery) is a full scan
+            if search and "USING" not in detail:
+                scan = search
+            if scan and not detail.startswith("SCAN CONSTANT"):
+                loop_rows *= max(rows_for(scan.group(1)), 1)
+                total = add(total, outer * loop_rows, detail)
+            elif search:
+                if "AUTOMATIC" in detail:
+                    n = max(rows_for(search.group(1)), 1)
+                    total = add(total, outer * n * math.log2(n + 1), detail)
+                loop_rows *= SEARCH_FANOUT
+                total = add(total, outer * loop_rows, detail)
+            elif detail.startswith("USE TEMP B-TREE"):
+                total = add(total, outer * loop_rows * math.log2(loop_rows + 1), detail)
+            elif detail.startswith("CORRELATED"):
+                sub_total, _ = walk(node_id, outer * loop_rows)
+                total += sub_total
+            elif container:
+                sub_total, sub_rows = walk(node_id, 1.0)
+                produced[container.group(2).lower()] = sub_rows
+                total += sub_total
+            else:
+                sub_total, _ = walk(node_id, outer)
+                total += sub_total
+        return total, loop_rows
+
+    cost, _ = walk(0, 1.0)
+    return cost, worst[0]
+
+
+def check_query_cost(db_path, sql: str, conn=None):
+    """Raise QueryTooExpensive if the plan's estimated cost exceeds the budget."""
+    own = conn is None
+    conn = conn or sqlite3.connect(db_path)
+    try:
+        plan = explain_plan(conn, sql)
+        cost, worst = estimate_cost(conn, db_path, sql, plan)
+    finally:
+        if own:
+            conn.close()
+    if cost > MAX_PLAN_COST:
+        raise QueryTooExpensive(
+            f"estimated {cost:,.0f} row visits (limit {MAX_PLAN_COST:,.0f}), mostly from '{worst}'",
+            format_plan(plan)
+        )
+    return cost
+
+
+@contextmanager
+def query_limits(conn, sql: str, step_budget: int = None, timeout: float = None):
+    """Interrupt the query if it exceeds the VM step budget or the deadline."""
+    step_budget = STEP_BUDGET if step_budget is None else step_budget
+    deadline = time.monotonic() + (QUERY_TIMEOUT_SECONDS if timeout is None else timeout)
+    state = {"steps": 0, "reason": None}
+
+    def on_progress():
+        state["steps"] += PROGRESS_INTERVAL
+        if state["steps"] > step_budget:
+            state["reason"] = f"exceeded the step budget of {step_budget:,} VM instructions"
+            return 1
+        if time.monotonic() > deadline:
+            state["reason"] = f"ran longer than {QUERY_TIMEOUT_SECONDS if timeout is None else timeout:g}s"
+            return 1
+        return 0
+
+    conn.set_progress_handler(on_progress, PROGRESS_INTERVAL)
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if state["reason"] is None or "interrupt" not in str(e).lower():
+            raise
+        try:
+            plan = format_plan(explain_plan(conn, sql))
+        except sqlite3.Error:
+            plan = ""
+        raise QueryTooExpensive(state["reason"], plan) from e
+    finally:
+        conn.set_progress_handler(None, 0)
@@ -0,0 +1,246 @@
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+
+from telemetry import count_event, latency_percentile
+
+# =========================
+# LLM RESILIENCE
+# =========================
+# Azure latency has a long tail, so every LLM call goes through three guards:
+#
+#   deadline  one budget per question (QUESTION_DEADLINE_SECONDS), carried in
+#             a context variable from rewrite and routing down to the plan,
+#             SQL and answer calls, including worker-pool threads
+#   hedging   when a call is still running after its profile's observed p95,
+#             a duplicate is sent and whichever answers first wins
+#   breaker   after BREAKER_FAILURES consecutive failures a deployment is
+#             skipped for BREAKER_COOLDOWN_SECONDS; callers fall back to
+#             templated SQL/answers instead of waiting on a degraded endpoint
+
+QUESTION_DEADLINE_SECONDS = float(os.getenv("QUESTION_DEADLINE_SECONDS", 90))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))   # calls before p95 is trusted
+HEDGE_PERCENTILE = 95
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", 30))
+LLM_CALL_THREADS = int(os.getenv("LLM_CALL_THREADS", 32))
+
+
+class LLMUnavailable(RuntimeError):
+    """The deployment's circuit breaker is open."""
+
+
+class LLMTimeout(TimeoutError):
+    """A single LLM call exceeded its profile timeout."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The question's overall deadline passed."""
+
+
+# Errors after which callers should degrade instead of failing the question
+DEGRADED_ERRORS = (LLMUnavailable, TimeoutError)
+
+# Client-library errors (matched by class name, so none is imported here)
+# that mean the endpoint is unreachable rather than the prompt rejected
+ENDPOINT_ERROR_NAMES = {"APIConnectionError", "APITimeoutError", "TransportError", "TimeoutException"}
+
+
+def is_endpoint_failure(e) -> bool:
+    """
+    Whether an LLM call error says the deployment is unhealthy: timeouts,
+    connection errors, 429 and 5xx. 4xx rejections of one prompt (content
+    filter, context length) and the question's own deadline do not.
+    """
+    if isinstance(e, DeadlineExceeded):
+        return False
+    if isinstance(e, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return any(cls.__name__ in ENDPOINT_ERROR_NAMES for cls in type(e).__mro__)
+
+
+# =========================
+# PER-QUESTION DEADLINE
+# =========================
+_deadline = contextvars.ContextVar("question_deadline", default=None)
+
+
+def current_deadline():
+    """Absolute time.monotonic() deadline of the current question, or None."""
+    return _deadline.get()
+
+
+def remaining_seconds():
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def start_deadline(seconds: float = None):
+    """Start the deadline of a new question in the current context."""
+    _deadline.set(time.monotonic() + (QUESTION_DEADLINE_SECONDS if seconds is None else seconds))
+
+
+def clear_deadline():
+    _deadline.set(None)
+
+
+@contextmanager
+def deadline_scope(deadline):
+    """Run a block under an existing absolute deadline (e.g. in a worker thread)."""
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def question_deadline(seconds: float = None):
+    """Run a block under a new per-question deadline."""
+    with deadline_scope(time.monotonic() + (QUESTION_DEADLINE_SECONDS if seconds is None else seconds)):
+        yield
+
+
+def call_timeout(profile_timeout: float):
+    """
+    (seconds, bound_by_deadline) for one call: the profile timeout, cut to
+    what is left of the question's deadline. Raises DeadlineExceeded when
+    nothing is left.
+    """
+    remaining = remaining_seconds()
+    if remaining is None or remaining >= profile_timeout:
+        return profile_timeout, False
+    if remaining <= 0:
+        count_event("llm.deadline_exceeded")
+        raise DeadlineExceeded("question deadline exceeded")
+    return remaining, True
+
+
+# =========================
+# CIRCUIT BREAKER
+# =========================
+class CircuitBreaker:
+    """closed -> open after N consecutive failures -> half-open probe after the cooldown."""
+
+    def __init__(self, name, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN_SECONDS):
+        self.name = name
+        self.failure_threshold = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+                return "open"
+            return "half-open"
+
+    def before_call(self):
+        """Raise LLMUnavailable while open; let one probe through after the cooldown."""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+                count_event("llm.breaker_rejected")
+                raise LLMUnavailable(f"LLM deployment '{self.name}' is temporarily unavailable")
+            self.probing = True
+
+    def release_probe(self):
+        """End a half-open probe that finished without a verdict on the endpoint."""
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                print(f"✅ LLM circuit for '{self.name}' closed")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                if self.opened_at is None:
+                    print(f"⛔ LLM circuit for '{self.name}' opened after {self.failures} failures")
+                count_event("llm.breaker_opened")
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(deployment: str) -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get(deployment)
+        if breaker is None:
+            breaker = _breakers[deployment] = CircuitBreaker(deployment)
+        return breaker
+
+
+def breaker_states() -> dict:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.state for b in breakers}
+
+
+# =========================
+# HEDGED CALLS
+# =========================
+_executor = ThreadPoolExecutor(max_workers=LLM_CALL_THREADS, thread_name_prefix="llm")
+
+
+def hedge_delay(profile: str):
+    """Seconds after which to hedge a call of this profile (observed p95), or None."""
+    return latency_percentile(profile, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+
+
+def hedged_call(fn, timeout: float, hedge_after: float = None, bound_by_deadline: bool = False):
+    """
+    Run fn() with a timeout; if it has not finished after hedge_after
+    seconds, run a second fn() and return whichever succeeds first.
+    The losing call is left to finish in the background.
+    """
+    started = time.monotonic()
+    pending = [_executor.submit(fn)]
+    first = pending[0]
+    if hedge_after is not None and hedge_after < timeout:
+        done, _ = wait(pending, timeout=hedge_after)
+        if not done:
+            count_event("llm.hedge_sent")
+            pending.append(_executor.submit(fn))
+
+    error = None
+    while pending:
+        left = timeout - (time.monotonic() - started)
+        done, _ = wait(pending, timeout=max(left, 0), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            pending.remove(future)
+            if future.exception() is None:
+                if future is not first:
+                    count_event("llm.hedge_won")
+                return future.result()
+            error = future.exception()
+    if error is not None and not pending:
+        raise error
+    if bound_by_deadline:
+        count_event("llm.deadline_exceeded")
+        raise DeadlineExceeded("question deadline exceeded while waiting for the LLM")
+    count_event("llm.timeout")
+    raise LLMTimeout(f"LLM call timed out after {timeout:.0f}s")
@@ -0,0 +1,400 @@
+import re
+
+# =========================
+# DRILL-DOWN FOLLOW-UPS ON CACHED RESULTS
+# =========================
+# Follow-ups like "only for ward 5", "sort those by count" or "top 3" only
+# narrow down the previous answer. When the previous rows are still in the
+# chat history we apply the refinement with pandas instead of running the
+# whole plan -> SQL -> execute pipeline again.
+
+REFINEMENT_CUES = (
+    "only", "just", "those", "them", "these", "this list", "that list",
+    "sort", "order", "rank", "top", "bottom", "first", "last", "filter",
+    "among", "out of", "group", "per", "wise", "break down", "split",
+    "highest", "lowest",
+)
+
+# Words that carry no meaning of their own in a refinement
+STOPWORDS = {
+    "a", "an", "the", "of", "for", "in", "from", "with", "where", "which",
+    "only", "just", "those", "them", "these", "this", "that", "it", "they",
+    "show", "me", "give", "list", "display", "please", "can", "you", "now",
+    "and", "also", "then", "what", "about", "is", "are", "was", "were",
+    "to", "on", "by", "sort", "sorted", "order", "ordered", "rank", "ranked",
+    "top", "bottom", "first", "last", "filter", "filtered", "among", "out",
+    "group", "grouped", "per", "wise", "break", "down", "split", "how",
+    "many", "count", "total", "sum", "number", "no", "asc", "ascending",
+    "desc", "descending", "highest", "lowest", "most", "least", "largest",
+    "smallest", "greater", "more", "less", "than", "above", "below", "over",
+    "under", "at", "equal", "equals", "same", "do", "i", "have", "there",
+    "all", "rows", "results", "data", "records", "again", "instead", "want",
+    "see", "tell", "us", "be", "should", "would", "like", "value", "values",
+    "each", "every", "id",
+}
+
+# Column name parts that are not useful as a spoken alias
+NOISE_PARTS = {"id", "mas", "no", "name", "clean", "key", "hier", "vis", "benf"}
+
+# Operations that are only correct when the cached rows are the full result
+NEEDS_COMPLETE = {"filter", "group", "total", "top"}
+# Operations that only need every fetched row (the preview may be a slice of a larger fetch)
+NEEDS_ALL_ROWS = {"sort", "first", "last"}
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "twenty": 20,
+}
+
+COMPARATORS = [
+    (r"(?:greater than|more than|above|over)", ">"),
+    (r"(?:less than|fewer than|below|under)", "<"),
+    (r"at least", ">="),
+    (r"at most", "<="),
+]
+
+
+def is_complete_result(sql: str) -> bool:
+    """True if the SQL returned every matching row (no LIMIT clause)."""
+    if not sql:
+        return False
+    return re.search(r"\blimit\b", sql, flags=re.IGNORECASE) is None
+
+
+def _words(text):
+    return re.findall(r"[a-z0-9ऀ-࿿]+(?:[-.][a-z0-9]+)*", text.lower())
+
+
+def _parse_int(token):
+    if token is None:
+        return None
+    if token.isdigit():
+        return int(token)
+    return NUMBER_WORDS.get(token)
+
+
+def _column_aliases(column: str):
+    """Spoken forms a user may use for a column, e.g. booth_name -> booth."""
+    col = column.lower()
+    parts = [p for p in re.split(r"[_\s]+", col) if p]
+    aliases = {col, " ".join(parts)}
+    meaningful = [p for p in parts if p not in NOISE_PARTS]
+    if meaningful:
+        aliases.add(" ".join(meaningful))
+        aliases.add(meaningful[0])
+        aliases.add(meaningful[-1])
+    if "count" in parts or col.endswith("_count"):
+        aliases.add("count")
+    return {a for a in aliases if a}
+
+
+def _find_columns(phrase: str, columns):
+    """Columns whose alias matches the phrase (longest alias wins)."""
+    phrase = phrase.strip().lower()
+    matches = []
+    for col in columns:
+        for alias in _column_aliases(col):
+            if alias == phrase or alias.rstrip("s") == phrase.rstrip("s"):
+                matches.append(col)
+                break
+    return matches
+
+
+def _mentioned_columns(q: str, columns):
+    """Columns referenced anywhere in the question, with the matched span."""
+    found = []
+    for col in columns:
+        for alias in sorted(_column_aliases(col), key=len, reverse=True):
+            m = re.search(rf"\b{re.escape(alias)}s?\b", q)
+            if m:
+                found.append((col, m.span()))
+                break
+    return found
+
+
+def _is_numeric(series) -> bool:
+    import pandas as pd
+
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+
+def _measure_column(df):
+    """The numeric value column of an aggregated result (e.g. visitor_count)."""
+    numeric = [c for c in df.columns if _is_numeric(df[c])]
+    not_ids = [c for c in numeric if not re.search(r"(^|_)(id|no|srno|booth)$", c.lower())]
+    candidates = not_ids or []
+    for c in candidates:
+        if re.search(r"count|total|sum|avg|num", c.lower()):
+            return c
+    return candidates[-1] if candidates else None
+
+
+def _match_value(df, col, raw: str):
+    """Boolean mask for rows where `col` equals (or contains) the spoken value."""
+    series = df[col]
+    if _is_numeric(series):
+        try:
+            value = float(raw)
+        except ValueError:
+            return None
+        return series == value
+    text = series.astype(str).str.strip().str.lower()
+    raw = raw.lower()
+    exact = text == raw
+    if exact.any():
+        return exact
+    contains = text.str.contains(re.escape(raw), regex=True, na=False)
+    if contains.any():
+        return contains
+    return None
+
+
+def _parse_filters(q, df, consumed):
+    """Filters like 'ward 5', 'booth umrvada', 'count above 50' or a bare 'pending'."""
+    filters = []
+    columns = list(df.columns)
+
+    # "<column> above/below N"
+    for pattern, op in COMPARATORS:
+        for m in re.finditer(rf"(?:(?P<col>[a-z_ ]+?)\s+)?{pattern}\s+(?P<val>\d+(?:\.\d+)?)", q):
+            cols = []
+            if m.group("col"):
+                words = m.group("col").split()
+                for n in range(len(words), 0, -1):
+                    cols = [c for c in _find_columns(" ".join(words[-n:]), columns) if _is_numeric(df[c])]
+                    if cols:
+                        break
+            if not cols:
+                measure = _measure_column(df)
+                cols = [measure] if measure else []
+            if not cols:
+                return None
+            filters.append((cols[0], op, float(m.group("val"))))
+            consumed.append(m.span())
+
+    # "<column> <value>" e.g. "ward 5", "booth umrvada-2"
+    for col, (start, end) in _mentioned_columns(q, columns):
+        if any(s <= start < e for s, e in consumed):
+            continue
+        m = re.match(r"s?\s*(?:no\.?|number|#|=|is|id)?\s*['\"]?([\w\-.]+)['\"]?", q[end:])
+        if not m or not m.group(1):
+            continue
+        raw = m.group(1)
+        if raw in STOPWORDS:
+            continue
+        # Prefer a sibling column with the same alias whose values actually match
+        candidates = [col] + [c for c in _find_columns(q[start:end], columns) if c != col]
+        for candidate in candidates:
+            mask = _match_value(df, candidate, raw)
+            if mask is not None:
+                filters.append((candidate, "mask", mask))
+                consumed.append((start, end + m.end()))
+                break
+
+    # Bare categorical values e.g. "only pending", "just PMAY"
+    for col in columns:
+        if _is_numeric(df[col]):
+            continue
+        values = df[col].dropna().astype(str).str.strip().unique()
+        if len(values) > 200:
+            continue
+        for value in values:
+            v = value.lower()
+            if len(v) < 3:
+                continue
+            m = re.search(rf"(?<![\w-]){re.escape(v)}(?![\w-])", q)
+            if m and not any(s <= m.start() < e for s, e in consumed):
+                filters.append((col, "mask", df[col].astype(str).str.strip().str.lower() == v))
+                consumed.append(m.span())
+    return filters
+
+
+def _parse_group(q, df, consumed):
+    m = re.search(r"(?:group(?:ed)?|break(?: it)?(?: down)?|split(?: it)?|count(?:s)?)\s+by\s+([a-z_ ]+?)(?=$|\s+(?:and|then|sorted|sort|order)\b|[,?.])", q) \
+        or re.search(r"\bper\s+([a-z_]+)", q) \
+        or re.search(r"\b([a-z_]+)[\s-]wise\b", q)
+    if not m:
+        return None
+    cols = _find_columns(m.group(1), list(df.columns))
+    if not cols:
+        return False
+    consumed.append(m.span())
+    return cols[0]
+
+
+def _parse_sort(q, df, consumed):
+    m = re.search(r"\b(?:sort|order|rank)(?:ed)?\s+(?:them|those|these|it|the list|results?)?\s*(?:by\s+)?([a-z_ ]+?)?(?:\s+(asc|ascending|desc|descending|lowest first|highest first|smallest first|largest first))?(?=$|[,?.]|\s+and\b)", q)
+    if not m:
+        return None
+    consumed.append(m.span())
+    phrase = (m.group(1) or "").strip()
+    col = None
+    if phrase:
+        cols = _find_columns(phrase, list(df.columns))
+        if not cols:
+            return False
+        col = cols[0]
+    else:
+        col = _measure_column(df)
+        if col is None:
+            return False
+    direction = m.group(2) or ""
+    if direction in ("asc", "ascending", "lowest first", "smallest first"):
+        ascending = True
+    elif direction in ("desc", "descending", "highest first", "largest first"):
+        ascending = False
+    else:
+        ascending = not _is_numeric(df[col])
+    return col, ascending
+
+
+def _parse_limit(q, consumed):
+    m = re.search(r"\b(top|bottom|first|last|highest|lowest)\s+(\d+|" + "|".join(NUMBER_WORDS) + r")\b", q)
+    if not m:
+        return None
+    consumed.append(m.span())
+    return m.group(1), _parse_int(m.group(2))
+
+
+def _mask_spans(q, consumed):
+    """Blank out the parts of the question already explained by an operation."""
+    chars = list(q)
+    for start, end in consumed:
+        for i in range(start, min(end, len(chars))):
+            chars[i] = " "
+    return "".join(chars)
+
+
+def _leftover_words(text, columns):
+    """Content words not explained by any parsed operation or column name."""
+    column_words = set()
+    for col in columns:
+        for alias in _column_aliases(col):
+            column_words.update(alias.split())
+    leftover = []
+    for word in _words(text):
+        base = word.rstrip("s")
+        if word in STOPWORDS or base in STOPWORDS or word.isdigit():
+            continue
+        if word in column_words or base in column_words:
+            continue
+        leftover.append(word)
+    return leftover
+
+
+def refine_cached_result(question: str, data: dict):
+    """
+    Apply a follow-up refinement (filter / sort / top-N / re-aggregation)
+    to the previous result set. Returns a dict with columns, rows and a short
+    description of the applied operations, or None if the cached rows cannot
+    answer the question and the SQL pipeline must run.
+    """
+    if not data or not data.get("columns") or data.get("rows") is None:
+        return None
+
+    q = " ".join(question.lower().split())
+    if not any(re.search(rf"\b{re.escape(cue)}\b", q) for cue in REFINEMENT_CUES):
+        return None
+
+    import pandas as pd     # only questions that look like refinements pay for it
+
+    df = pd.DataFrame(list(data["rows"]), columns=data["columns"])
+    if df.empty:
+        return None
+
+    consumed = []
+    ops = set()
+    steps = []
+
+    limit = _parse_limit(q, consumed)
+    group_col = _parse_group(q, df, consumed)
+    if group_col is False:
+        return None
+    sort = _parse_sort(q, df, consumed)
+    if sort is False:
+        return None
+    filters = _parse_filters(q, df, consumed)
+    if filters is None:
+        return None
+    remaining = _mask_spans(q, consumed)
+    wants_total = group_col is None and re.search(r"\b(how many|total|sum|count)\b", remaining) is not None
+
+    if _leftover_words(remaining, df.columns):
+        return None
+
+    # ---- filters ----
+    for col, op, value in filters:
+        ops.add("filter")
+        if op == "mask":
+            df = df[value.reindex(df.index, fill_value=False)]
+            steps.append(f"filtered on {col}")
+        else:
+            series = pd.to_numeric(df[col], errors="coerce")
+            mask = {">": series > value, "<": series < value,
+                    ">=": series >= value, "<=": series <= value}[op]
+            df = df[mask]
+            steps.append(f"{col} {op} {value:g}")
+
+    # ---- re-aggregation ----
+    if group_col:
+        ops.add("group")
+        measure = _measure_column(df)
+        if measure and measure != group_col:
+            df = df.groupby(group_col, dropna=False, sort=False)[measure].sum().reset_index()
+        else:
+            df = df.groupby(group_col, dropna=False, sort=False).size().reset_index(name="count")
+        steps.append(f"grouped by {group_col}")
+    elif wants_total:
+        ops.add("total")
+        measure = _measure_column(df)
+        if measure and re.search(r"\b(total|sum)\b", q):
+            df = pd.DataFrame({f"total_{measure}": [df[measure].sum()]})
+        else:
+            df = pd.DataFrame({"count": [len(df)]})
+        steps.append("totalled")
+
+    # ---- sort ----
+    if sort:
+        col, ascending = sort
+        if col not in df.columns:
+            return None
+        ops.add("sort")
+        df = df.sort_values(col, ascending=ascending, kind="stable")
+        steps.append(f"sorted by {col} {'ascending' if ascending else 'descending'}")
+
+    # ---- top-N ----
+    if limit:
+        word, n = limit
+        if word in ("top", "highest", "bottom", "lowest"):
+            ops.add("top")
+            if not sort:
+                measure = _measure_column(df)
+                if measure is None:
+                    return None
+                df = df.sort_values(measure, ascending=word in ("bottom", "lowest"), kind="stable")
+            df = df.head(n)
+        elif word == "first":
+            ops.add("first")
+            df = df.head(n)
+        else:
+            ops.add("last")
+            df = df.tail(n)
+        steps.append(f"{word} {n}")
+
+    if not steps:
+        return None
+    if ops & NEEDS_COMPLETE and not data.get("complete", False):
+        return None
+    if ops & NEEDS_ALL_ROWS and data.get("total", len(data["rows"])) != len(data["rows"]):
+        return None
+
+    # Convert NumPy scalars back to plain Python values for session state
+    rows = [tuple(v.item() if hasattr(v, "item") else v for v in row)
+            for row in df.itertuples(index=False, name=None)]
+    return {
+        "columns": list(df.columns),
+        "rows": rows,
+        "description": "; ".join(steps),
+        # A top/first/last slice is never the complete answer to the original question
+        "complete": data.get("complete", False) and not ops & {"top", "first", "last"},
+    }
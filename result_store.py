@@ -0,0 +1,135 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from memory_accounting import register_cache
+
+# =========================
+# SPILL-TO-DISK RESULT STORE
+# =========================
+# Full query results are written to per-session Arrow IPC (Feather v2)
+# files instead of living in st.session_state.messages. Session state only
+# keeps a handle plus a small preview. Files are evicted least-recently-used
+# first whenever the store grows past a global byte budget.
+
+BASE_DIR = Path(__file__).resolve().parent
+STORE_DIR = Path(os.getenv("RESULT_STORE_DIR", BASE_DIR / ".result_store"))
+STORE_MAX_BYTES = int(os.getenv("RESULT_STORE_MAX_BYTES", 512 * 1024 * 1024))
+PREVIEW_ROWS = 20
+
+_lock = threading.Lock()
+
+
+def _to_table(columns, rows) -> pa.Table:
+    """Arrow table from DB rows; mixed-type SQLite columns are stored as text."""
+    arrays = []
+    for i in range(len(columns)):
+        values = [row[i] for row in rows]
+        try:
+            arrays.append(pa.array(values))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type=pa.string()))
+    # Arrow needs unique field names; SQL results may repeat a column name
+    names = [f"{name}#{i}" for i, name in enumerate(columns)]
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def _files():
+    if not STORE_DIR.exists():
+        return []
+    return [p for p in STORE_DIR.glob("*/*.arrow") if p.is_file()]
+
+
+def _enforce_budget():
+    """Delete least-recently-used result files until the store fits the budget."""
+    entries = []
+    for path in _files():
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    used = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if used <= STORE_MAX_BYTES:
+            break
+        try:
+            path.unlink()
+            used -= size
+        except FileNotFoundError:
+            pass
+
+
+def save_result(session_id: str, columns, rows) -> dict:
+    """Write a result to disk and return its handle."""
+    session_dir = STORE_DIR / session_id
+    session_dir.mkdir(parents=True, exist_ok=True)
+    result_id = uuid.uuid4().hex
+    path = session_dir / f"{result_id}.arrow"
+
+    feather.write_feather(_to_table(columns, rows), str(path), compression="zstd")
+    with _lock:
+        _enforce_budget()
+    return {"session": session_id, "id": result_id, "path": str(path)}
+
+
+def load_result(handle: dict):
+    """Rows of a stored result, or None if it has been evicted."""
+    path = Path(handle["path"])
+    try:
+        table = feather.read_table(str(path))
+        # Touch the file so eviction sees it as recently used
+        now = time.time()
+        os.utime(path, (now, now))
+    except (FileNotFoundError, OSError, pa.ArrowInvalid):
+        return None
+    return list(zip(*(col.to_pylist() for col in table.columns)))
+
+
+def drop_session(session_id: str):
+    """Remove every stored result of a session (e.g. on "clear chat")."""
+    shutil.rmtree(STORE_DIR / session_id, ignore_errors=True)
+
+
+def store_size() -> int:
+    """Bytes currently held by the store."""
+    return sum(p.stat().st_size for p in _files())
+
+
+# On disk, with its own budget: reported, not counted against memory ceilings
+register_cache("result_store", store_size, kind="disk")
+
+
+# =========================
+# MESSAGE DATA HELPERS
+# =========================
+def make_result_data(session_id: str, columns, rows, **meta) -> dict:
+    """
+    Data payload for a chat message. Small results stay inline; larger ones
+    are spilled to disk and only a preview is kept in session state.
+    """
+    data = {"columns": list(columns), **meta}
+    data.setdefault("total", len(rows))
+    if len(rows) <= PREVIEW_ROWS:
+        data["rows"] = list(rows)
+        return data
+    data["preview"] = list(rows[:PREVIEW_ROWS])
+    data["cached_rows"] = len(rows)
+    data["result"] = save_result(session_id, columns, rows)
+    return data
+
+
+def result_rows(data: dict):
+    """All cached rows of a message payload, or None if they were evicted."""
+    if "rows" in data:
+        return data["rows"]
+    if "result" in data:
+        return load_result(data["result"])
+    return None
@@ -0,0 +1,118 @@
+import math
+
+# =========================
+# RESULT SUMMARIZATION
+# =========================
+# explain_answer used to paste rows[:50] into the prompt, which is token
+# heavy and silently drops everything after row 50. This builds a compact,
+# fixed-size summary over the FULL result (totals, top/bottom-k,
+# distributions, null counts) plus a small sample of rows. pandas is
+# imported on first use, so importing an agent stays fast.
+
+MAX_COLUMNS = 20          # columns described in the summary
+TOP_K = 5                 # top/bottom rows and most frequent values
+MAX_DISTRIBUTION = 25     # full value distribution if a column has <= this many values
+SAMPLE_ROWS = 10          # raw rows included as a sample
+MAX_VALUE_CHARS = 40      # long text values are truncated
+
+
+def _short(value) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NULL"
+    text = str(value).strip()
+    if len(text) > MAX_VALUE_CHARS:
+        text = text[:MAX_VALUE_CHARS - 1] + "…"
+    return text
+
+
+def _num(value) -> str:
+    value = float(value)
+    return f"{int(value):,}" if value.is_integer() else f"{value:,.2f}"
+
+
+def _format_rows(df) -> str:
+    return "\n".join(
+        "  " + " | ".join(_short(v) for v in row)
+        for row in df.itertuples(index=False, name=None)
+    )
+
+
+def _is_measure(name: str, series) -> bool:
+    """Numeric columns worth totalling (counts, sums) rather than IDs."""
+    import pandas as pd
+
+    if not pd.api.types.is_numeric_dtype(series) or pd.api.types.is_bool_dtype(series):
+        return False
+    lowered = name.lower()
+    return not (lowered == "id" or lowered.endswith("_id") or lowered.endswith("_no") or lowered == "booth")
+
+
+def summarize_result(columns, rows, total=None) -> str:
+    """
+    Compact text summary of a query result for the answer prompt.
+    Its size depends on the number of columns (capped), not on the number of rows.
+    `total` is the full row count when only the first rows were fetched.
+    """
+    total_rows = len(rows)
+    if total_rows == 0:
+        return "Rows returned: 0 (no matching records)"
+
+    import pandas as pd
+
+    df = pd.DataFrame(list(rows), columns=list(columns))
+    described = list(df.columns[:MAX_COLUMNS])
+
+    lines = [f"Rows returned: {total_rows}", f"Columns: {', '.join(map(str, df.columns))}"]
+    if total is not None and total > total_rows:
+        lines[0] = (
+            f"Rows returned: {total} in total; the statistics below cover the "
+            f"first {total_rows} rows only"
+        )
+
+    # Small results are sent as-is, the summary adds nothing
+    if total_rows <= SAMPLE_ROWS:
+        lines += ["All rows:", _format_rows(df)]
+        return "\n".join(lines)
+
+    nulls = df[described].isna().sum()
+    measures = [c for c in described if _is_measure(str(c), df[c])]
+
+    lines.append("Column summary:")
+    for col in described:
+        series = df[col]
+        null_note = f"{int(nulls[col])} nulls"
+        if col in measures:
+            numeric = pd.to_numeric(series, errors="coerce")
+            lines.append(
+                f"- {col} (number): total {_num(numeric.sum())}, min {_num(numeric.min())}, "
+                f"max {_num(numeric.max())}, mean {_num(numeric.mean())}, {null_note}"
+            )
+            continue
+        counts = series.astype("object").where(series.notna(), None).map(_short).value_counts()
+        distinct = len(counts)
+        if distinct == total_rows:
+            lines.append(f"- {col}: all {distinct} values distinct, {null_note}")
+        elif distinct <= MAX_DISTRIBUTION:
+            dist = ", ".join(f"{k} ({v})" for k, v in counts.items())
+            lines.append(f"- {col}: {distinct} distinct, {null_note}; distribution: {dist}")
+        else:
+            top = ", ".join(f"{k} ({v})" for k, v in counts.head(TOP_K).items())
+            lines.append(f"- {col}: {distinct} distinct, {null_note}; most frequent: {top}")
+    if len(df.columns) > MAX_COLUMNS:
+        lines.append(f"- ... {len(df.columns) - MAX_COLUMNS} more columns not summarized")
+
+    # Ranked extremes by the main measure (e.g. visitor_count)
+    if measures:
+        key = measures[-1]
+        # Rows without a numeric value are neither top nor bottom
+        ordered = df.assign(_key=pd.to_numeric(df[key], errors="coerce")).dropna(subset=["_key"])
+        ordered = ordered.sort_values("_key", kind="stable").drop(columns="_key")
+        if not ordered.empty:
+            lines.append(f"Top {TOP_K} rows by {key}:")
+            lines.append(_format_rows(ordered.tail(TOP_K).iloc[::-1][described]))
+            lines.append(f"Bottom {TOP_K} rows by {key}:")
+            lines.append(_format_rows(ordered.head(TOP_K)[described]))
+
+    lines.append(f"Sample rows (first {SAMPLE_ROWS} of {total_rows}):")
+    lines.append(_format_rows(df.head(SAMPLE_ROWS)[described]))
+    return "\n".join(lines)
@@ -0,0 +1,220 @@
+from llm_registry import invoke
+from decomposer import decompose_question, is_cross_domain, mentioned_agents
+from resilience import DEGRADED_ERRORS
+from worker_pool import get_pool
+from pipeline import AGENTS
+from template_cache import has_servable_template
+from admission import PRIORITY_CACHED, PRIORITY_NORMAL
+
+# =========================
+# QUESTION ROUTING
+# =========================
+# Shared by the Streamlit app and the HTTP API (api_server.py). `history`
+# is prior chat messages prepended to every classifier call; the app passes
+# its chat memory, API callers may pass none. When the LLM is degraded
+# (see resilience.py) the classifiers fall back to keyword rules.
+
+
+def ask_llm(messages, profile="default", history=()):
+    return invoke(list(history) + messages, profile)
+
+
+def is_general_question(question: str, history=()) -> bool:
+    """
+    Returns True if the question is general and does NOT need DB.
+    """
+    prompt = f"""
+Classify the question.
+
+Return ONLY one word:
+
+GENERAL  → greetings, help, explanation, who are you, what can you do,
+            definitions, casual talk, non-database questions
+
+DATA     → anything asking for numbers, counts, lists, records,
+            visitors, booths, wards, assemblies, beneficiaries
+
+Question: "{question}"
+"""
+
+    try:
+        response = ask_llm([{"role": "user", "content": prompt}], "classify", history)
+    except DEGRADED_ERRORS:
+        return False    # let the data pipeline (and its fallbacks) handle it
+    label = response.strip().upper()
+
+    return "GENERAL" in label
+
+
+def answer_general_question(question: str, history=()) -> str:
+    """
+    Direct LLM response for general questions.
+    No SQL involved.
+    """
+    prompt = f"""
+You are a helpful AI assistant for a Constituency data system.
+
+Answer clearly and briefly.
+
+User question:
+{question}
+"""
+    try:
+        return ask_llm([{"role": "user", "content": prompt}], "general", history)
+    except DEGRADED_ERRORS:
+        return "I'm having trouble reaching the language service right now. Please try again in a moment."
+
+# =========================
+# FOLLOW-UP QUESTIONS
+# =========================
+def is_followup_question(question: str) -> bool:
+    followup_words = [
+        "how many",
+        "what about",
+        "same",
+        "and",
+        "also",
+        "count",
+        "total",
+        "then",
+        "for this",
+        "for that"
+    ]
+
+    q = question.lower()
+
+    return any(word in q for word in followup_words)
+
+
+def rewrite_question(question: str, last_question, history=()):
+    """Rewrite a follow-up into a standalone question using the previous one."""
+    if not last_question:
+        return question
+
+    prompt = f"""
+You are rewriting a follow-up question into a full standalone question.
+
+Previous question:
+{last_question}
+
+Follow-up question:
+{question}
+
+Return a complete rewritten question.
+Only return the rewritten sentence.
+"""
+
+    try:
+        return ask_llm([{"role": "user", "content": prompt}], "rewrite", history)
+    except DEGRADED_ERRORS:
+        return question
+
+
+# =========================
+# DETECT AGENT
+# =========================
+def detect_agent(question, history=()):
+    """Detect which agent should handle the query"""
+    
+    prompt = f"""
+Analyze this question and return ONLY one word: VISITOR, HIERARCHY, or BENEFICIARY
+If the user asks to which assembly you are created for or what assembly data you have then you must need to return BENEFICIARY.(critical)
+***If the user question specifies about booths count, wards,shakthi kendras count and assemblies count and the following names :
+1. RAKESH DESAI
+2. HARSHBHAI SANGHVI
+3. R.C. PATEL
+4. NARESHBHAI MANGABHAI PATEL
+5. SANDIP DESAI
+6. MANUBHAI PATEL
+7. Sangitaben Rajendrakumar Patil
+then you must need to return HIERARCHY.***
+If the user mention under which MP these assemblies or whose is the Mp of these booths or wards or shakthi kendras then you must need to return HIERARCHY.(critical)
+-If the user question contains reasons or reason categories it must need to return VISITOR.
+-when the user asks about incharges names and how many booths or wards or shakthi kendras are assigned to which incharge then you must need to return HIERARCHY.
+-when the user asks about schems and incharges in one question then you must need to return BENEFICIARY.
+-If the user asks about booths wise visiter counts or assembly vise visitor counts and wars vise and shakthi kendra vise visitor counts then you must need to return VISITOR.
+-If the user asks about booth wise, ward wise, shakthi kendra wise, assembly wise, constituency wise, MP wise beneficiaries details then you must need to return BENEFICIARY.
+-If the user asks about unique visitors count then you must need to return VISITOR.
+Question: "{question}
+
+Rules:
+- If the user question is greeting then instantly pass to VISITOR agent
+- VISITOR: Questions about visitors, visits, work status, visitor details,date wise operations.
+- HIERARCHY: Questions about booths, wards, constituencies, AC, administrative structure
+- BENEFICIARY: Questions about beneficiaries,schemes,beneficiary benifts,beneficiary items, beneficiary categories, beneficiary details
+Return ONLY:VISITOR, HIERARCHY, or BENEFICIARY
+"""
+    
+    try:
+        response = ask_llm([{"role": "user", "content": prompt}], "classify", history)
+    except DEGRADED_ERRORS:
+        agents = mentioned_agents(question)
+        return agents[0] if agents else "visitor"
+    agent = response.strip().upper()
+    
+    if "VISITOR" in agent:
+        return "visitor"
+    elif "HIERARCHY" in agent:
+        return "hierarchy"
+    elif "BENEFICIARY" in agent:
+        return "beneficiary"
+    else:
+        return "visitor"
+
+
+# =========================
+# DATA QUESTIONS
+# =========================
+def route_data_question(question, history=()):
+    """
+    Pick the execution for a data question: {"agent": ..., "decomposition": ...}.
+    Aggregate comparisons across agents run on the cross-domain fact tables;
+    other multi-agent questions are split and joined (see decomposer.py).
+    """
+    if is_cross_domain(question):
+        return {"agent": "cross", "decomposition": None}
+    decomposition = decompose_question(question)
+    if decomposition:
+        return {"agent": decomposition["parts"][0]["agent"], "decomposition": decomposition}
+    return {"agent": detect_agent(question, history), "decomposition": None}
+
+
+def fallback_route(route, question, result):
+    """Second route to try when the first one failed, or None."""
+    if route["agent"] != "cross" or result["success"] or result.get("too_expensive"):
+        return None
+    decomposition = decompose_question(question)
+    if not decomposition:
+        return None
+    print("CROSS-DOMAIN QUERY FAILED, DECOMPOSING:", result["error"])
+    return {"agent": decomposition["parts"][0]["agent"], "decomposition": decomposition}
+
+
+def submit_route(route, question, lang="English"):
+    """Start (or join) the pipeline job for a routed question on the shared pool."""
+    return get_pool().submit(route["agent"], question, lang, decomposition=route["decomposition"])
+
+
+# =========================
+# ADMISSION COST
+# =========================
+# LLM calls a question is expected to make, for the admission controller's
+# global bucket (see admission.py): classify + route + plan + SQL + answer
+# (+ rewrite) on the full pipeline; classify + answer when a verified
+# template or the previous result's cached rows can answer it.
+FULL_PIPELINE_LLM_CALLS = 6
+CACHED_LLM_CALLS = 2
+
+
+def estimate_llm_calls(question, refined=False):
+    """(expected LLM calls, admission priority) for a question."""
+    if refined:
+        return 1, PRIORITY_CACHED
+    for agent_key, module in AGENTS.items():
+        try:
+            if has_servable_template(agent_key, module, question):
+                return CACHED_LLM_CALLS, PRIORITY_CACHED
+        except Exception as e:
+            print(f"⚠️ Template check failed for {agent_key}: {e}")
+            break
+    return FULL_PIPELINE_LLM_CALLS, PRIORITY_NORMAL
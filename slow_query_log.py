@@ -0,0 +1,280 @@
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import sqlglot
+from sqlglot import exp
+
+from query_guard import explain_plan, format_plan
+from telemetry import count_event
+
+# =========================
+# SLOW-QUERY LOG
+# =========================
+# Every run_sql execution is folded into per-fingerprint totals (runs, time,
+# rows, errors) in a separate SQLite file, so the log never contends with
+# converted.db. A fingerprint is the SQL with literals masked and IN lists
+# collapsed: "beneficiaries in booth 12" and "... booth 40" are one query
+# shape. Executions slower than SLOW_QUERY_MS (or interrupted by the query
+# guard) also keep a sample with the literal SQL and its EXPLAIN QUERY PLAN,
+# the last SLOW_QUERY_SAMPLES per fingerprint.
+#
+#   python slow_query_log.py                  worst offenders by total time
+#   python slow_query_log.py --by max --plans slowest single runs, with plans
+#
+# This is the data for choosing indexes and summary tables.
+
+BASE_DIR = Path(__file__).resolve().parent
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "on").lower() != "off"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 500))
+SLOW_QUERY_DB = Path(os.getenv("SLOW_QUERY_DB", BASE_DIR / "slow_queries.db"))
+SLOW_QUERY_SAMPLES = int(os.getenv("SLOW_QUERY_SAMPLES", 20))     # kept per fingerprint
+
+REPORT_ORDERS = {
+    "total": "total_ms DESC",
+    "max": "max_ms DESC",
+    "avg": "total_ms / executions DESC",
+    "runs": "executions DESC",
+    "slow": "slow_count DESC, total_ms DESC"
+}
+
+_lock = threading.Lock()
+_initialized = False
+
+
+def _connect():
+    conn = sqlite3.connect(SLOW_QUERY_DB, timeout=5)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def init_slow_query_tables(conn):
+    """Create the log tables if they don't exist (called with _lock held)"""
+    global _initialized
+    if _initialized:
+        return
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS query_fingerprints (
+        fingerprint TEXT,
+        agent TEXT,
+        normalized_sql TEXT,
+        executions INTEGER DEFAULT 0,
+        total_ms REAL DEFAULT 0,
+        max_ms REAL DEFAULT 0,
+        total_rows INTEGER DEFAULT 0,
+        max_rows INTEGER DEFAULT 0,
+        slow_count INTEGER DEFAULT 0,
+        error_count INTEGER DEFAULT 0,
+        first_seen TEXT,
+        last_seen TEXT,
+        PRIMARY KEY (fingerprint, agent)
+    )
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS slow_queries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        fingerprint TEXT,
+        agent TEXT,
+        sql TEXT,
+        elapsed_ms REAL,
+        rows INTEGER,
+        error TEXT,
+        plan TEXT,
+        logged_at TEXT
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_slow_queries_fingerprint ON slow_queries (fingerprint, agent)")
+    conn.commit()
+    _initialized = True
+
+
+# =========================
+# FINGERPRINTS
+# =========================
+def _mask(node):
+    if isinstance(node, exp.In) and node.expressions:
+        return exp.In(this=node.this.copy(), expressions=[exp.Placeholder()])
+    if isinstance(node, exp.Literal):
+        return exp.Placeholder()
+    return node
+
+
+def normalize_sql(sql: str) -> str:
+    """SQL with literals replaced by ? and IN (...) lists collapsed to IN (?)."""
+    sql = sql.strip().rstrip(";")
+    try:
+        return sqlglot.parse_one(sql, dialect="sqlite").transform(_mask).sql(dialect="sqlite")
+    except Exception:
+        masked = re.sub(r"'(?:[^']|'')*'", "?", sql)
+        masked = re.sub(r"(?<![\w.])\d+(?:\.\d+)?\b", "?", masked)
+        masked = re.sub(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", "IN (?)", masked, flags=re.IGNORECASE)
+        return re.sub(r"\s+", " ", masked)
+
+
+def fingerprint(sql: str):
+    """(fingerprint, normalized SQL) of a query."""
+    normalized = normalize_sql(sql)
+    return hashlib.sha1(normalized.lower().encode("utf-8")).hexdigest()[:12], normalized
+
+
+# =========================
+# LOGGING
+# =========================
+def _plan_text(conn, sql: str, error) -> str:
+    plan = getattr(error, "plan", "")     # QueryTooExpensive already carries it
+    if plan:
+        return plan
+    try:
+        return format_plan(explain_plan(conn, sql))
+    except sqlite3.Error:
+        return ""
+
+
+def log_query(conn, agent: str, sql: str, seconds: float, rows=None, error=None):
+    """
+    Record one execution. `conn` is the connection the query ran on; it is
+    only used for EXPLAIN QUERY PLAN when the query was slow or failed.
+    Never raises: a logging problem must not fail the question.
+    """
+    if not SLOW_QUERY_LOG:
+        return
+    elapsed_ms = seconds * 1000
+    slow = elapsed_ms >= SLOW_QUERY_MS or error is not None
+    try:
+        key, normalized = fingerprint(sql)
+        plan = _plan_text(conn, sql, error) if slow else ""
+        now = datetime.now().isoformat(timespec="seconds")
+        with _lock:
+            log = _connect()
+            try:
+                init_slow_query_tables(log)
+                log.execute("""
+                INSERT INTO query_fingerprints
+                    (fingerprint, agent, normalized_sql, executions, total_ms, max_ms,
+                     total_rows, max_rows, slow_count, error_count, first_seen, last_seen)
+                VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (fingerprint, agent) DO UPDATE SET
+                    executions = executions + 1,
+                    total_ms = total_ms + excluded.total_ms,
+                    max_ms = MAX(max_ms, excluded.max_ms),
+                    total_rows = total_rows + excluded.total_rows,
+                    max_rows = MAX(max_rows, excluded.max_rows),
+                    slow_count = slow_count + excluded.slow_count,
+                    error_count = error_count + excluded.error_count,
+                    last_seen = excluded.last_seen
+                """, (key, agent, normalized, elapsed_ms, elapsed_ms, rows or 0, rows or 0,
+                      int(slow), int(error is not None), now, now))
+                if slow:
+                    log.execute("""
+                    INSERT INTO slow_queries (fingerprint, agent, sql, elapsed_ms, rows, error, plan, logged_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """, (key, agent, sql, elapsed_ms, rows, str(error)[:500] if error else None, plan, now))
+                    log.execute("""
+                    DELETE FROM slow_queries WHERE fingerprint = ? AND agent = ? AND id NOT IN (
+                        SELECT id FROM slow_queries WHERE fingerprint = ? AND agent = ?
+                        ORDER BY id DESC LIMIT ?
+                    )
+                    """, (key, agent, key, agent, SLOW_QUERY_SAMPLES))
+                log.commit()
+            finally:
+                log.close()
+        if slow:
+            count_event("sql.slow")
+    except Exception as e:
+        print(f"⚠️ Slow-query log write failed: {e}")
+
+
+# =========================
+# REPORT
+# =========================
+def slow_query_report(top: int = 20, order: str = "total", agent: str = None):
+    """Worst fingerprints with their share of all query time and latest slow sample."""
+    if not SLOW_QUERY_DB.exists():
+        return []
+    conn = sqlite3.connect(SLOW_QUERY_DB)
+    conn.row_factory = sqlite3.Row
+    try:
+        where, params = ("WHERE agent = ?", [agent]) if agent else ("", [])
+        all_ms = conn.execute(f"SELECT COALESCE(SUM(total_ms), 0) FROM query_fingerprints {where}", params).fetchone()[0]
+        rows = conn.execute(
+            f"SELECT * FROM query_fingerprints {where} ORDER BY {REPORT_ORDERS[order]} LIMIT ?",
+            params + [top]
+        ).fetchall()
+        report = []
+        for row in rows:
+            sample = conn.execute("""
+            SELECT sql, elapsed_ms, rows, error, plan, logged_at FROM slow_queries
+            WHERE fingerprint = ? AND agent = ? ORDER BY id DESC LIMIT 1
+            """, (row["fingerprint"], row["agent"])).fetchone()
+            report.append({
+                "fingerprint": row["fingerprint"],
+                "agent": row["agent"],
+                "runs": row["executions"],
+                "slow": row["slow_count"],
+                "errors": row["error_count"],
+                "avg_ms": round(row["total_ms"] / row["executions"], 1),
+                "max_ms": round(row["max_ms"], 1),
+                "total_ms": round(row["total_ms"], 1),
+                "time_share": round(row["total_ms"] / all_ms, 3) if all_ms else 0.0,
+                "avg_rows": round(row["total_rows"] / row["executions"], 1),
+                "max_rows": row["max_rows"],
+                "last_seen": row["last_seen"],
+                "normalized_sql": row["normalized_sql"],
+                "sample": dict(sample) if sample else None
+            })
+        return report
+    finally:
+        conn.close()
+
+
+def print_report(report, plans: bool = False):
+    if not report:
+        print("No queries logged yet.")
+        return
+    print(f"\n🐢 Slowest query shapes (slow = over {SLOW_QUERY_MS:g}ms or interrupted)")
+    print(f"{'fingerprint':<12} {'agent':<11} {'runs':>6} {'slow':>5} {'err':>4} "
+          f"{'avg ms':>8} {'max ms':>9} {'total s':>8} {'share':>6} {'avg rows':>9}  sql")
+    for entry in report:
+        sql = entry["normalized_sql"]
+        print(f"{entry['fingerprint']:<12} {entry['agent'] or '-':<11} {entry['runs']:>6} {entry['slow']:>5} "
+              f"{entry['errors']:>4} {entry['avg_ms']:>8.1f} {entry['max_ms']:>9.1f} "
+              f"{entry['total_ms'] / 1000:>8.2f} {entry['time_share']:>6.1%} {entry['avg_rows']:>9.1f}  "
+              f"{sql if len(sql) <= 80 else sql[:77] + '...'}")
+
+    if not plans:
+        return
+    for entry in report:
+        sample = entry["sample"]
+        if not sample:
+            continue
+        print(f"\n── {entry['fingerprint']} ({entry['agent']}) · {sample['elapsed_ms']:.0f}ms, "
+              f"{sample['rows'] if sample['rows'] is not None else '?'} rows, {sample['logged_at']}")
+        print(entry["normalized_sql"])
+        if sample["error"]:
+            print(f"error: {sample['error']}")
+        print("plan:")
+        for line in (sample["plan"] or "(not captured)").splitlines():
+            print(f"  {line}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report the worst generated-SQL shapes from the slow-query log.")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--by", choices=sorted(REPORT_ORDERS), default="total", help="ranking (default: total time)")
+    parser.add_argument("--agent", help="only this agent's queries")
+    parser.add_argument("--plans", action="store_true", help="print the latest slow sample and its plan")
+    args = parser.parse_args(argv)
+    report = slow_query_report(args.top, args.by, args.agent)
+    print_report(report, args.plans)
+    return report
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,180 @@
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import sqlglot
+
+from telemetry import count_event
+
+# =========================
+# SQL REPAIR + FIX CACHE
+# =========================
+# When the validator or SQLite rejects generated SQL, the error is sent
+# back to SQL generation (at most SQL_REPAIR_ATTEMPTS times, within
+# SQL_REPAIR_BUDGET seconds) instead of failing the question. Successful
+# repairs are remembered in converted.db:
+#   kind='sql'    exact bad SQL -> fixed SQL
+#   kind='column' a wrong column name -> the column the fix used instead
+# so the same mistake is corrected locally next time, without an LLM call.
+
+REPAIR_ATTEMPTS = int(os.getenv("SQL_REPAIR_ATTEMPTS", 2))
+REPAIR_BUDGET_SECONDS = float(os.getenv("SQL_REPAIR_BUDGET", 30))
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_PATH = BASE_DIR / "converted.db"
+
+# SQLite errors the generated SQL itself caused; anything else (locked or
+# unreadable database, I/O, interrupted) is an environment problem a new
+# query cannot fix
+REPAIRABLE_SQLITE_ERRORS = re.compile(
+    r"no such (?:column|table|function)|syntax error|incomplete input|unrecognized token"
+    r"|ambiguous column|misuse of (?:aliased )?(?:aggregate|window)|wrong number of arguments"
+    r"|order by term|group by clause is required|having clause on a non-aggregate"
+    r"|aggregate functions are not allowed|sub-select returns|do not have the same number of result columns|row value misused",
+    re.IGNORECASE
+)
+
+COLUMN_ERROR = re.compile(r"(?:Invalid column(?: in aggregate)?|no such column):\s*([\w.]+)", re.IGNORECASE)
+
+_init_lock = threading.Lock()
+_initialized = False
+
+
+def init_fix_table():
+    """Create the sql_fixes table if it doesn't exist"""
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS sql_fixes (
+            agent TEXT,
+            kind TEXT,
+            source TEXT,
+            target TEXT,
+            hits INTEGER DEFAULT 0,
+            updated_at TEXT,
+            PRIMARY KEY (agent, kind, source)
+        )
+        """)
+        conn.commit()
+        conn.close()
+        _initialized = True
+
+
+def is_repairable(error: Exception) -> bool:
+    """Validator rejections and SQLite syntax/schema errors can be sent back to SQL generation."""
+    if isinstance(error, sqlite3.OperationalError):
+        return REPAIRABLE_SQLITE_ERRORS.search(str(error)) is not None
+    return isinstance(error, ValueError) and "Only SELECT" not in str(error)
+
+
+def fingerprint(sql: str) -> str:
+    return re.sub(r"\s+", " ", sql.strip().rstrip(";")).strip().lower()
+
+
+def _column_names(sql: str):
+    try:
+        return {c.name.lower() for c in sqlglot.parse_one(sql, dialect="sqlite").find_all(sqlglot.exp.Column)}
+    except Exception:
+        return set()
+
+
+def _bad_column(error) -> str:
+    match = COLUMN_ERROR.search(str(error))
+    return match.group(1).split(".")[-1].lower() if match else None
+
+
+def substitute_column(sql: str, bad: str, good: str):
+    """Rename every reference to column `bad` as `good`; None if the SQL cannot be parsed."""
+    try:
+        parsed = sqlglot.parse_one(sql, dialect="sqlite")
+    except Exception:
+        return None
+
+    def rename(node):
+        if isinstance(node, sqlglot.exp.Column) and node.name.lower() == bad:
+            node = node.copy()
+            node.set("this", sqlglot.exp.to_identifier(good))
+        return node
+
+    return parsed.transform(rename).sql(dialect="sqlite") + ";"
+
+
+def _lookup(conn, agent, kind, source):
+    row = conn.execute(
+        "SELECT target FROM sql_fixes WHERE agent = ? AND kind = ? AND source = ?",
+        (agent, kind, source)
+    ).fetchone()
+    if row:
+        conn.execute(
+            "UPDATE sql_fixes SET hits = hits + 1 WHERE agent = ? AND kind = ? AND source = ?",
+            (agent, kind, source)
+        )
+        conn.commit()
+    return row[0] if row else None
+
+
+def cached_fix(agent: str, sql: str, error):
+    """A locally known fix for this failure: the exact SQL, or a learned column substitution."""
+    init_fix_table()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        fixed = _lookup(conn, agent, "sql", fingerprint(sql))
+        if fixed:
+            count_event("sql.fix_cache_hit")
+            return fixed
+        bad = _bad_column(error)
+        good = _lookup(conn, agent, "column", bad) if bad else None
+        if good:
+            fixed = substitute_column(sql, bad, good)
+            if fixed:
+                count_event("sql.column_fix_hit")
+                print(f"🩹 Replaced column {bad} -> {good} (learned fix)")
+                return fixed
+    finally:
+        conn.close()
+    return None
+
+
+def remember_fix(agent: str, bad_sql: str, error, fixed_sql: str):
+    """Store a successful repair, plus the column substitution it implies."""
+    init_fix_table()
+    now = datetime.now().isoformat()
+    entries = [("sql", fingerprint(bad_sql), fixed_sql)]
+
+    bad = _bad_column(error)
+    removed = _column_names(bad_sql) - _column_names(fixed_sql)
+    added = _column_names(fixed_sql) - _column_names(bad_sql)
+    if bad and removed == {bad} and len(added) == 1:
+        entries.append(("column", bad, added.pop()))
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.executemany(
+            """
+            INSERT INTO sql_fixes (agent, kind, source, target, hits, updated_at)
+            VALUES (?, ?, ?, ?, 0, ?)
+            ON CONFLICT(agent, kind, source) DO UPDATE SET target = excluded.target, updated_at = excluded.updated_at
+            """,
+            [(agent, kind, source, target, now) for kind, source, target in entries]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def repair_feedback(failures) -> list:
+    """Chat turns showing SQL generation its failed queries and the errors they raised."""
+    messages = []
+    for sql, error in failures:
+        messages.append({"role": "assistant", "content": sql})
+        messages.append({
+            "role": "user",
+            "content": f"That query failed with: {error}\nReturn a corrected SQLite query only."
+        })
+    return messages
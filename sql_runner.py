@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import time
+
+import sqlglot
+from sqlglot import exp
+
+from query_guard import query_limits
+from slow_query_log import log_query
+
+# =========================
+# CAPPED, STREAMING SQL EXECUTION
+# =========================
+# Rows are pulled with fetchmany() up to SQL_MAX_ROWS so a "list all ..."
+# question never materializes the whole table in Python. When the cap is
+# hit, the exact total is counted separately and further rows can be
+# browsed page by page: by keyset when the query is ordered by its table's
+# INTEGER PRIMARY KEY, otherwise by LIMIT/OFFSET over the original SQL, so
+# pages always follow the answer's own row order.
+
+MAX_FETCH_ROWS = int(os.getenv("SQL_MAX_ROWS", 5000))
+FETCH_BATCH_SIZE = int(os.getenv("SQL_FETCH_BATCH", 500))
+PAGE_SIZE = 20
+KEYSET_COLUMN = "id"
+
+
+def _strip_sql(sql: str) -> str:
+    return sql.strip().rstrip(";").strip()
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+def run_query(db_path, sql: str, max_rows: int = None, agent: str = None):
+    """
+    Execute a SELECT and stream at most `max_rows` rows.
+    Returns (columns, rows, total) where total is the exact number of rows
+    the query produces, even when only the first `max_rows` were fetched.
+    Every execution is recorded in the slow-query log under `agent`.
+    """
+    max_rows = MAX_FETCH_ROWS if max_rows is None else max_rows
+
+    conn = sqlite3.connect(db_path)
+    started = time.perf_counter()
+    try:
+        # Step budget / deadline cover the fetch and the total count
+        with query_limits(conn, sql):
+            cur = conn.cursor()
+            cur.execute(sql)
+            columns = [d[0] for d in cur.description]
+
+            rows = []
+            while len(rows) < max_rows:
+                batch = cur.fetchmany(min(FETCH_BATCH_SIZE, max_rows - len(rows)))
+                if not batch:
+                    break
+                rows.extend(batch)
+
+            truncated = len(rows) == max_rows and cur.fetchone() is not None
+            cur.close()
+
+            total = len(rows)
+            if truncated:
+                total = conn.execute(f"SELECT COUNT(*) FROM ({_strip_sql(sql)})").fetchone()[0]
+        log_query(conn, agent, sql, time.perf_counter() - started, total)
+        return columns, rows, total
+    except Exception as e:
+        log_query(conn, agent, sql, time.perf_counter() - started, error=e)
+        raise
+    finally:
+        conn.close()
+
+
+def keyset_column(conn, sql: str, columns):
+    """
+    KEYSET_COLUMN when it provably identifies each row in query order: the
+    query reads one table, selects that table's INTEGER PRIMARY KEY and is
+    ORDER BY it ascending (no GROUP BY, aggregates or LIMIT). None otherwise.
+    """
+    if list(columns).count(KEYSET_COLUMN) != 1:
+        return None
+    try:
+        parsed = sqlglot.parse_one(_strip_sql(sql), dialect="sqlite")
+    except Exception:
+        return None
+    tables = list(parsed.find_all(exp.Table))
+    if (not isinstance(parsed, exp.Select) or len(tables) != 1 or len(list(parsed.find_all(exp.Select))) != 1
+            or parsed.args.get("group") or parsed.args.get("limit") or parsed.args.get("offset")
+            or parsed.find(exp.AggFunc) or parsed.find(exp.Window)):
+        return None
+
+    projected = [e for e in parsed.expressions if e.alias_or_name == KEYSET_COLUMN]
+    if projected and not (isinstance(projected[0].unalias(), exp.Column) and projected[0].unalias().name == KEYSET_COLUMN):
+        return None     # e.g. "booth_id AS id"
+    if not projected and not any(isinstance(e, exp.Star) for e in parsed.expressions):
+        return None
+    order = parsed.args.get("order")
+    ordered = order.expressions if order else []
+    if (len(ordered) != 1 or ordered[0].args.get("desc") or not isinstance(ordered[0].this, exp.Column)
+            or ordered[0].this.name != KEYSET_COLUMN):
+        return None
+
+    info = conn.execute(f"PRAGMA table_info({_quote(tables[0].name)})").fetchall()
+    primary = [(name, col_type) for _, name, col_type, _, _, pk in info if pk]
+    return KEYSET_COLUMN if primary == [(KEYSET_COLUMN, "INTEGER")] else None
+
+
+def fetch_page(db_path, sql: str, columns, after=None, page_size: int = PAGE_SIZE):
+    """
+    One page of an arbitrary SELECT, in the query's own row order.
+    `after` is the cursor returned for the previous page, (offset, key), or
+    None for the first page. Returns (rows, next_cursor); next_cursor is
+    None on the last page.
+
+    Queries ordered by their table's INTEGER PRIMARY KEY are paged by
+    keyset on it; everything else by LIMIT/OFFSET over the original SQL.
+    """
+    columns = list(columns)
+    offset, after_key = after or (0, None)
+    source = _strip_sql(sql)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        key = keyset_column(conn, source, columns)
+        if key is not None and after_key is not None:
+            key_expr = f"page_src.{_quote(key)}"
+            query = f"SELECT * FROM ({source}) AS page_src WHERE {key_expr} > ? ORDER BY {key_expr} LIMIT ?"
+            params = [after_key, page_size + 1]
+        else:
+            # First page, non-unique results, or a cursor that only knows its offset
+            query = f"SELECT * FROM ({source}) AS page_src LIMIT ? OFFSET ?"
+            params = [page_size + 1, offset]
+        with query_limits(conn, query):
+            rows = conn.execute(query, params).fetchall()
+    finally:
+        conn.close()
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if not has_more:
+        return rows, None
+    last_key = rows[-1][columns.index(key)] if key is not None else None
+    return rows, (offset + len(rows), last_key)
@@ -0,0 +1,120 @@
+import threading
+from collections import defaultdict, deque
+
+# =========================
+# LLM TELEMETRY
+# =========================
+# Per-profile call counts, latency and token cost for the running process,
+# so the effect of moving a stage to a smaller deployment is visible.
+
+LATENCY_WINDOW = 500   # recent calls kept per profile for percentiles
+PROFILE_HISTORY = 50   # recent request profiles listed (see profiling.py)
+
+_lock = threading.Lock()
+_stats = defaultdict(lambda: {
+    "calls": 0,
+    "errors": 0,
+    "input_tokens": 0,
+    "output_tokens": 0,
+    "cost": 0.0,
+    "latencies": deque(maxlen=LATENCY_WINDOW)
+})
+
+
+def token_usage(response):
+    """(input_tokens, output_tokens) reported by a LangChain chat response."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    if usage:
+        return usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    usage = (getattr(response, "response_metadata", None) or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+
+
+def record_llm_call(profile: str, deployment: str, seconds: float,
+                    input_tokens=0, output_tokens=0, cost=0.0, error=False):
+    with _lock:
+        stats = _stats[(profile, deployment)]
+        stats["calls"] += 1
+        stats["errors"] += int(error)
+        stats["input_tokens"] += input_tokens
+        stats["output_tokens"] += output_tokens
+        stats["cost"] += cost
+        stats["latencies"].append(seconds)
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+def latency_percentile(profile: str, pct, min_samples: int = 1):
+    """Recent latency percentile (seconds) of a profile, or None with too few calls."""
+    with _lock:
+        latencies = [v for (name, _), stats in _stats.items() if name == profile for v in stats["latencies"]]
+    if len(latencies) < min_samples:
+        return None
+    return _percentile(latencies, pct)
+
+
+def profile_report():
+    """One row per (profile, deployment): calls, errors, latency p50/p95, tokens, cost."""
+    with _lock:
+        snapshot = {key: {**stats, "latencies": list(stats["latencies"])} for key, stats in _stats.items()}
+    report = []
+    for (profile, deployment), stats in sorted(snapshot.items()):
+        report.append({
+            "profile": profile,
+            "deployment": deployment,
+            "calls": stats["calls"],
+            "errors": stats["errors"],
+            "p50_ms": round(_percentile(stats["latencies"], 50) * 1000),
+            "p95_ms": round(_percentile(stats["latencies"], 95) * 1000),
+            "input_tokens": stats["input_tokens"],
+            "output_tokens": stats["output_tokens"],
+            "cost_usd": round(stats["cost"], 4)
+        })
+    return report
+
+
+# =========================
+# EVENT COUNTERS
+# =========================
+# Simple named counters (e.g. plan parse outcomes) for failure rates.
+_events = defaultdict(int)
+
+
+def count_event(name: str, n: int = 1):
+    with _lock:
+        _events[name] += n
+
+
+def event_counts() -> dict:
+    with _lock:
+        return dict(_events)
+
+
+# =========================
+# REQUEST PROFILES
+# =========================
+# Saved flamegraphs of profiled questions, newest last, with the stage
+# timeline of the job they belong to.
+_profiles = deque(maxlen=PROFILE_HISTORY)
+
+
+def record_profile(entry: dict):
+    with _lock:
+        _profiles.append(entry)
+
+
+def recent_profiles() -> list:
+    with _lock:
+        return list(_profiles)
+
+
+def reset_telemetry():
+    with _lock:
+        _stats.clear()
+        _events.clear()
+        _profiles.clear()
@@ -0,0 +1,390 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+import sqlglot
+
+from telemetry import count_event
+from memory_accounting import register_cache, deep_size
+
+# =========================
+# QUESTION TEMPLATE CACHE
+# =========================
+# Most traffic is a few question shapes with different entities
+# ("how many beneficiaries in <scheme> in <booth>"). After a successful
+# run, known entities and numbers in the question are masked and the SQL
+# is stored with matching parameter slots. A later question with the same
+# shape binds its own values into the SQL and skips the planner and SQL
+# LLM calls.
+#
+# TEMPLATE_CACHE_MODE:
+#   off     no matching, no learning
+#   shadow  templates are only compared against the full pipeline (default)
+#   on      templates verified in shadow TEMPLATE_MIN_VERIFIED times with no
+#           mismatch answer directly; unverified ones keep running in shadow
+
+TEMPLATE_MODE = os.getenv("TEMPLATE_CACHE_MODE", "shadow").lower()
+TEMPLATE_MIN_VERIFIED = int(os.getenv("TEMPLATE_MIN_VERIFIED", 3))
+ENTITY_VALUES_LIMIT = 5000        # distinct values loaded per entity column
+ENTITY_TTL_SECONDS = 3600
+MIN_ENTITY_LENGTH = 3
+
+BASE_DIR = Path(__file__).resolve().parent
+DB_PATH = BASE_DIR / "converted.db"
+
+NUMBER = re.compile(r"(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+
+_init_lock = threading.Lock()
+_initialized = False
+_vocab_lock = threading.Lock()
+_vocab = {}    # agent -> (built_at, surface -> (type, canonical), regex)
+
+
+def init_template_table():
+    """Create the question_templates table if it doesn't exist"""
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        conn = sqlite3.connect(DB_PATH)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS question_templates (
+            agent TEXT,
+            shape TEXT,
+            sql_template TEXT,
+            slots TEXT,
+            hits INTEGER DEFAULT 0,
+            verified INTEGER DEFAULT 0,
+            mismatches INTEGER DEFAULT 0,
+            created_at TEXT,
+            learned_values TEXT,
+            PRIMARY KEY (agent, shape)
+        )
+        """)
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(question_templates)")}
+        if "learned_values" not in columns:
+            # Older tables counted a repeat of the learning question as
+            # verification; start those counts over.
+            conn.execute("ALTER TABLE question_templates ADD COLUMN learned_values TEXT")
+            conn.execute("UPDATE question_templates SET verified = 0")
+        conn.commit()
+        conn.close()
+        _initialized = True
+
+
+# =========================
+# ENTITY MASKING
+# =========================
+def _vocabulary(agent_key, module):
+    """surface text -> (entity type, canonical value), plus a matching regex."""
+    with _vocab_lock:
+        cached = _vocab.get(agent_key)
+        if cached and time.time() - cached[0] < ENTITY_TTL_SECONDS:
+            return cached[1], cached[2]
+
+    vocab = {}
+    for entity_type, values in getattr(module, "ENTITY_VALUES", {}).items():
+        for value in values:
+            vocab[value.lower()] = (entity_type, value)
+            # "163-Limbayat" is also asked about as "limbayat"
+            if "-" in value and value.split("-", 1)[0].isdigit():
+                vocab.setdefault(value.split("-", 1)[1].lower(), (entity_type, value))
+
+    columns = getattr(module, "ENTITY_COLUMNS", {})
+    table = getattr(module, "ENTITY_TABLE", None)
+    if columns and table:
+        try:
+            conn = sqlite3.connect(module.SQLITE_DB_PATH)
+            try:
+                for column, entity_type in columns.items():
+                    try:
+                        rows = conn.execute(
+                            f'SELECT DISTINCT "{column}" FROM "{table}" WHERE "{column}" IS NOT NULL LIMIT ?',
+                            (ENTITY_VALUES_LIMIT,)
+                        ).fetchall()
+                    except sqlite3.Error as e:
+                        print(f"⚠️ Could not load {entity_type} values for {agent_key} from {table}.{column}: {e}")
+                        continue
+                    for (value,) in rows:
+                        value = str(value).strip()
+                        if len(value) >= MIN_ENTITY_LENGTH and not value.isdigit():
+                            vocab.setdefault(value.lower(), (entity_type, value))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"⚠️ Could not load entity values for {agent_key}: {e}")
+
+    surfaces = sorted(vocab, key=len, reverse=True)
+    regex = re.compile(
+        r"(?<!\w)(" + "|".join(re.escape(s) for s in surfaces) + r")(?!\w)"
+    ) if surfaces else None
+    with _vocab_lock:
+        _vocab[agent_key] = (time.time(), vocab, regex)
+    return vocab, regex
+
+
+def clear_vocabulary():
+    with _vocab_lock:
+        _vocab.clear()
+
+
+register_cache("template.vocabulary", lambda: deep_size(_vocab), clear_vocabulary)
+
+
+def _normalize(question: str) -> str:
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?.!")
+
+
+def mask_question(agent_key, module, question: str):
+    """
+    Question shape with entities and numbers replaced by <type> markers,
+    plus the masked values in order: [(type, surface, canonical), ...].
+    """
+    text = _normalize(question)
+    vocab, regex = _vocabulary(agent_key, module)
+    values, parts, position = [], [], 0
+
+    def mask_numbers(segment):
+        def number(match):
+            values.append(("num", match.group(0), match.group(0)))
+            return "<num>"
+        return NUMBER.sub(number, segment)
+
+    for match in (regex.finditer(text) if regex else []):
+        parts.append(mask_numbers(text[position:match.start()]))
+        entity_type, canonical = vocab[match.group(1)]
+        values.append((entity_type, match.group(1), canonical))
+        parts.append(f"<{entity_type}>")
+        position = match.end()
+    parts.append(mask_numbers(text[position:]))
+    return "".join(parts), values
+
+
+# =========================
+# SQL SLOTS
+# =========================
+def _token(index, form):
+    return f"__{form}{index}__"
+
+
+# Literals under these never become slots: "ward 1 ... top 1" must not bind LIMIT
+UNSLOTTED_CLAUSES = (sqlglot.exp.Limit, sqlglot.exp.Offset, sqlglot.exp.Order, sqlglot.exp.Ordered)
+
+
+def _slottable(node) -> bool:
+    """A literal compared against something inside a WHERE or HAVING clause."""
+    compared = False
+    parent = node.parent
+    while parent is not None:
+        if isinstance(parent, UNSLOTTED_CLAUSES) or isinstance(parent, sqlglot.exp.Select):
+            return False
+        if isinstance(parent, sqlglot.exp.Predicate):
+            compared = True
+        if isinstance(parent, (sqlglot.exp.Where, sqlglot.exp.Having)):
+            return compared
+        parent = parent.parent
+    return False
+
+
+def parameterize(sql: str, values):
+    """
+    Replace the question's values in SQL literals with slot tokens.
+    Only literals in WHERE/HAVING comparisons are slotted. Returns
+    (template, slots), or None if some value is not found in exactly one
+    such literal, in which case the SQL is not safe to reuse for other
+    values.
+    """
+    try:
+        parsed = sqlglot.parse_one(sql, dialect="sqlite")
+    except Exception:
+        return None
+    slots = set()
+    found_in = Counter()    # value index -> literals it was slotted in
+
+    def replace(node):
+        if not isinstance(node, sqlglot.exp.Literal) or not _slottable(node):
+            return node
+        text = node.this
+        for index, (entity_type, surface, canonical) in enumerate(values):
+            if entity_type == "num":
+                if not node.is_string and text == surface:
+                    slots.add((index, "num"))
+                    found_in[index] += 1
+                    return sqlglot.exp.Literal(this=_token(index, "num"), is_string=False)
+                if node.is_string:
+                    pattern = rf"(?<![\w.]){re.escape(surface)}(?![\w.])"
+                    if re.search(pattern, text):
+                        slots.add((index, "num"))
+                        found_in[index] += 1
+                        text = re.sub(pattern, _token(index, "num"), text)
+                continue
+            if not node.is_string:
+                continue
+            for form, value in (("canonical", canonical), ("surface", surface)):
+                found = text.lower().find(value.lower())
+                if found >= 0:
+                    slots.add((index, form))
+                    found_in[index] += 1
+                    text = text[:found] + _token(index, form) + text[found + len(value):]
+                    break
+        return sqlglot.exp.Literal.string(text) if node.is_string and text != node.this else node
+
+    template = parsed.transform(replace, copy=False).sql(dialect="sqlite") + ";"
+    if any(found_in[index] != 1 for index in range(len(values))):
+        return None
+    return template, sorted(slots)
+
+
+def bind(template: str, slots, values) -> str:
+    """SQL for new values of the same question shape."""
+    sql = template
+    for index, form in slots:
+        entity_type, surface, canonical = values[index]
+        value = canonical if form == "canonical" else surface
+        if form != "num":
+            value = value.replace("'", "''")
+        sql = sql.replace(_token(index, form), value)
+    return sql
+
+
+# =========================
+# CACHE
+# =========================
+def lookup_template(agent_key, module, question: str):
+    """
+    Template for the question's shape. None when the cache is off;
+    otherwise a dict with the shape/values and, if one is stored, the
+    bound SQL, its shadow verified/mismatches counts and whether it may
+    answer directly ("servable").
+    """
+    if TEMPLATE_MODE == "off":
+        return None
+    shape, values = mask_question(agent_key, module, question)
+    match = {
+        "shape": shape, "values": values, "sql": None, "servable": False,
+        "new_values": False, "verified": 0, "mismatches": 0
+    }
+
+    init_template_table()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        row = conn.execute(
+            """
+            SELECT sql_template, slots, verified, mismatches, learned_values
+            FROM question_templates WHERE agent = ? AND shape = ?
+            """,
+            (agent_key, shape)
+        ).fetchone()
+        if row is None:
+            count_event("template.miss")
+            return match
+        template, slots, verified, mismatches, learned_values = row
+        match["sql"] = bind(template, [tuple(slot) for slot in json.loads(slots)], values)
+        match["verified"], match["mismatches"] = verified, mismatches
+        # Only a run with other values than the learning question's verifies the slots
+        match["new_values"] = learned_values is not None and learned_values != _value_key(values)
+        if learned_values is None:
+            conn.execute(
+                "UPDATE question_templates SET learned_values = ? WHERE agent = ? AND shape = ?",
+                (_value_key(values), agent_key, shape)
+            )
+            conn.commit()
+        match["servable"] = TEMPLATE_MODE == "on" and verified >= TEMPLATE_MIN_VERIFIED and mismatches == 0
+        if match["servable"]:
+            conn.execute(
+                "UPDATE question_templates SET hits = hits + 1 WHERE agent = ? AND shape = ?",
+                (agent_key, shape)
+            )
+            conn.commit()
+        count_event("template.hit")
+    finally:
+        conn.close()
+    return match
+
+
+def _value_key(values) -> str:
+    return json.dumps([canonical.lower() for _, _, canonical in values])
+
+
+def has_servable_template(agent_key, module, question: str) -> bool:
+    """Whether a verified template would answer the question (no counters touched)."""
+    if TEMPLATE_MODE != "on":
+        return False
+    shape, _ = mask_question(agent_key, module, question)
+    init_template_table()
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        row = conn.execute(
+            "SELECT 1 FROM question_templates WHERE agent = ? AND shape = ? AND verified >= ? AND mismatches = 0",
+            (agent_key, shape, TEMPLATE_MIN_VERIFIED)
+        ).fetchone()
+    finally:
+        conn.close()
+    return row is not None
+
+
+def learn_template(agent_key, match, sql: str):
+    """Store the SQL that answered a question as the template for its shape."""
+    if match is None or match["sql"] is not None:
+        return
+    parameterized = parameterize(sql, match["values"])
+    if parameterized is None:
+        count_event("template.not_parameterizable")
+        return
+    template, slots = parameterized
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute(
+            """
+            INSERT OR IGNORE INTO question_templates (agent, shape, sql_template, slots, created_at, learned_values)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (agent_key, match["shape"], template, json.dumps(slots), datetime.now().isoformat(),
+             _value_key(match["values"]))
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    count_event("template.learned")
+
+
+def record_shadow_result(agent_key, match, ok: bool):
+    """
+    Count a shadow comparison of the template's rows against the full
+    pipeline's. A match only counts as verification when the question's
+    values differ from the ones the template was learned with; returns
+    whether it did.
+    """
+    if ok and not match["new_values"]:
+        count_event("template.shadow_same_values")
+        return False
+    column = "verified" if ok else "mismatches"
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute(
+            f"UPDATE question_templates SET {column} = {column} + 1 WHERE agent = ? AND shape = ?",
+            (agent_key, match["shape"])
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    count_event("template.shadow_match" if ok else "template.shadow_mismatch")
+    if not ok:
+        print(f"⚠️ Template mismatch for shape: {match['shape']}")
+    return ok
+
+
+def _canonical_row(row):
+    return tuple(round(v, 6) if isinstance(v, float) else v for v in row)
+
+
+def same_result(rows_a, rows_b) -> bool:
+    """Same rows regardless of order (column names may differ by alias)."""
+    return Counter(map(_canonical_row, rows_a)) == Counter(map(_canonical_row, rows_b))
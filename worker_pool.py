@@ -0,0 +1,136 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pipeline import execute_query, execute_multi
+from resilience import current_deadline, deadline_scope
+from profiling import current_profile, profile_scope
+
+# =========================
+# QUERY WORKER POOL
+# =========================
+# execute_query jobs run on a shared thread pool instead of the Streamlit
+# script thread. Identical questions in flight at the same time (same agent,
+# same normalized text, same language) share a single execution: the second
+# caller joins the running job and receives the same result and progress.
+# Decomposed multi-intent questions are keyed under the "multi" agent.
+# A job runs under the submitting question's deadline (see resilience.py)
+# and, when that question is profiled, is sampled with it (see profiling.py).
+
+POOL_WORKERS = int(os.getenv("PIPELINE_WORKERS", 8))
+
+STAGE_LABELS = {
+    "queued": "⏳ Waiting for a free worker…",
+    "template": "⚡ Reusing a known question shape…",
+    "plan": "🧭 Planning the query…",
+    "sql": "🛠️ Writing SQL…",
+    "validate": "🔎 Checking the SQL…",
+    "run": "🗄️ Running the query…",
+    "repair": "🩹 Fixing the SQL…",
+    "answer": "✍️ Writing the answer…",
+    "done": "✅ Done"
+}
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace and trailing punctuation do not change the answer."""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?.!")
+
+
+class QueryJob:
+    """One in-flight execution; shared by every caller asking the same question."""
+
+    def __init__(self, key):
+        self.key = key
+        self.future = None
+        self.events = [("queued", time.time())]
+        self.waiters = 1
+        self._lock = threading.Lock()
+
+    def report(self, stage: str):
+        with self._lock:
+            self.events.append((stage, time.time()))
+
+    @property
+    def stage(self) -> str:
+        with self._lock:
+            return self.events[-1][0]
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout=None) -> dict:
+        return self.future.result(timeout)
+
+
+class QueryPool:
+    def __init__(self, workers: int = POOL_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query")
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, agent_key, question, lang="English", decomposition=None) -> QueryJob:
+        """
+        Start a job, or join the identical one already running.
+        With a decomposition (see decomposer.py) agent_key is ignored and the
+        sub-questions are fanned out across agents.
+        """
+        if decomposition is not None:
+            agent_key = "multi"
+        key = (agent_key, normalize_question(question), lang)
+        with self._lock:
+            job = self._inflight.get(key)
+            if job is not None:
+                job.waiters += 1
+                print(f"🔁 Joined in-flight query ({job.waiters} waiting): {key[1]}")
+                return job
+
+            job = QueryJob(key)
+            self._inflight[key] = job
+            job.future = self._executor.submit(
+                self._run, job, agent_key, question, lang, decomposition, current_deadline(), current_profile()
+            )
+        return job
+
+    def _run(self, job, agent_key, question, lang, decomposition=None, deadline=None, profile=None):
+        try:
+            with deadline_scope(deadline), profile_scope(profile):
+                if decomposition is not None:
+                    return execute_multi(question, decomposition, lang, progress=job.report)
+                return execute_query(agent_key, question, lang, progress=job.report)
+        finally:
+            job.report("done")
+            with self._lock:
+                self._inflight.pop(job.key, None)
+
+    def inflight(self) -> int:
+        with self._lock:
+            return len(self._inflight)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> QueryPool:
+    """Process-wide pool shared by all sessions."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = QueryPool()
+        return _pool
+
+
+def wait_for(job: QueryJob, on_stage=None, poll_seconds: float = 0.2) -> dict:
+    """Block until the job finishes, calling on_stage(stage) whenever it changes."""
+    seen = None
+    while not job.done():
+        stage = job.stage
+        if stage != seen and on_stage:
+            on_stage(stage)
+        seen = stage
+        time.sleep(poll_seconds)
+    return job.result()